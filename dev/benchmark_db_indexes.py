@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+
+# This script is supposed to be run in the ./dev directory as
+#  ./benchmark_db_indexes.py [ITEMS]
+# It creates a synthetic database with the same schema as Outspline's, times
+#  the lookup queries that filter on non-primary-key columns, then creates the
+#  indexes added by the core 5, links 2 and organism_alarms 2 upgrades and
+#  times the same queries again
+
+import sys
+import os
+import imp
+import random
+import sqlite3
+import tempfile
+import timeit
+
+ROOT_DIR = '..'
+BASE_DIR = os.path.join(ROOT_DIR, 'src', 'outspline')
+
+core_queries = imp.load_source('core_queries',
+                                os.path.join(BASE_DIR, 'core', 'queries.py'))
+links_queries = imp.load_source('links_queries',
+                os.path.join(BASE_DIR, 'extensions', 'links', 'queries.py'))
+alarms_queries = imp.load_source('alarms_queries', os.path.join(BASE_DIR,
+                            'extensions', 'organism_alarms', 'queries.py'))
+
+ITEMS = 100000
+HISTORY_GROUP_SIZE = 10
+LINKS = ITEMS // 20
+ALARMS = ITEMS // 20
+REPEAT = 2000
+
+INDEXES = (
+    core_queries.items_create_index_parent,
+    core_queries.history_create_index_group,
+    core_queries.history_create_index_status,
+    core_queries.history_create_index_tstamp,
+    links_queries.links_create_index_id,
+    links_queries.links_create_index_target,
+    alarms_queries.alarms_create_index_item,
+)
+
+
+def populate(cursor, nitems):
+    cursor.execute(core_queries.items_create)
+    cursor.execute(core_queries.history_create)
+    cursor.execute(links_queries.links_create)
+    cursor.execute(alarms_queries.alarms_create)
+
+    last_children = {0: 0}
+    items = []
+
+    for id_ in range(1, nitems + 1):
+        parent = random.choice((0, random.randint(0, id_ - 1)))
+        previous = last_children.get(parent, 0)
+        last_children[parent] = id_
+        last_children.setdefault(id_, 0)
+        items.append((id_, parent, previous, 'Item {}'.format(id_)))
+
+    cursor.executemany(core_queries.items_insert, items)
+
+    history = []
+
+    for id_ in range(1, nitems + 1):
+        history.append((id_ // HISTORY_GROUP_SIZE + 1, id_, 'insert',
+                                            'Insert item', '[0,0,""]', None))
+
+    cursor.executemany(core_queries.history_insert, history)
+    # Leave the most recent groups in the "undone" state, like after a few
+    #  undos
+    cursor.execute('UPDATE History SET H_status=5 WHERE H_group<?',
+                                    (nitems // HISTORY_GROUP_SIZE - 10, ))
+    cursor.execute('UPDATE History SET H_status=0 WHERE H_group>?',
+                                    (nitems // HISTORY_GROUP_SIZE - 5, ))
+
+    cursor.executemany(links_queries.links_insert, [(random.randint(1,
+                nitems), random.randint(1, nitems)) for i in range(LINKS)])
+
+    cursor.executemany(alarms_queries.alarms_insert, [(random.randint(1,
+                nitems), 0, None, 0, None) for i in range(ALARMS)])
+
+
+def make_operations(nitems):
+    ngroups = nitems // HISTORY_GROUP_SIZE
+
+    def randitem():
+        return random.randint(1, nitems)
+
+    def randgroup():
+        return random.randint(1, ngroups)
+
+    return (
+        ('items_select_parent_text', core_queries.items_select_parent_text,
+                                        lambda: (randitem(), randitem())),
+        ('history_select_group_undo', core_queries.history_select_group_undo,
+                                        lambda: (randgroup(), )),
+        ('history_select_group_redo', core_queries.history_select_group_redo,
+                                        lambda: (randgroup(), )),
+        ('history_select_status_undo',
+                                core_queries.history_select_status_undo, None),
+        ('history_select_status_redo',
+                                core_queries.history_select_status_redo, None),
+        ('history_select_groups', core_queries.history_select_groups, None),
+        ('history_delete_group', core_queries.history_delete_group,
+                                        lambda: (1, )),
+        ('links_select_id', links_queries.links_select_id,
+                                        lambda: (randitem(), )),
+        ('links_select_target', links_queries.links_select_target,
+                                        lambda: (randitem(), )),
+        ('alarms_select_item', alarms_queries.alarms_select_item,
+                                        lambda: (randitem(), )),
+    )
+
+
+def time_operations(cursor, operations):
+    results = {}
+
+    for name, query, params in operations:
+        # Slow full table scans can take a long time, so adapt the number of
+        #  repetitions to the first measure
+        first = timeit.default_timer()
+        cursor.execute(query, params() if params else ()).fetchall()
+        first = timeit.default_timer() - first
+        repeat = max(min(int(0.5 / max(first, 1e-6)), REPEAT), 5)
+
+        start = timeit.default_timer()
+
+        for i in range(repeat):
+            cursor.execute(query, params() if params else ()).fetchall()
+
+        results[name] = (timeit.default_timer() - start) / repeat
+
+    return results
+
+
+def main():
+    nitems = int(sys.argv[1]) if len(sys.argv) > 1 else ITEMS
+    random.seed(0)
+
+    handle, filename = tempfile.mkstemp(suffix='.osl')
+    os.close(handle)
+
+    try:
+        connection = sqlite3.connect(filename)
+        cursor = connection.cursor()
+
+        print("Populating a synthetic database with {} items...".format(
+                                                                    nitems))
+        populate(cursor, nitems)
+        connection.commit()
+
+        operations = make_operations(nitems)
+
+        print("Timing queries without indexes...")
+        before = time_operations(cursor, operations)
+
+        for query in INDEXES:
+            cursor.execute(query)
+
+        cursor.execute('ANALYZE')
+        connection.commit()
+
+        print("Timing queries with indexes...")
+        after = time_operations(cursor, operations)
+
+        connection.close()
+    finally:
+        os.remove(filename)
+
+    print("\n{:<28} {:>14} {:>14} {:>10}".format("Query", "Before (us)",
+                                                    "After (us)", "Speedup"))
+
+    for name, query, params in operations:
+        print("{:<28} {:>14.1f} {:>14.1f} {:>9.1f}x".format(name,
+                        before[name] * 1e6, after[name] * 1e6,
+                        before[name] / after[name]))
+
+if __name__ == '__main__':
+    main()
@@ -23,7 +23,8 @@ data = (
         ("enabled", "on"),
         ("debug_mode", "off"),
         ("refresh_delay", "25"),
-        ("maximum_items", "300"),
+        ("maximum_items", "20000"),
+        ("maximum_cached_items", "100000"),
         ("first_weekday", "0"),
         ("show_navigator", "yes"),
         ("navigator_buttons", "previous,next,reset,set,apply"),
@@ -125,7 +125,8 @@ class MemoryDB(DBQueue):
 
 
 class FileDB(object):
-    def __init__(self, filename, check_same_thread=False, name_based=False):
+    def __init__(self, filename, check_same_thread=False, name_based=False,
+                                                        search_index=False):
         self.connection = sqlite3.connect(filename,
                                         check_same_thread=check_same_thread)
 
@@ -142,6 +143,13 @@ class FileDB(object):
             self.disconnect()
             raise exceptions.DatabaseNotValidError()
 
+        # The sqlite3 module commits the pending transaction before executing
+        #  a CREATE statement, so the temp tables of the full-text index must
+        #  be created now, and not when the database may have unsaved changes
+        #  or after the lock test below
+        self.search_index = search_index and self._create_search_index(
+                                                    self.connection.cursor())
+
         # If == 0 it means the database is new (just been created)
         if cursor.fetchone()[0] > 0:
             try:
@@ -154,6 +162,22 @@ class FileDB(object):
             else:
                 cursor.execute(queries.properties_delete_dummy)
 
+    @staticmethod
+    def _create_search_index(cursor):
+        try:
+            cursor.execute(queries.items_search_create)
+        except sqlite3.OperationalError:
+            # FTS5 or its trigram tokenizer (SQLite 3.34) are not available
+            log.info('Full-text search index not supported by SQLite {}'
+                                            ''.format(sqlite3.sqlite_version))
+            return False
+        else:
+            cursor.execute(queries.items_search_create_enabled)
+            cursor.execute(queries.items_search_create_trigger_insert)
+            cursor.execute(queries.items_search_create_trigger_update)
+            cursor.execute(queries.items_search_create_trigger_delete)
+            return True
+
     def cursor(self):
         return self.connection.cursor()
 
@@ -172,16 +196,24 @@ class Database(object):
     def __init__(self, filename):
         self.connection = DBQueue()
         self.filename = filename
-        self.items = {}
+        self.tree = items.Tree()
+        self.items = items.Items(self.connection, self.tree, self.filename)
         self.dbhistory = history.DBHistory(self.connection, self.items,
-                                                                self.filename)
+                                                    self.tree, self.filename)
+        self.items.dbhistory = self.dbhistory
 
         # Enable multi-threading, as the database is protected with a queue
         self.connection.put(FileDB(filename, check_same_thread=False,
-                                                            name_based=True))
+                                        name_based=True, search_index=True))
         qconn = self.connection.get()
         cursor = qconn.cursor()
 
+        # The full-text index is only filled and kept in sync after it's
+        #  first needed, see self.search_items_text; it's False if the SQLite
+        #  library does not support it
+        self.search_index = qconn.search_index
+        self.search_index_enabled = False
+
         cursor.execute(queries.properties_select_history)
         softlimit = cursor.fetchone()[0]
         config = coreaux_api.get_configuration()('History')
@@ -189,13 +221,12 @@ class Database(object):
         hardlimit = config.get_int('hard_limit')
         self.dbhistory.set_limits(softlimit, timelimit, hardlimit)
 
-        dbitems = cursor.execute(queries.items_select_tree)
+        # Load the tree directly from the cursor, without keeping all the rows
+        #  in memory at the same time
+        cursor.execute(queries.items_select_tree)
+        self.tree.load(cursor)
         self.connection.give(qconn)
 
-        for item in dbitems:
-            self.items[item['I_id']] = items.Item(self.connection,
-                    self.dbhistory, self.items, self.filename, item['I_id'])
-
     @staticmethod
     def create(filename):
         if filename in dbs:
@@ -230,7 +261,11 @@ class Database(object):
                                     int(float(outspline.info.core.version)), ))
 
                 cursor.execute(queries.items_create)
+                cursor.execute(queries.items_create_index_parent)
                 cursor.execute(queries.history_create)
+                cursor.execute(queries.history_create_index_group)
+                cursor.execute(queries.history_create_index_status)
+                cursor.execute(queries.history_create_index_tstamp)
 
                 conn.save_and_disconnect()
 
@@ -282,39 +317,77 @@ class Database(object):
 
         save_database_event.signal(filename=self.filename)
 
-    def save_copy(self, destination):
+    def save_copy(self, destination, progress=None):
         # Some addons may use this event to generate an exception
         # For consistency, signal 'self.filename' and not 'destination'
         save_permission_check_event.signal(filename=self.filename)
 
         # Of course the original file cannot be simply copied, in fact in that
         # case it should be saved first, and that's not what is expected
+        # The sqlite3 module of Python 2 does not expose SQLite's online backup
+        # API, and ATTACH or VACUUM INTO cannot be used either, because they
+        # would commit the unsaved changes; read all the tables from the
+        # original database first, so that its connection can be given back
+        # before writing the copy, and then insert the rows with one
+        # executemany per batch
+        # progress, if given, is called as progress(copied_rows, total_rows)
+        # after every inserted batch
 
         qconn = self.connection.get()
-        qconnd = FileDB(destination)
         cursor = qconn.cursor()
-        cursord = qconnd.cursor()
+        tables = []
 
         cursor.execute(queries.master_select_tables)
 
         for row in cursor:
             tname = row["name"]
 
+            # Plain tuples are faster to retrieve than sqlite3.Row objects
+            tcursor = qconn.cursor()
+            tcursor.row_factory = None
+            tcursor.execute(queries.master_select_table.format(tname))
+            columns = [column[0] for column in tcursor.description]
+            tables.append((tname, columns, tcursor.fetchall()))
+
+        # The original database is not needed anymore
+        self.connection.give(qconn)
+
+        qconnd = FileDB(destination)
+        cursord = qconnd.cursor()
+
+        # Rebuilding the indexes of the destination once at the end is much
+        # faster than updating them for every copied row
+        cursord.execute(queries.master_select_indexes)
+        indexes = cursord.fetchall()
+
+        for name, sql in indexes:
+            cursord.execute(queries.master_drop_index.format(name))
+
+        total = sum(len(rows) for tname, columns, rows in tables)
+        copied = 0
+        # Insert the rows in batches only to be able to report the progress
+        batchsize = 10000
+
+        for tname, columns, rows in tables:
             # Some tables are initialized by self.create
             cursord.execute(queries.master_delete.format(tname))
 
-            tcursor = qconn.cursor()
-            tcursor.execute(queries.master_select_table.format(tname))
+            query = queries.master_insert.format(tname, ", ".join(columns),
+                                            ", ".join(["?", ] * len(columns)))
+
+            for index in xrange(0, len(rows), batchsize):
+                batch = rows[index:index + batchsize]
+                cursord.executemany(query, batch)
+                copied += len(batch)
 
-            for trow in tcursor:
-                cursord.execute(queries.master_insert.format(tname,
-                                    ", ".join(trow.keys()),
-                                    ", ".join(["?", ] * len(trow))), (trow))
+                if progress:
+                    progress(copied, total)
 
         cursord.execute(queries.history_update_status_new)
         cursord.execute(queries.history_update_status_old)
 
-        self.connection.give(qconn)
+        for name, sql in indexes:
+            cursord.execute(sql)
 
         qconnd.save_and_disconnect()
 
@@ -350,7 +423,7 @@ class Database(object):
         return roots
 
     def get_root_items(self):
-        return items.Item.get_children_sorted(self.filename, 0)
+        return self.tree.get_children_sorted(0)
 
     def get_all_items(self):
         qconn = self.connection.get()
@@ -362,6 +435,65 @@ class Database(object):
     def get_all_items_text(self):
         return self.get_all_items().fetchall()
 
+    def search_items_text(self, strings, start=0, limit=-1):
+        # Return the I_id and I_text rows of the items whose text may contain
+        #  all the strings, ignoring the case; the caller must still check
+        #  the texts, since all the items are returned if the full-text index
+        #  is not available or the strings are shorter than 3 characters
+        # The rows are sorted by id, and only the first limit rows with an id
+        #  greater than start are returned, so that the items can be searched
+        #  in chunks; a negative limit means no limit
+        strings = [string for string in strings if len(string) > 2]
+
+        qconn = self.connection.get()
+        cursor = qconn.cursor()
+
+        if not strings or not self.search_index:
+            cursor.execute(queries.items_select_search_range, (start, limit))
+        else:
+            if not self.search_index_enabled:
+                # From now on the index is kept in sync by the triggers
+                cursor.execute(queries.items_search_insert_enabled)
+                cursor.execute(queries.items_search_insert_all)
+                self.search_index_enabled = True
+
+            query = u' AND '.join(u'"{}"'.format(string.replace('"', '""'))
+                                                        for string in strings)
+            cursor.execute(queries.items_search_select, (start, query, limit))
+
+        rows = cursor.fetchall()
+        self.connection.give(qconn)
+
+        return rows
+
+    def get_items_text(self, ids):
+        return {row['I_id']: row['I_text'] for row in
+                        self.select_ids(queries.items_select_ids_text, ids)}
+
+    def get_items_heading(self, ids):
+        # Return the first line of the texts, and whether they have more, so
+        #  that the long texts don't have to be read entirely
+        return {row['I_id']: (row['I_heading'], bool(row['I_multiline']))
+                                    for row in self.select_ids(
+                                    queries.items_select_ids_heading, ids)}
+
+    def select_ids(self, query, ids):
+        # The placeholders for the ids must be formatted into the query
+        ids = list(ids)
+        rows = []
+        qconn = self.connection.get()
+        cursor = qconn.cursor()
+
+        # Select the ids in chunks, in order to stay below SQLite's default
+        # limit of 999 parameters per query
+        for index in xrange(0, len(ids), 500):
+            chunk = ids[index:index + 500]
+            cursor.execute(query.format(', '.join('?' * len(chunk))), chunk)
+            rows.extend(cursor.fetchall())
+
+        self.connection.give(qconn)
+        return rows
+
     def add_ignored_dependency(self, extension):
         qconn = self.connection.get()
         cur = qconn.cursor()
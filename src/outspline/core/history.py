@@ -17,17 +17,21 @@
 # along with Outspline.  If not, see <http://www.gnu.org/licenses/>.
 
 import json
+import time as time_
+import itertools
+import zlib
+import difflib
 
 from outspline.coreaux_api import Event
 
 import queries
 import databases
-import items
 import exceptions
 
 check_pending_changes_event = Event()
 reset_modified_state_event = Event()
 history_event = Event()
+history_group_event = Event()
 history_insert_event = Event()
 history_update_previous_event = Event()
 history_update_parent_event = Event()
@@ -35,38 +39,175 @@ history_update_text_event = Event()
 history_delete_event = Event()
 history_clean_event = Event()
 
+# Texts shorter than this (old and new together) are stored in the history as
+#  they are, since a delta would not save any space
+TEXT_PAYLOAD_THRESHOLD = 512
+# Above this length the changed part of a text is not diffed line by line, and
+#  is replaced as a whole instead
+TEXT_PAYLOAD_DIFF_LIMIT = 100000
+
+
+def make_text_payloads(text, oldtext):
+    # Return the (redo, undo) history payloads of a text update
+    # Long texts are stored as binary blobs holding either a compressed delta
+    #  that transforms the current text of the item into the target one, or,
+    #  when that would not be smaller, the compressed target text; short texts
+    #  are stored plainly, like the rows of older databases, and
+    #  read_text_payload tells the two formats apart by their type
+    if len(text) + len(oldtext) < TEXT_PAYLOAD_THRESHOLD:
+        return (text, oldtext)
+
+    redo = []
+    undo = []
+
+    for i1, i2, j1, j2 in _diff_texts(oldtext, text):
+        redo.append((i1, i2, text[j1:j2]))
+        undo.append((j1, j2, oldtext[i1:i2]))
+
+    return (_encode_text_payload(text, redo),
+                                        _encode_text_payload(oldtext, undo))
+
+
+def read_text_payload(payload, current):
+    # Return the text stored by a history payload; current is the text of the
+    #  item at the moment the payload is applied, which delta payloads are
+    #  relative to
+    if not isinstance(payload, buffer):
+        return payload
+
+    data = zlib.decompress(payload[1:]).decode('utf-8')
+
+    if payload[0] == 'z':
+        return data
+
+    pieces = []
+    end = 0
+
+    for start, stop, replacement in json.loads(data):
+        pieces.append(current[end:start])
+        pieces.append(replacement)
+        end = stop
+
+    pieces.append(current[end:])
+
+    return u''.join(pieces)
+
+
+def _encode_text_payload(text, delta):
+    jdelta = zlib.compress(json.dumps(delta,
+                                    separators=(',', ':')).encode('utf-8'))
+    ztext = zlib.compress(text.encode('utf-8'))
+
+    if len(jdelta) < len(ztext):
+        return buffer('d' + jdelta)
+    else:
+        return buffer('z' + ztext)
+
+
+def _diff_texts(old, new):
+    # Return the (i1, i2, j1, j2) tuples of the changes, meaning that
+    #  old[i1:i2] is replaced by new[j1:j2], in ascending order
+    maxprefix = min(len(old), len(new))
+    prefix = 0
+
+    while prefix < maxprefix and old[prefix] == new[prefix]:
+        prefix += 1
+
+    maxsuffix = maxprefix - prefix
+    suffix = 0
+
+    while suffix < maxsuffix and old[-suffix - 1] == new[-suffix - 1]:
+        suffix += 1
+
+    oldend = len(old) - suffix
+    newend = len(new) - suffix
+
+    if oldend - prefix + newend - prefix > TEXT_PAYLOAD_DIFF_LIMIT or \
+                                    prefix == oldend or prefix == newend:
+        if prefix < oldend or prefix < newend:
+            return ((prefix, oldend, prefix, newend), )
+        else:
+            return ()
+
+    # Diff the changed part by lines, which is fast also on long texts, and
+    #  convert the line indices back to character offsets
+    oldlines = old[prefix:oldend].splitlines(True)
+    newlines = new[prefix:newend].splitlines(True)
+    oldoffsets = _get_line_offsets(oldlines, prefix)
+    newoffsets = _get_line_offsets(newlines, prefix)
+    matcher = difflib.SequenceMatcher(None, oldlines, newlines,
+                                                            autojunk=False)
+
+    return tuple((oldoffsets[i1], oldoffsets[i2], newoffsets[j1],
+                newoffsets[j2]) for tag, i1, i2, j1, j2
+                in matcher.get_opcodes() if tag != 'equal')
+
+
+def _get_line_offsets(lines, start):
+    offsets = [start]
+
+    for line in lines:
+        start += len(line)
+        offsets.append(start)
+
+    return offsets
+
 
 class DBHistory(object):
-    def __init__(self, connection, items, filename):
+    def __init__(self, connection, items, tree, filename):
         self.connection = connection
         self.items = items
+        self.tree = tree
         self.filename = filename
 
         self.hactions = {
             'insert': {
-                'undo': self._do_history_row_delete,
-                'redo': self._do_history_row_insert,
+                'undo': self._do_history_rows_delete,
+                'redo': self._do_history_rows_insert,
             },
             'update_previous': {
-                'undo': self._do_history_row_update_previous,
-                'redo': self._do_history_row_update_previous,
+                'undo': self._do_history_rows_update_previous,
+                'redo': self._do_history_rows_update_previous,
             },
             'update_parent': {
-                'undo': self._do_history_row_update_parent,
-                'redo': self._do_history_row_update_parent,
+                'undo': self._do_history_rows_update_parent,
+                'redo': self._do_history_rows_update_parent,
             },
             'update_text': {
-                'undo': self._do_history_row_update_text,
-                'redo': self._do_history_row_update_text,
+                'undo': self._do_history_rows_update_text,
+                'redo': self._do_history_rows_update_text,
             },
             'delete': {
-                'undo': self._do_history_row_insert,
-                'redo': self._do_history_row_delete,
+                'undo': self._do_history_rows_insert,
+                'redo': self._do_history_rows_delete,
+            },
+            'insert_subtree': {
+                'undo': self._do_history_row_delete_subtree,
+                'redo': self._do_history_row_insert_subtree,
+            },
+            'delete_subtree': {
+                'undo': self._do_history_row_insert_subtree,
+                'redo': self._do_history_row_delete_subtree,
             },
         }
 
+        # The handlers of these action types are passed all the consecutive
+        # rows of their type at once, see self._do_history
+        self.hbatchactions = set(('insert', 'update_previous', 'update_parent',
+                                                    'update_text', 'delete'))
+
+        # The changes to the items made by the history group being undone or
+        # redone, signalled all together with history_group_event
+        self.history_changes = None
+
         self.status_updates = {0: 1, 1: 0, 2: 3, 3: 2, 4: 5, 5: 4}
 
+        # The [group, timestamp] lists of the groups in the History table, in
+        # ascending order, where the timestamp is the latest of the group's
+        # actions; they are loaded when the first action is inserted, and let
+        # the history be pruned without querying the whole table
+        self.groups = None
+
     def set_limits(self, soft, time, hard):
         self.historylimits = [soft, time, hard]
 
@@ -80,12 +221,16 @@ class DBHistory(object):
 
         self.historylimits[0] = limit
 
-    def register_action_handlers(self, name, redo_handler, undo_handler):
+    def register_action_handlers(self, name, redo_handler, undo_handler,
+                                                                batch=False):
         if name not in self.hactions:
             self.hactions[name] = {
                 'undo': undo_handler,
                 'redo': redo_handler,
             }
+
+            if batch:
+                self.hbatchactions.add(name)
         else:
             raise exceptions.ConflictingActionHandlersError()
 
@@ -95,9 +240,61 @@ class DBHistory(object):
         cur = qconn.cursor()
         cur.execute(queries.history_insert, (group, id_, type_, description,
                                                     query_redo, query_undo))
-        cur.execute(queries.history_delete_union, self.historylimits)
+        self._prune_history(cur, group)
         self.connection.give(qconn)
 
+    def insert_history_many(self, group, type_, description, records):
+        # records is an iterable of (id_, query_redo, query_undo) tuples
+        qconn = self.connection.get()
+        cur = qconn.cursor()
+        cur.executemany(queries.history_insert, ((group, id_, type_,
+                                            description, redo, undo)
+                                            for id_, redo, undo in records))
+        self._prune_history(cur, group)
+        self.connection.give(qconn)
+
+    def _prune_history(self, cursor, group):
+        now = int(time_.time())
+
+        if self.groups is None:
+            # The loaded groups already include the new one
+            cursor.execute(queries.history_select_groups)
+            self.groups = [[row['H_group'], row['H_tstamp']] for row in cursor]
+            self._prune_history_groups(cursor, now)
+        elif self.groups and self.groups[-1][0] >= group:
+            # The history is pruned only once per group, when its first action
+            # is inserted
+            if self.groups[-1][0] == group:
+                self.groups[-1][1] = now
+        else:
+            self.groups.append([group, now])
+            self._prune_history_groups(cursor, now)
+
+    def _prune_history_groups(self, cursor, now):
+        soft, timelimit, hard = self.historylimits
+
+        # Keep the 'soft' most recent groups, and also the 'hard' most recent
+        # groups with actions inserted in the last 'timelimit' minutes; groups
+        # have to be kept intact
+        first = max(len(self.groups) - soft, 0)
+        threshold = now - timelimit * 60
+        count = 0
+
+        for index in xrange(len(self.groups) - 1, -1, -1):
+            if count >= hard:
+                break
+
+            if self.groups[index][1] >= threshold:
+                first = min(first, index)
+                count += 1
+
+        # If no group has to be kept, do not delete anything, like the old
+        # pruning query did
+        if 0 < first < len(self.groups):
+            cursor.execute(queries.history_delete_group,
+                                                    (self.groups[first][0], ))
+            del self.groups[:first]
+
     def get_next_history_group(self):
         qconn = self.connection.get()
         cursor = qconn.cursor()
@@ -106,6 +303,12 @@ class DBHistory(object):
         self.connection.give(qconn)
 
         row = cursor.fetchone()
+
+        if self.groups is not None:
+            # The groups that could be redone have just been deleted
+            while self.groups and self.groups[-1][0] > (row['H_group'] or 0):
+                self.groups.pop()
+
         if row['H_group']:
             group = row['H_group'] + 1
         else:
@@ -122,11 +325,12 @@ class DBHistory(object):
 
         return cursor
 
-    def _update_history_id(self, id_, status):
+    def _update_history_group(self, group, status):
         newstatus = self.status_updates[status]
         qconn = self.connection.get()
         cursor = qconn.cursor()
-        cursor.execute(queries.history_update_id, (newstatus, id_))
+        cursor.execute(queries.history_update_group_status, (newstatus,
+                                                                    group))
         self.connection.give(qconn)
 
     def check_pending_changes(self):
@@ -216,10 +420,29 @@ class DBHistory(object):
                                                     (lastgroup['H_group'], )))
             self.connection.give(qconn)
             return {'history': history,
+                    'group': lastgroup['H_group'],
                     'status': lastgroup['H_status']}
         else:
             return False
 
+    @staticmethod
+    def get_history_items(history, action):
+        items = set()
+
+        for row in history:
+            items.add(row['H_item'])
+
+            # Subtree records affect also the descendants of H_item; their
+            #  queries store either the whole rows or only the ids
+            if row['H_type'] in ('insert_subtree', 'delete_subtree'):
+                for record in json.loads(row[3]):
+                    if isinstance(record, list):
+                        items.add(record[0])
+                    else:
+                        items.add(record)
+
+        return items
+
     def undo_history(self):
         self._do_history(self.read_history_undo(), 'undo')
 
@@ -229,78 +452,171 @@ class DBHistory(object):
     def _do_history(self, read, action):
         if read:
             history = read['history']
-            status = read['status']
-
-            for row in history:
-                self.hactions[row['H_type']][action](self.filename, action,
-                            row[3], row['H_id'], row['H_type'], row['H_item'])
-                self._update_history_id(row['H_id'], status)
-
+            self.history_changes = {'inserted': {},
+                                    'deleted': {},
+                                    'moved': set(),
+                                    'updated_text': {}}
+
+            # Process the consecutive rows of the same type together, so that
+            # the handlers that support it can apply them all at once, while
+            # preserving the order of the actions
+            for type_, rows in itertools.groupby(history,
+                                                key=lambda row: row['H_type']):
+                handler = self.hactions[type_][action]
+
+                if type_ in self.hbatchactions:
+                    handler(self.filename, action, tuple(rows))
+                else:
+                    for row in rows:
+                        handler(self.filename, action, row[3], row['H_id'],
+                                                        type_, row['H_item'])
+
+            # All the actions of a group always share the same status
+            self._update_history_group(read['group'], read['status'])
+
+            changes = self.history_changes
+            self.history_changes = None
+
+            history_group_event.signal(filename=self.filename, action=action,
+                                                            changes=changes)
             history_event.signal(filename=self.filename)
 
-    def _do_history_row_insert(self, filename, action, jparams, hid, type_,
-                                                                    itemid):
-        parent, previous, text = json.loads(jparams)
+    def _do_history_rows_insert(self, filename, action, rows):
+        records = []
+
+        for row in rows:
+            parent, previous, text = json.loads(row[3])
+            records.append((row['H_item'], parent, previous, text))
 
         qconn = self.connection.get()
         cursor = qconn.cursor()
-        cursor.execute(queries.items_insert, (itemid, parent, previous, text))
+        cursor.executemany(queries.items_insert, records)
         self.connection.give(qconn)
 
-        self.items[itemid] = items.Item(self.connection, self, self.items,
-                                                        self.filename, itemid)
+        for row, (itemid, parent, previous, text) in itertools.izip(rows,
+                                                                    records):
+            self.tree.insert(itemid, parent, previous)
+            self.history_changes['inserted'][itemid] = text
 
-        history_insert_event.signal(filename=self.filename, id_=itemid,
-                        parent=parent, previous=previous, text=text, hid=hid)
+            history_insert_event.signal(filename=self.filename, id_=itemid,
+                                    parent=parent, previous=previous,
+                                    text=text, hid=row['H_id'])
 
-    def _do_history_row_update_previous(self, filename, action, jparams, hid,
-                                                                type_, itemid):
-        parent, previous = json.loads(jparams)
+    def _do_history_rows_update_previous(self, filename, action, rows):
+        records = [(row['H_item'], ) + tuple(json.loads(row[3]))
+                                                            for row in rows]
 
         qconn = self.connection.get()
         cursor = qconn.cursor()
-        cursor.execute(queries.items_update_previous, (previous, itemid))
+        cursor.executemany(queries.items_update_previous, ((previous, itemid)
+                                for itemid, parent, previous in records))
         self.connection.give(qconn)
 
-        history_update_previous_event.signal(filename=self.filename,
+        for itemid, parent, previous in records:
+            self.tree.update_previous(itemid, previous)
+            self.history_changes['moved'].add(itemid)
+
+            history_update_previous_event.signal(filename=self.filename,
                                 id_=itemid, parent=parent, previous=previous)
 
-    def _do_history_row_update_parent(self, filename, action, jparams, hid,
-                                                                type_, itemid):
-        oldparent, newparent, previous = json.loads(jparams)
+    def _do_history_rows_update_parent(self, filename, action, rows):
+        records = [(row['H_item'], ) + tuple(json.loads(row[3]))
+                                                            for row in rows]
+
+        qconn = self.connection.get()
+        cursor = qconn.cursor()
+        cursor.executemany(queries.items_update_parent, ((newparent, previous,
+                                                                    itemid)
+                        for itemid, oldparent, newparent, previous in records))
+        self.connection.give(qconn)
+
+        for itemid, oldparent, newparent, previous in records:
+            self.tree.update_parent(itemid, newparent, previous)
+            self.history_changes['moved'].add(itemid)
+
+            history_update_parent_event.signal(filename=self.filename,
+                                id_=itemid, oldparent=oldparent,
+                                newparent=newparent, previous=previous)
 
+    def _do_history_rows_update_text(self, filename, action, rows):
         qconn = self.connection.get()
         cursor = qconn.cursor()
-        cursor.execute(queries.items_update_parent, (newparent, previous,
-                                                                    itemid))
+
+        # Delta payloads are relative to the current text of the item, which
+        #  may have been changed by a previous row of the same batch
+        texts = {}
+        records = []
+
+        for row in rows:
+            itemid = row['H_item']
+            payload = row[3]
+
+            if isinstance(payload, buffer) and itemid not in texts:
+                cursor.execute(queries.items_select_id_editor, (itemid, ))
+                texts[itemid] = cursor.fetchone()['I_text']
+
+            text = read_text_payload(payload, texts.get(itemid))
+            texts[itemid] = text
+            records.append((itemid, text))
+
+        cursor.executemany(queries.items_update_text, ((text, itemid)
+                                                for itemid, text in records))
         self.connection.give(qconn)
 
-        history_update_parent_event.signal(filename=self.filename, id_=itemid,
-                oldparent=oldparent, newparent=newparent, previous=previous)
+        for itemid, text in records:
+            self.history_changes['updated_text'][itemid] = text
 
-    def _do_history_row_update_text(self, filename, action, jparams, hid,
+            history_update_text_event.signal(filename=self.filename,
+                                                        id_=itemid, text=text)
+
+    def _do_history_rows_delete(self, filename, action, rows):
+        qconn = self.connection.get()
+        cursor = qconn.cursor()
+        cursor.executemany(queries.items_delete_id, ((row['H_item'], )
+                                                            for row in rows))
+        self.connection.give(qconn)
+
+        for row in rows:
+            itemid = row['H_item']
+            parent, text = json.loads(row[3])
+
+            self.items[itemid].remove()
+            self.history_changes['deleted'][itemid] = text
+
+            history_delete_event.signal(filename=self.filename, id_=itemid,
+                                    hid=row['H_id'], parent=parent, text=text)
+
+    def _do_history_row_insert_subtree(self, filename, action, jparams, hid,
                                                                 type_, itemid):
+        records = json.loads(jparams)
+
         qconn = self.connection.get()
         cursor = qconn.cursor()
-        cursor.execute(queries.items_update_text, (jparams, itemid))
+        cursor.executemany(queries.items_insert, records)
         self.connection.give(qconn)
 
-        history_update_text_event.signal(filename=self.filename, id_=itemid,
-                                                                text=jparams)
+        texts = {}
 
-    def _do_history_row_delete(self, filename, action, jparams, hid, type_,
-                                                                    itemid):
-        parent, text = json.loads(jparams)
+        for id_, parent, previous, text in records:
+            self.tree.insert(id_, parent, previous)
+            texts[id_] = text
 
+        self.history_changes['inserted'].update(texts)
+
+    def _do_history_row_delete_subtree(self, filename, action, jparams, hid,
+                                                                type_, itemid):
         qconn = self.connection.get()
         cursor = qconn.cursor()
-        cursor.execute(queries.items_delete_id, (itemid, ))
+        cursor.execute(queries.items_select_subtree, (itemid, ))
+        texts = dict((row['I_id'], row['I_text']) for row in cursor)
+        cursor.executemany(queries.items_delete_id, ((id_, )
+                                                            for id_ in texts))
         self.connection.give(qconn)
 
-        self.items[itemid].remove()
+        for id_ in texts:
+            self.items[id_].remove()
 
-        history_delete_event.signal(filename=self.filename, id_=itemid,
-                                            hid=hid, parent=parent, text=text)
+        self.history_changes['deleted'].update(texts)
 
     def clean_history(self):
         # This operation must be performed on a different connection than
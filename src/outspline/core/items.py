@@ -21,23 +21,193 @@ import json
 from outspline.coreaux_api import Event
 
 import databases
+import history
 import queries
 import exceptions
 
 item_insert_event = Event()
+subtrees_insert_event = Event()
 item_update_previous_event = Event()
 item_update_parent_event = Event()
 item_update_text_event = Event()
-item_deleting_event = Event()
-item_deleted_event = Event()
-item_deleted_2_event = Event()
+subtree_deleting_event = Event()
+subtree_deleted_event = Event()
+
+
+class Tree(object):
+    # In-memory copy of the I_parent and I_previous columns of the Items
+    #  table, so that navigating the tree does not require querying the
+    #  database
+    # It must be kept in sync by all the functions that modify those columns,
+    #  including the history action handlers
+    def __init__(self):
+        self.parents = {}
+        self.previous = {}
+        self.children = {}
+        # More than one item can share the same (parent, previous) key only
+        #  temporarily, i.e. while an action is updating the links of the
+        #  siblings one at a time, so the values are plain ids, and become sets
+        #  of ids only while shared, which saves a lot of memory
+        self.links = {}
+        # Cache of the sorted children of each parent, rebuilt lazily
+        self.sorted_children = {}
+
+    def load(self, rows):
+        for row in rows:
+            self._link(row['I_id'], row['I_parent'], row['I_previous'])
+
+    def _link(self, id_, parent, previous):
+        self.parents[id_] = parent
+        self.previous[id_] = previous
+
+        key = (parent, previous)
+        ids = self.links.get(key)
+
+        if ids is None:
+            self.links[key] = id_
+        elif isinstance(ids, set):
+            ids.add(id_)
+        else:
+            self.links[key] = set((ids, id_))
+
+        self.children.setdefault(parent, set()).add(id_)
+        self.sorted_children.pop(parent, None)
+
+    def _unlink(self, id_):
+        parent = self.parents.pop(id_)
+        previous = self.previous.pop(id_)
+
+        key = (parent, previous)
+        ids = self.links[key]
+
+        if isinstance(ids, set):
+            ids.discard(id_)
+
+            if len(ids) == 1:
+                self.links[key] = ids.pop()
+        else:
+            del self.links[key]
+
+        self.children[parent].discard(id_)
+
+        if not self.children[parent]:
+            del self.children[parent]
+
+        self.sorted_children.pop(parent, None)
+
+    def insert(self, id_, parent, previous):
+        self._link(id_, parent, previous)
+
+    def update_previous(self, id_, previous):
+        parent = self.parents[id_]
+        self._unlink(id_)
+        self._link(id_, parent, previous)
+
+    def update_parent(self, id_, parent, previous):
+        self._unlink(id_)
+        self._link(id_, parent, previous)
+
+    def remove(self, id_):
+        self._unlink(id_)
+
+    def get_parent(self, id_):
+        return self.parents[id_]
+
+    def get_previous(self, id_):
+        return self.previous[id_]
+
+    def get_next(self, id_):
+        try:
+            ids = self.links[(self.parents[id_], id_)]
+        except KeyError:
+            return None
+        else:
+            return self._get_any_id(ids)
+
+    @staticmethod
+    def _get_any_id(ids):
+        # Like the LIMIT 1 query that this replaces, in the rare case of more
+        #  than one item sharing the same key, return any of them
+        if isinstance(ids, set):
+            return next(iter(ids))
+        else:
+            return ids
+
+    def has_children(self, id_):
+        return id_ in self.children
+
+    def get_children_unsorted(self, id_):
+        return list(self.children.get(id_, ()))
+
+    def get_children_sorted(self, parent):
+        return self._get_children_sorted(parent)[:]
+
+    def get_last_child(self, parent):
+        try:
+            return self._get_children_sorted(parent)[-1]
+        except IndexError:
+            return 0
+
+    def _get_children_sorted(self, parent):
+        try:
+            return self.sorted_children[parent]
+        except KeyError:
+            ids = []
+            previous = 0
+
+            while True:
+                try:
+                    nexts = self.links[(parent, previous)]
+                except KeyError:
+                    break
+                else:
+                    previous = self._get_any_id(nexts)
+                    ids.append(previous)
+
+            self.sorted_children[parent] = ids
+            return ids
+
+
+class Items(object):
+    # Mapping of the ids of the items to their Item objects, which are only
+    #  created when accessed, since they are just handles; the existing ids
+    #  are the ones in the tree, so there's nothing to keep in sync here
+    def __init__(self, connection, tree, filename):
+        self.connection = connection
+        self.tree = tree
+        self.filename = filename
+        # DBHistory is instantiated after this object, see databases.Database
+        self.dbhistory = None
+
+    def __getitem__(self, id_):
+        if id_ in self.tree.parents:
+            return Item(self.connection, self.dbhistory, self, self.tree,
+                                                        self.filename, id_)
+        else:
+            raise KeyError(id_)
+
+    def __contains__(self, id_):
+        return id_ in self.tree.parents
+
+    def __iter__(self):
+        return iter(self.tree.parents)
+
+    def __len__(self):
+        return len(self.tree.parents)
+
+    def keys(self):
+        return self.tree.parents.keys()
 
 
 class Item(object):
-    def __init__(self, connection, dbhistory, items, filename, id_):
+    __slots__ = ('connection', 'dbhistory', 'items', 'tree', 'filename',
+                                                                        'id_')
+
+    def __init__(self, connection, dbhistory, items, tree, filename, id_):
         self.connection = connection
         self.dbhistory = dbhistory
         self.items = items
+        self.tree = tree
         self.filename = filename
         self.id_ = id_
 
@@ -69,9 +239,7 @@ class Item(object):
                     json.dumps((parent, previous, text), separators=(',',':')),
                     json.dumps((parent, text), separators=(',',':')))
 
-        db = databases.dbs[filename]
-        databases.dbs[filename].items[id_] = cls(db.connection, db.dbhistory,
-                                                    db.items, filename, id_)
+        databases.dbs[filename].tree.insert(id_, parent, previous)
 
         if updnext:
             items[updnext.get_id()].update_previous(id_, group,
@@ -83,19 +251,98 @@ class Item(object):
 
         return id_
 
+    @classmethod
+    def insert_subtrees(cls, filename, parent, previous, records, group,
+                                                description='Insert items'):
+        # records is a sequence of (key, parentkey, text) tuples, where keys
+        #  are arbitrary ids chosen by the caller; parentkey must be None for
+        #  the roots of the subtrees, which are inserted one after the other
+        #  after previous, and must refer to an earlier record otherwise
+        if not records:
+            return {}
+
+        db = databases.dbs[filename]
+
+        # Set updnext *before* inserting the new items in the database
+        try:
+            updnext = db.items[previous]._get_next()
+        except KeyError:
+            # previous may be 0
+            updnext = False
+
+        qconn = db.connection.get()
+        cursor = qconn.cursor()
+
+        cursor.execute(queries.items_select_max_id)
+        # Assigning the ids here is equivalent to letting SQLite choose them,
+        #  since I_id is not AUTOINCREMENT
+        id_ = cursor.fetchone()['I_max_id'] or 0
+
+        ids = {}
+        roots = []
+        rootof = {}
+        subtrees = {}
+        # The last inserted child of each parent
+        lasts = {parent: previous}
+
+        for key, parentkey, text in records:
+            id_ += 1
+            ids[key] = id_
+
+            if parentkey is None:
+                iparent = parent
+                rootof[id_] = id_
+                roots.append(id_)
+            else:
+                iparent = ids[parentkey]
+                rootof[id_] = rootof[iparent]
+
+            subtrees.setdefault(rootof[id_], []).append((id_, iparent,
+                                                lasts.get(iparent, 0), text))
+            lasts[iparent] = id_
+
+        rows = [row for root in roots for row in subtrees[root]]
+        cursor.executemany(queries.items_insert, rows)
+
+        db.connection.give(qconn)
+
+        # Store a single history record for each subtree: the redo query
+        #  stores the whole rows, the undo query only needs the ids
+        db.dbhistory.insert_history_many(group, 'insert_subtree', description,
+                    ((root, json.dumps(subtrees[root], separators=(',',':')),
+                    json.dumps([row[0] for row in subtrees[root]],
+                    separators=(',',':'))) for root in roots))
+
+        texts = {}
+
+        for id_, iparent, iprevious, text in rows:
+            db.tree.insert(id_, iparent, iprevious)
+            texts[id_] = text
+
+        if updnext and roots:
+            updnext.update_previous(roots[-1], group,
+                                                    description=description)
+
+        # Signal the event *after* updating the next item
+        subtrees_insert_event.signal(filename=filename, parent=parent,
+                                    roots=roots, texts=texts, group=group,
+                                    description=description)
+
+        return ids
+
     def update_previous(self, previous, group, description='Update item'):
+        parent = self.tree.get_parent(self.id_)
+        oldprevious = self.tree.get_previous(self.id_)
+
         qconn = self.connection.get()
         cursor = qconn.cursor()
-
-        cursor.execute(queries.items_select_parent_previous, (self.id_, ))
-        oldvalues = cursor.fetchone()
-        parent = oldvalues["I_parent"]
         cursor.execute(queries.items_update_previous, (previous, self.id_))
         self.connection.give(qconn)
 
+        self.tree.update_previous(self.id_, previous)
+
         jhparams = json.dumps((parent, previous), separators=(',',':'))
-        jhunparams = json.dumps((parent, oldvalues["I_previous"]),
-                                                        separators=(',',':'))
+        jhunparams = json.dumps((parent, oldprevious), separators=(',',':'))
         self.dbhistory.insert_history(group, self.id_, 'update_previous',
                                             description, jhparams, jhunparams)
 
@@ -105,19 +352,21 @@ class Item(object):
 
     def update_parent(self, parent, previous, group,
                                                     description='Update item'):
+        oldparent = self.tree.get_parent(self.id_)
+        oldprevious = self.tree.get_previous(self.id_)
+
         qconn = self.connection.get()
         cursor = qconn.cursor()
-
-        cursor.execute(queries.items_select_parent_previous, (self.id_, ))
-        oldvalues = cursor.fetchone()
         cursor.execute(queries.items_update_parent, (parent, previous,
                                                                     self.id_))
         self.connection.give(qconn)
 
-        jhparams = json.dumps((oldvalues["I_parent"], parent, previous),
+        self.tree.update_parent(self.id_, parent, previous)
+
+        jhparams = json.dumps((oldparent, parent, previous),
+                                                        separators=(',',':'))
+        jhunparams = json.dumps((parent, oldparent, oldprevious),
                                                         separators=(',',':'))
-        jhunparams = json.dumps((parent, oldvalues["I_parent"],
-                                oldvalues["I_previous"]), separators=(',',':'))
         self.dbhistory.insert_history(group, self.id_, 'update_parent',
                                             description, jhparams, jhunparams)
 
@@ -134,30 +383,38 @@ class Item(object):
         cursor.execute(queries.items_update_text, (text, self.id_))
         self.connection.give(qconn)
 
+        redo, undo = history.make_text_payloads(text, oldtext)
         self.dbhistory.insert_history(group, self.id_, 'update_text',
-                                                    description, text, oldtext)
+                                                    description, redo, undo)
 
         item_update_text_event.signal(filename=self.filename, id_=self.id_,
                             text=text, group=group, description=description)
 
     def delete_subtree(self, group, description='Delete subtree'):
-        for child in self._get_children_unsorted():
-            child.delete_subtree(group, description)
-
+        # Gather the whole subtree with a single query instead of walking it
+        #  item by item, so that also a big branch is deleted with only a few
+        #  statements and a single history record
         qconn = self.connection.get()
         cursor = qconn.cursor()
+        cursor.execute(queries.items_select_subtree, (self.id_, ))
+        rows = cursor.fetchall()
+        self.connection.give(qconn)
 
-        cursor.execute(queries.items_select_id, (self.id_, ))
-        res = cursor.fetchone()
-        parent = res['I_parent']
-        previous = res['I_previous']
-        text = res['I_text']
+        texts = {}
+        records = []
 
-        self.connection.give(qconn)
+        for row in rows:
+            texts[row['I_id']] = row['I_text']
+            records.append((row['I_id'], row['I_parent'], row['I_previous'],
+                                                                row['I_text']))
+
+            if row['I_id'] == self.id_:
+                parent = row['I_parent']
+                previous = row['I_previous']
 
         # This event must be signalled *before* updating the next item
-        item_deleting_event.signal(filename=self.filename, parent=parent,
-                                        id_=self.id_, text=text,
+        subtree_deleting_event.signal(filename=self.filename, id_=self.id_,
+                                        parent=parent, texts=texts,
                                         group=group, description=description)
 
         next = self._get_next()
@@ -167,31 +424,29 @@ class Item(object):
 
         qconn = self.connection.get()
         cursor = qconn.cursor()
-
-        # For the moment it's necessary to pass res['I_text'] for both the redo
-        # and undo queries, because it's needed also when a history action
-        # removes an item
-        hparams = json.dumps((parent, text), separators=(',',':'))
-        hunparams = json.dumps((parent, previous, text), separators=(',',':'))
-
-        cursor.execute(queries.items_delete_id, (self.id_, ))
-
+        cursor.executemany(queries.items_delete_id, ((id_, )
+                                                            for id_ in texts))
         self.connection.give(qconn)
 
-        self.dbhistory.insert_history(group, self.id_, 'delete',
-                                            description, hparams, hunparams)
+        # The redo query only needs the ids, which are also used to preview
+        #  the items affected by the history action; the undo query stores
+        #  the whole rows in order to restore them
+        hparams = json.dumps(list(texts), separators=(',',':'))
+        hunparams = json.dumps(records, separators=(',',':'))
 
-        self.remove()
+        self.dbhistory.insert_history(group, self.id_, 'delete_subtree',
+                                            description, hparams, hunparams)
 
-        # This event is designed to be signalled _after_ self.remove()
-        item_deleted_event.signal(filename=self.filename, id_=self.id_,
-                                         hid=cursor.lastrowid, text=text,
-                                         group=group, description=description)
+        for id_ in texts:
+            self.items[id_].remove()
 
-        item_deleted_2_event.signal(filename=self.filename, id_=self.id_)
+        # This event is designed to be signalled _after_ removing the items
+        subtree_deleted_event.signal(filename=self.filename, id_=self.id_,
+                                        texts=texts, group=group,
+                                        description=description)
 
     def remove(self):
-        del self.items[self.id_]
+        self.tree.remove(self.id_)
 
     def shift_up(self, group, description='Shift item up'):
         items = self.items
@@ -281,14 +536,11 @@ class Item(object):
         return [self.items[id_] for id_ in self.get_children()]
 
     def _get_children_unsorted(self):
-        qconn = self.connection.get()
-        cursor = qconn.cursor()
-        cursor.execute(queries.items_select_id_children, (self.id_, ))
-        self.connection.give(qconn)
-        return [self.items[row["I_id"]] for row in cursor]
+        return [self.items[id_] for id_ in
+                                self.tree.get_children_unsorted(self.id_)]
 
     def get_children(self):
-        return self.get_children_sorted(self.filename, self.id_)
+        return self.tree.get_children_sorted(self.id_)
 
     def get_all_info(self):
         qconn = self.connection.get()
@@ -328,11 +580,7 @@ class Item(object):
             return None
 
     def get_previous(self):
-        qconn = self.connection.get()
-        cursor = qconn.cursor()
-        cursor.execute(queries.items_select_id_previous, (self.id_, ))
-        self.connection.give(qconn)
-        return cursor.fetchone()['I_previous']
+        return self.tree.get_previous(self.id_)
 
     def _get_next(self):
         try:
@@ -341,16 +589,7 @@ class Item(object):
             return None
 
     def get_next(self):
-        qconn = self.connection.get()
-        cursor = qconn.cursor()
-        cursor.execute(queries.items_select_id_next, (self.id_, ))
-        self.connection.give(qconn)
-        nid = cursor.fetchone()
-
-        if nid:
-            return nid['I_id']
-        else:
-            return None
+        return self.tree.get_next(self.id_)
 
     def _get_parent(self):
         pid = self.get_parent()
@@ -361,12 +600,7 @@ class Item(object):
             return None
 
     def get_parent(self):
-        qconn = self.connection.get()
-        cursor = qconn.cursor()
-        cursor.execute(queries.items_select_id_parent, (self.id_, ))
-        self.connection.give(qconn)
-        pid = cursor.fetchone()
-        return pid['I_parent']
+        return self.tree.get_parent(self.id_)
 
     def get_text(self):
         qconn = self.connection.get()
@@ -377,55 +611,18 @@ class Item(object):
         return text
 
     def has_children(self):
-        qconn = self.connection.get()
-        cursor = qconn.cursor()
-        cursor.execute(queries.items_select_id_haschildren, (self.id_, ))
-        self.connection.give(qconn)
-
-        if cursor.fetchone():
-            return True
-        else:
-            return False
+        return self.tree.has_children(self.id_)
 
     def is_root(self):
-        qconn = self.connection.get()
-        cursor = qconn.cursor()
-        cursor.execute(queries.items_select_id_parent, (self.id_, ))
-        self.connection.give(qconn)
-
-        if cursor.fetchone()["I_parent"] == 0:
+        if self.tree.get_parent(self.id_) == 0:
             return True
         else:
             return False
 
-    @classmethod
-    def get_last_child(cls, filename, id_):
-        ids = cls.get_children_sorted(filename, id_)
-
-        try:
-            return ids[-1]
-        except IndexError:
-            return 0
+    @staticmethod
+    def get_last_child(filename, id_):
+        return databases.dbs[filename].tree.get_last_child(id_)
 
     @staticmethod
     def get_children_sorted(filename, parent):
-        qconn = databases.dbs[filename].connection.get()
-        cursor = qconn.cursor()
-        cursor.execute(queries.items_select_parent, (parent, 0))
-        row = cursor.fetchone()
-        ids = []
-
-        if row:
-            ids.append(row["I_id"])
-
-            while True:
-                cursor.execute(queries.items_select_id_next, (ids[-1], ))
-                row = cursor.fetchone()
-
-                if row:
-                    ids.append(row["I_id"])
-                else:
-                    break
-
-        databases.dbs[filename].connection.give(qconn)
-        return ids
+        return databases.dbs[filename].tree.get_children_sorted(parent)
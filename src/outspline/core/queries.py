@@ -26,6 +26,12 @@ master_insert = "INSERT INTO {} ({}) VALUES ({})"
 
 master_delete = "DELETE FROM {}"
 
+# The automatic indexes of the primary keys and unique constraints have no sql
+master_select_indexes = ("SELECT name, sql FROM sqlite_master "
+                                    "WHERE type='index' AND sql IS NOT NULL")
+
+master_drop_index = "DROP INDEX {}"
+
 properties_create = ('CREATE TABLE Properties (P_id INTEGER PRIMARY KEY, '
                                               'P_max_history INTEGER)')
 
@@ -68,35 +74,89 @@ items_create = ("CREATE TABLE Items (I_id INTEGER PRIMARY KEY, "
                                     "I_previous INTEGER, "
                                     "I_text TEXT)")
 
-items_select_tree = 'SELECT I_id FROM Items'
+items_create_index_parent = ('CREATE INDEX Items_parent '
+                                            'ON Items (I_parent, I_previous)')
+
+items_select_tree = 'SELECT I_id, I_parent, I_previous FROM Items'
 
 items_select_id = ('SELECT I_parent, I_previous, I_text FROM Items '
                    'WHERE I_id=? LIMIT 1')
 
-items_select_id_parent = 'SELECT I_parent FROM Items WHERE I_id=? LIMIT 1'
-
-items_select_id_editor = 'SELECT I_text FROM Items WHERE I_id=? LIMIT 1'
-
-items_select_id_previous = ('SELECT I_previous FROM Items WHERE I_id=? '
-                            'LIMIT 1')
+items_select_subtree = ('WITH RECURSIVE Subtree (S_id) AS ('
+                            'SELECT ? UNION ALL '
+                            'SELECT I_id FROM Items '
+                            'JOIN Subtree ON I_parent=S_id) '
+                        'SELECT I_id, I_parent, I_previous, I_text FROM Items '
+                        'JOIN Subtree ON I_id=S_id')
 
-items_select_id_next = 'SELECT I_id FROM Items WHERE I_previous=? LIMIT 1'
+items_select_max_id = 'SELECT MAX(I_id) AS I_max_id FROM Items'
 
-items_select_id_children = 'SELECT I_id FROM Items WHERE I_parent=?'
-
-items_select_id_haschildren = 'SELECT I_id FROM Items WHERE I_parent=? LIMIT 1'
-
-items_select_parent = ('SELECT I_id FROM Items WHERE I_parent=? AND '
-                                                        'I_previous=? LIMIT 1')
-
-items_select_parent_previous = ('SELECT I_parent, I_previous FROM Items '
-                                                        'WHERE I_id=? LIMIT 1')
+items_select_id_editor = 'SELECT I_text FROM Items WHERE I_id=? LIMIT 1'
 
 items_select_parent_text = ('SELECT I_id, I_text FROM Items '
                                 'WHERE I_parent=? AND I_previous=? LIMIT 1')
 
 items_select_search = 'SELECT I_id, I_text FROM Items'
 
+items_select_search_range = ('SELECT I_id, I_text FROM Items WHERE I_id>? '
+                                                    'ORDER BY I_id LIMIT ?')
+
+# The placeholders for the ids must be formatted into this query
+items_select_ids_text = 'SELECT I_id, I_text FROM Items WHERE I_id IN ({})'
+
+# The placeholders for the ids must be formatted into this query; only the
+#  first line of the texts is returned, and I_multiline tells whether there
+#  are more
+items_select_ids_heading = ('SELECT I_id, '
+                'substr(I_text, 1, instr(I_text || char(10), char(10)) - 1) '
+                'AS I_heading, instr(I_text, char(10)) > 0 AS I_multiline '
+                'FROM Items WHERE I_id IN ({})')
+
+# The full-text index of the items' texts lives in the temp schema of the
+#  connection, so that it's never saved in the file, and it's kept in sync by
+#  temp triggers as long as ItemsSearchEnabled has a row; the trigram
+#  tokenizer makes it match any substring of at least 3 characters, ignoring
+#  the case
+items_search_create = ("CREATE VIRTUAL TABLE temp.ItemsSearch USING fts5("
+                                                    "I_text, content='', "
+                                                    "tokenize='trigram')")
+
+items_search_create_enabled = ('CREATE TEMP TABLE ItemsSearchEnabled '
+                                                    '(ISE_enabled INTEGER)')
+
+items_search_create_trigger_insert = (
+                    "CREATE TEMP TRIGGER ItemsSearch_insert "
+                    "AFTER INSERT ON main.Items "
+                    "WHEN EXISTS (SELECT * FROM ItemsSearchEnabled) BEGIN "
+                    "INSERT INTO ItemsSearch (rowid, I_text) "
+                    "VALUES (new.I_id, new.I_text); END")
+
+items_search_create_trigger_update = (
+                    "CREATE TEMP TRIGGER ItemsSearch_update "
+                    "AFTER UPDATE OF I_text ON main.Items "
+                    "WHEN EXISTS (SELECT * FROM ItemsSearchEnabled) BEGIN "
+                    "INSERT INTO ItemsSearch (ItemsSearch, rowid, I_text) "
+                    "VALUES ('delete', old.I_id, old.I_text); "
+                    "INSERT INTO ItemsSearch (rowid, I_text) "
+                    "VALUES (new.I_id, new.I_text); END")
+
+items_search_create_trigger_delete = (
+                    "CREATE TEMP TRIGGER ItemsSearch_delete "
+                    "AFTER DELETE ON main.Items "
+                    "WHEN EXISTS (SELECT * FROM ItemsSearchEnabled) BEGIN "
+                    "INSERT INTO ItemsSearch (ItemsSearch, rowid, I_text) "
+                    "VALUES ('delete', old.I_id, old.I_text); END")
+
+items_search_insert_enabled = 'INSERT INTO ItemsSearchEnabled VALUES (1)'
+
+items_search_insert_all = ('INSERT INTO ItemsSearch (rowid, I_text) '
+                                            'SELECT I_id, I_text FROM Items')
+
+items_search_select = ('SELECT I_id, I_text FROM Items WHERE I_id>? '
+                            'AND I_id IN (SELECT rowid FROM ItemsSearch '
+                            'WHERE ItemsSearch MATCH ?) '
+                            'ORDER BY I_id LIMIT ?')
+
 items_insert = ('INSERT INTO Items (I_id, I_parent, I_previous, I_text) '
                 'VALUES (?, ?, ?, ?)')
 
@@ -118,6 +178,15 @@ history_create = ("CREATE TABLE History (H_id INTEGER PRIMARY KEY, "
                                         "H_redo TEXT, "
                                         "H_undo TEXT)")
 
+history_create_index_group = ('CREATE INDEX History_group '
+                                            'ON History (H_group, H_status)')
+
+history_create_index_status = ('CREATE INDEX History_status '
+                                            'ON History (H_status, H_group)')
+
+history_create_index_tstamp = ('CREATE INDEX History_tstamp '
+                                            'ON History (H_group, H_tstamp)')
+
 # Do not change the index of H_undo [3]
 history_select_group_undo = ('SELECT H_id, H_item, H_type, H_undo '
                              'FROM History WHERE H_group=? ORDER BY H_id DESC')
@@ -140,6 +209,9 @@ history_select_status_redo = ('SELECT H_group, H_status '
                               'FROM History WHERE H_status IN (0, 2, 4) '
                               'ORDER BY H_group ASC LIMIT 1')
 
+history_select_groups = ('SELECT H_group, MAX(H_tstamp) AS H_tstamp '
+                         'FROM History GROUP BY H_group ORDER BY H_group ASC')
+
 history_select_description = ('SELECT DISTINCT H_group, H_status, H_tstamp, '
                               'H_description FROM History '
                               'ORDER BY H_group DESC, H_tstamp DESC')
@@ -154,7 +226,7 @@ history_update_status_new = ('UPDATE History SET H_status=5 '
 history_update_status_old = ('UPDATE History SET H_status=2 '
                              'WHERE H_status IN (0, 4)')
 
-history_update_id = 'UPDATE History SET H_status=? WHERE H_id=?'
+history_update_group_status = 'UPDATE History SET H_status=? WHERE H_group=?'
 
 # This won't be needed anymore when bug #13 will be implemented
 history_update_group = ('UPDATE History '
@@ -177,24 +249,6 @@ DELETE FROM History WHERE H_group < (
     )
 )''')
 
-# There can't be entries with statuses 0, 2, 4 because this query is executed
-# only when *inserting* a group in the history, and before that all 0, 2 and 4
-# actions are deleted by history_delete_status
-# Don't just use ORDER BY and OFFSET directly in the main DELETE query, because
-# groups have to be kept intact
-history_delete_union = ('''
-DELETE FROM History WHERE H_group < (
-    SELECT MIN(H_group) FROM (
-        SELECT H_group FROM (
-            SELECT DISTINCT H_group FROM History ORDER BY H_group DESC LIMIT ?
-        )
-        UNION
-        SELECT H_group FROM (
-            SELECT DISTINCT H_group FROM History
-            WHERE H_tstamp >= strftime("%s", "now") - ? * 60
-            ORDER BY H_group DESC LIMIT ?
-        )
-    )
-)''')
+history_delete_group = 'DELETE FROM History WHERE H_group<?'
 
 history_delete_purge = 'DELETE FROM History'
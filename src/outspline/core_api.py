@@ -52,8 +52,8 @@ def save_database(filename):
     return databases.dbs[filename].save()
 
 
-def save_database_copy(origin, destination):
-    return databases.dbs[origin].save_copy(destination)
+def save_database_copy(origin, destination, progress=None):
+    return databases.dbs[origin].save_copy(destination, progress)
 
 
 def close_database(filename):
@@ -101,6 +101,30 @@ def insert_item_after(filename, previous, group=None, text='New item',
             previous=previous, group=group, text=text, description=description)
 
 
+def append_subtrees(filename, parent, records, group=None,
+                                                description='Insert items'):
+    previous = items.Item.get_last_child(filename, parent)
+
+    if group == None:
+        group = databases.dbs[filename].dbhistory.get_next_history_group()
+
+    return items.Item.insert_subtrees(filename=filename, parent=parent,
+                            previous=previous, records=records, group=group,
+                            description=description)
+
+
+def insert_subtrees_after(filename, previous, records, group=None,
+                                                description='Insert items'):
+    parent = databases.dbs[filename].items[previous].get_parent()
+
+    if group == None:
+        group = databases.dbs[filename].dbhistory.get_next_history_group()
+
+    return items.Item.insert_subtrees(filename=filename, parent=parent,
+                            previous=previous, records=records, group=group,
+                            description=description)
+
+
 def move_item_up(filename, id_, description='Move item up'):
     group = databases.dbs[filename].dbhistory.get_next_history_group()
     try:
@@ -142,30 +166,47 @@ def register_history_action_handlers(filename, name, redo_handler,
                                                     redo_handler, undo_handler)
 
 
+def register_history_batch_action_handlers(filename, name, redo_handler,
+                                                                undo_handler):
+    # The handlers are passed all the consecutive history rows of their type
+    # at once, as (filename, action, rows)
+    return databases.dbs[filename].dbhistory.register_action_handlers(name,
+                                        redo_handler, undo_handler, batch=True)
+
+
 def insert_history(filename, group, id_, type, description, query_redo,
                                                                 query_undo):
     return databases.dbs[filename].dbhistory.insert_history(group, id_, type,
                                         description, query_redo, query_undo)
 
 
+def insert_history_many(filename, group, type, description, records):
+    return databases.dbs[filename].dbhistory.insert_history_many(group, type,
+                                                        description, records)
+
+
+def make_history_text_payloads(text, oldtext):
+    return history.make_text_payloads(text, oldtext)
+
+
+def read_history_text_payload(payload, current):
+    return history.read_text_payload(payload, current)
+
+
 def preview_undo_tree(filename):
-    read = databases.dbs[filename].dbhistory.read_history_undo()
+    dbhistory = databases.dbs[filename].dbhistory
+    read = dbhistory.read_history_undo()
     if read:
-        items = set()
-        for row in read['history']:
-            items.add(row['H_item'])
-        return items
+        return dbhistory.get_history_items(read['history'], 'undo')
     else:
         return False
 
 
 def preview_redo_tree(filename):
-    read = databases.dbs[filename].dbhistory.read_history_redo()
+    dbhistory = databases.dbs[filename].dbhistory
+    read = dbhistory.read_history_redo()
     if read:
-        items = set()
-        for row in read['history']:
-            items.add(row['H_item'])
-        return items
+        return dbhistory.get_history_items(read['history'], 'redo')
     else:
         return False
 
@@ -284,6 +325,23 @@ def get_all_items_text(filename):
     return databases.dbs[filename].get_all_items_text()
 
 
+def search_items_text(filename, strings, start=0, limit=-1):
+    return databases.dbs[filename].search_items_text(strings, start=start,
+                                                                limit=limit)
+
+
+def get_items_text(filename, ids):
+    return databases.dbs[filename].get_items_text(ids)
+
+
+def get_items_heading(filename, ids):
+    return databases.dbs[filename].get_items_heading(ids)
+
+
+def select_ids(filename, query, ids):
+    return databases.dbs[filename].select_ids(query, ids)
+
+
 def get_history_descriptions(filename):
     return databases.dbs[filename].dbhistory.get_history_descriptions()
 
@@ -396,6 +454,10 @@ def bind_to_history(handler, bind=True):
     return history.history_event.bind(handler, bind)
 
 
+def bind_to_history_group(handler, bind=True):
+    return history.history_group_event.bind(handler, bind)
+
+
 def bind_to_history_insert(handler, bind=True):
     return history.history_insert_event.bind(handler, bind)
 
@@ -440,6 +502,10 @@ def bind_to_insert_item(handler, bind=True):
     return items.item_insert_event.bind(handler, bind)
 
 
+def bind_to_insert_subtrees(handler, bind=True):
+    return items.subtrees_insert_event.bind(handler, bind)
+
+
 def bind_to_update_item_simple(handler, bind=True):
     return items.item_update_previous_event.bind(handler, bind)
 
@@ -452,13 +518,9 @@ def bind_to_update_item_text(handler, bind=True):
     return items.item_update_text_event.bind(handler, bind)
 
 
-def bind_to_deleting_item(handler, bind=True):
-    return items.item_deleting_event.bind(handler, bind)
-
-
-def bind_to_deleted_item(handler, bind=True):
-    return items.item_deleted_event.bind(handler, bind)
+def bind_to_deleting_subtree(handler, bind=True):
+    return items.subtree_deleting_event.bind(handler, bind)
 
 
-def bind_to_deleted_item_2(handler, bind=True):
-    return items.item_deleted_2_event.bind(handler, bind)
+def bind_to_deleted_subtree(handler, bind=True):
+    return items.subtree_deleted_event.bind(handler, bind)
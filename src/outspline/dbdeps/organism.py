@@ -46,3 +46,10 @@ def upgrade_1_to_2(cursor):
     # These queries must stay here because they must not be updated with the
     # normal queries
     pass
+
+
+def upgrade_2_to_3(cursor):
+    # Placeholder/example
+    # These queries must stay here because they must not be updated with the
+    # normal queries
+    pass
@@ -27,6 +27,7 @@ def add(cursor):
     cursor.execute(queries.alarmsproperties_create)
     cursor.execute(queries.alarmsproperties_insert_init, (LIMIT, ))
     cursor.execute(queries.alarms_create)
+    cursor.execute(queries.alarms_create_index_item)
     cursor.execute(queries.alarmsofflog_create)
 
 def remove(cursor):
@@ -44,3 +45,8 @@ def upgrade_0_to_1(cursor):
                                         ).get_int('default_log_soft_limit')
     cursor.execute('INSERT INTO AlarmsProperties (AP_id, AP_log_limit) '
                                                 'VALUES (NULL, ?)', (LIMIT, ))
+
+def upgrade_1_to_2(cursor):
+    # These queries must stay here because they must not be updated with the
+    # normal queries
+    cursor.execute('CREATE INDEX Alarms_item ON Alarms (A_item)')
@@ -25,7 +25,7 @@ from exceptions import UnsafePasteWarning
 origin_filename = None
 copy_items_event = Event()
 item_copy_event = Event()
-item_paste_event = Event()
+items_paste_event = Event()
 items_pasted_event = Event()
 paste_check_event = Event()
 
@@ -56,49 +56,50 @@ def copy_items(filename, cids):
 def paste_items(filename, baseid, mode, group, description='Paste items'):
     qmemory = core_api.get_memory_connection()
     cursor = qmemory.cursor()
-    cursor.execute(queries.copy_select_parent_roots)
-    old_roots = cursor.fetchall()
+    cursor.execute(queries.copy_select)
+    rows = cursor.fetchall()
     core_api.give_memory_connection(qmemory)
 
-    old_to_new_ids = {}
-
-    def recurse(baseid, previd):
-        cursor.execute(queries.copy_select_parent, (baseid, previd))
-        child = cursor.fetchone()
-
-        if child:
-            id_ = child['C_id']
-
-            old_to_new_ids[id_] = core_api.append_item(
-                                filename, old_to_new_ids[baseid], group=group,
-                                text=child['C_text'], description=description)
-
-            item_paste_event.signal(filename=filename, id_=old_to_new_ids[id_],
-                                    oldid=id_, group=group,
-                                    description=description)
-
-            recurse(id_, 0)
-            recurse(baseid, id_)
-
-    if mode == 'siblings':
-        old_roots.reverse()
-
-    for root in old_roots:
-        if mode == 'children':
-            old_to_new_ids[root['C_id']] = core_api.append_item(
-                                filename, baseid, group=group,
-                                text=root['C_text'], description=description)
-        elif mode == 'siblings':
-            old_to_new_ids[root['C_id']] = core_api.insert_item_after(
-                                filename, baseid, group=group,
-                                text=root['C_text'], description=description)
-
-        item_paste_event.signal(filename=filename,
-                                            id_=old_to_new_ids[root['C_id']],
-                                            oldid=root['C_id'], group=group,
-                                            description=description)
-
-        recurse(root['C_id'], 0)
+    # Rebuild the copied tree in memory instead of querying the table for
+    # each item
+    copied_ids = set(row['C_id'] for row in rows)
+    old_roots = []
+    links = {}
+
+    for row in rows:
+        if row['C_parent'] in copied_ids:
+            links[(row['C_parent'], row['C_previous'])] = row
+        else:
+            old_roots.append(row)
+
+    # Parents must come before their children, and siblings must keep their
+    # order
+    records = [(root['C_id'], None, root['C_text']) for root in old_roots]
+    parents = [root['C_id'] for root in old_roots]
+
+    for parent in parents:
+        previous = 0
+
+        while True:
+            try:
+                child = links[(parent, previous)]
+            except KeyError:
+                break
+            else:
+                previous = child['C_id']
+                records.append((previous, parent, child['C_text']))
+                parents.append(previous)
+
+    if mode == 'children':
+        old_to_new_ids = core_api.append_subtrees(filename, baseid, records,
+                                        group=group, description=description)
+    elif mode == 'siblings':
+        old_to_new_ids = core_api.insert_subtrees_after(filename, baseid,
+                                        records, group=group,
+                                        description=description)
+
+    items_paste_event.signal(filename=filename, ids=old_to_new_ids,
+                                        group=group, description=description)
 
     new_ids = old_to_new_ids.values()
     new_roots = [old_to_new_ids[root['C_id']] for root in old_roots]
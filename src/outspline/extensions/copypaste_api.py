@@ -58,8 +58,8 @@ def bind_to_copy_item(handler, bind=True):
     return copypaste.item_copy_event.bind(handler, bind)
 
 
-def bind_to_paste_item(handler, bind=True):
-    return copypaste.item_paste_event.bind(handler, bind)
+def bind_to_paste_items(handler, bind=True):
+    return copypaste.items_paste_event.bind(handler, bind)
 
 
 def bind_to_items_pasted(handler, bind=True):
@@ -82,21 +82,19 @@ def handle_update_item_text(kwargs):
                         kwargs['text'], kwargs['group'], kwargs['description'])
 
 
-def handle_delete_item(kwargs):
+def handle_deleting_subtree(kwargs):
     filename = kwargs['filename']
-    id_ = kwargs['id_']
-    group = kwargs['group']
-    description = kwargs['description']
+    texts = kwargs['texts']
 
     if filename in links.cdbs:
-        links.delete_link(filename, id_, group, description)
-        links.break_links(filename, id_, group, description)
+        links.delete_subtree_links(filename, texts, kwargs['group'],
+                                                    kwargs['description'])
 
         if copypaste_api:
             # Breaking links in the CopyLinks table will not be stored in the
             # history, so this is useful only if undoing/redoing changes will
             # warn the user and break all the copied links
-            links.break_copied_links(filename, id_)
+            links.break_subtree_copied_links(filename, texts)
 
 
 def handle_history(kwargs):
@@ -119,9 +117,9 @@ def handle_copy_item(kwargs):
     links.copy_link(kwargs['filename'], kwargs['id_'])
 
 
-def handle_paste_item(kwargs):
-    links.paste_link(kwargs['filename'], kwargs['id_'], kwargs['oldid'],
-                                        kwargs['group'], kwargs['description'])
+def handle_paste_items(kwargs):
+    links.paste_links(kwargs['filename'], kwargs['ids'], kwargs['group'],
+                                                        kwargs['description'])
 
 
 def handle_safe_paste_check(kwargs):
@@ -134,7 +132,7 @@ def main():
     core_api.bind_to_open_database_dirty(handle_open_database_dirty)
     core_api.bind_to_open_database(handle_open_database)
     core_api.bind_to_close_database(handle_close_database)
-    core_api.bind_to_deleting_item(handle_delete_item)
+    core_api.bind_to_deleting_subtree(handle_deleting_subtree)
     core_api.bind_to_history(handle_history)
 
     if coreaux_api.get_extension_configuration('links').get_bool('sync_text'):
@@ -143,5 +141,5 @@ def main():
     if copypaste_api:
         copypaste_api.bind_to_copy_items(handle_copy_items)
         copypaste_api.bind_to_copy_item(handle_copy_item)
-        copypaste_api.bind_to_paste_item(handle_paste_item)
+        copypaste_api.bind_to_paste_items(handle_paste_items)
         copypaste_api.bind_to_safe_paste_check(handle_safe_paste_check)
@@ -29,7 +29,7 @@ import exceptions
 
 upsert_link_event = Event()
 delete_link_event = Event()
-break_link_event = Event()
+delete_subtree_links_event = Event()
 history_insert_event = Event()
 history_update_event = Event()
 history_delete_event = Event()
@@ -162,58 +162,67 @@ def delete_link(filename, id_, group, description='Delete link'):
         core_api.give_connection(filename, qconn)
 
 
-def break_links(filename, id_, group, description='Break links'):
-    # Break any links that point to the item
-    # Don't just delete those links, as it would leave their associated
-    # items in an unexpected state for the user (back to normal,
-    # undistinguished items); also this further action should be handled
-    # properly by the interface somehow
-    # Don't try to delete the links and their associated items, because
-    # silently deleting items that were not selected would be confusing;
-    # furthermore, theoretically link items are allowed (at least in the
-    # back-end) to have their own children, which should be deleted too
+def delete_subtree_links(filename, texts, group,
+                                        description='Delete subtree links'):
+    # The links of the deleted items, as {id: target}
+    deleted = dict((row['L_id'], row['L_target']) for row in
+                core_api.select_ids(filename, queries.links_select_ids, texts))
+    broken = {}
+
+    for row in core_api.select_ids(filename, queries.links_select_targets,
+                                                                        texts):
+        id_ = row['L_id']
+
+        if id_ not in texts:
+            # Break any links that point to the deleted items
+            # Don't just delete those links, as it would leave their associated
+            # items in an unexpected state for the user (back to normal,
+            # undistinguished items); also this further action should be
+            # handled properly by the interface somehow
+            # Don't try to delete the links and their associated items,
+            # because silently deleting items that were not selected would be
+            # confusing; furthermore, theoretically link items are allowed (at
+            # least in the back-end) to have their own children, which should
+            # be deleted too
+            broken.setdefault(row['L_target'], set()).add(id_)
+
     qconn = core_api.get_connection(filename)
     cursor = qconn.cursor()
-    cursor.execute(queries.links_select_target, (id_, ))
-
-    ids = set()
-    rows = cursor.fetchall()
-
-    if rows:
-        for row in rows:
-            linkid = row['L_id']
-            ids.add(linkid)
-
-            do_update_link(filename, cursor, None, linkid)
+    cursor.executemany(queries.links_delete_id, ((id_, ) for id_ in deleted))
+    cursor.executemany(queries.links_update_id, ((None, id_)
+                                    for ids in broken.itervalues()
+                                    for id_ in ids))
 
-            core_api.give_connection(filename, qconn)
+    for ids in broken.itervalues():
+        for id_ in ids:
+            last_known_links[filename][id_] = None
 
-            core_api.insert_history(filename, group, linkid, 'link_update',
-                                                description, None, str(id_))
-
-            qconn = core_api.get_connection(filename)
-            cursor = qconn.cursor()
+    core_api.give_connection(filename, qconn)
 
-        core_api.give_connection(filename, qconn)
+    core_api.insert_history_many(filename, group, 'link_delete', description,
+                    ((id_, None, str(target) if target is not None else None)
+                    for id_, target in deleted.iteritems()))
+    core_api.insert_history_many(filename, group, 'link_update', description,
+                    ((id_, None, str(target))
+                    for target, ids in broken.iteritems() for id_ in ids))
 
-        break_link_event.signal(filename=filename, ids=ids, oldtarget=id_)
-    else:
-        core_api.give_connection(filename, qconn)
+    if deleted or broken:
+        delete_subtree_links_event.signal(filename=filename, deleted=deleted,
+                                                                broken=broken)
 
 
-def break_copied_links(filename, id_):
+def break_subtree_copied_links(filename, texts):
     # Breaking links in the CopyLinks table will not be stored in the history,
     # so this is useful only if undoing/redoing changes will warn the user and
     # break all the copied links
     if copypaste_api.get_copy_origin_filename() == filename:
         mconn = core_api.get_memory_connection()
         curm = mconn.cursor()
-
-        curm.execute(queries.copylinks_select_target, (id_, ))
-
-        for row in curm.fetchall():
-            curm.execute(queries.copylinks_update_id, (row['CL_id'], ))
-
+        curm.execute(queries.copylinks_select_all)
+        ids = [row['CL_id'] for row in curm.fetchall()
+                                                if row['CL_target'] in texts]
+        curm.executemany(queries.copylinks_update_id, ((id_, )
+                                                            for id_ in ids))
         core_api.give_memory_connection(mconn)
 
 
@@ -303,27 +312,31 @@ def can_paste_safely(filename, exception):
         raise exception()
 
 
-def paste_link(filename, id_, oldid, group, description):
+def paste_links(filename, ids, group, description):
     if filename in cdbs:
         mem = core_api.get_memory_connection()
         curm = mem.cursor()
-        curm.execute(queries.copylinks_select_id, (oldid, ))
+        curm.execute(queries.copylinks_select_all)
         core_api.give_memory_connection(mem)
-        row = curm.fetchone()
-
-        if row:
-            # Item is a link
-            if copypaste_api.get_copy_origin_filename() == filename:
-                # Pasting on the same database is always safe, although the
-                # link could have been broken by a deletion or a history change
-                target = row['CL_target']
-            else:
-                # If pasting on a different database, the link must be broken,
-                # in fact even if the target is pasted too there's not a simple
-                # way of retrieving its new id
-                target = None
 
-            upsert_link(filename, id_, target, group, description)
+        # Pasting on the same database is always safe, although the links
+        # could have been broken by a deletion or a history change; if pasting
+        # on a different database, the links must be broken, in fact even if
+        # the targets are pasted too there's not a simple way of retrieving
+        # their new ids
+        same = copypaste_api.get_copy_origin_filename() == filename
+
+        for row in curm.fetchall():
+            try:
+                id_ = ids[row['CL_id']]
+            except KeyError:
+                pass
+            else:
+                # Links are usually few compared to the pasted items, so keep
+                # using upsert_link, which also synchronizes the text and drops
+                # the rules
+                upsert_link(filename, id_, row['CL_target'] if same else None,
+                                                            group, description)
 
 
 def handle_history_insert(filename, action, jparams, hid, type_, itemid):
@@ -19,12 +19,22 @@
 links_create = ("CREATE TABLE Links (L_id INTEGER, "
                                        "L_target INTEGER)")
 
+links_create_index_id = 'CREATE INDEX Links_id ON Links (L_id)'
+
+links_create_index_target = 'CREATE INDEX Links_target ON Links (L_target)'
+
 links_select = 'SELECT * FROM Links'
 
 links_select_id = 'SELECT L_target FROM Links WHERE L_id=? LIMIT 1'
 
 links_select_target = 'SELECT L_id FROM Links WHERE L_target=?'
 
+# The placeholders for the ids must be formatted into these queries
+links_select_ids = 'SELECT L_id, L_target FROM Links WHERE L_id IN ({})'
+
+links_select_targets = ('SELECT L_id, L_target FROM Links '
+                                                    'WHERE L_target IN ({})')
+
 links_select_target_broken = ('SELECT L_id FROM Links WHERE L_target=NULL '
                               'LIMIT 1')
 
@@ -41,9 +51,7 @@ copylinks_create = ("CREATE TABLE CopyLinks (CL_id INTEGER, "
 
 copylinks_select = 'SELECT CL_id FROM CopyLinks LIMIT 1'
 
-copylinks_select_id = 'SELECT CL_target FROM CopyLinks WHERE CL_id=?'
-
-copylinks_select_target = 'SELECT CL_id FROM CopyLinks WHERE CL_target=?'
+copylinks_select_all = 'SELECT * FROM CopyLinks'
 
 copylinks_insert = 'INSERT INTO CopyLinks (CL_id, CL_target) VALUES (?, ?)'
 
@@ -67,8 +67,8 @@ def bind_to_delete_link(handler, bind=True):
     return links.delete_link_event.bind(handler, bind)
 
 
-def bind_to_break_link(handler, bind=True):
-    return links.break_link_event.bind(handler, bind)
+def bind_to_delete_subtree_links(handler, bind=True):
+    return links.delete_subtree_links_event.bind(handler, bind)
 
 
 def bind_to_history_insert(handler, bind=True):
@@ -42,12 +42,13 @@ class Main(object):
         core_api.bind_to_open_database(self._handle_open_database)
         core_api.bind_to_close_database(self._handle_close_database)
         core_api.bind_to_insert_item(self._handle_insert_item)
-        core_api.bind_to_deleting_item(self._handle_delete_item)
+        core_api.bind_to_insert_subtrees(self._handle_insert_subtrees)
+        core_api.bind_to_deleting_subtree(self._handle_deleting_subtree)
 
         if copypaste_api:
             copypaste_api.bind_to_copy_items(self._handle_copy_items)
             copypaste_api.bind_to_copy_item(self._handle_copy_item)
-            copypaste_api.bind_to_paste_item(self._handle_paste_item)
+            copypaste_api.bind_to_paste_items(self._handle_paste_items)
             copypaste_api.bind_to_safe_paste_check(
                                                 self._handle_safe_paste_check)
 
@@ -93,10 +94,19 @@ class Main(object):
         except KeyError:
             pass
 
-    def _handle_delete_item(self, kwargs):
+    def _handle_insert_subtrees(self, kwargs):
         try:
-            self.databases[kwargs['filename']].delete_item_rules(kwargs['id_'],
-                        kwargs['text'], kwargs['group'], kwargs['description'])
+            self.databases[kwargs['filename']].insert_subtrees_items(
+                                    kwargs['roots'], kwargs['texts'],
+                                    kwargs['group'], kwargs['description'])
+        except KeyError:
+            pass
+
+    def _handle_deleting_subtree(self, kwargs):
+        try:
+            self.databases[kwargs['filename']].delete_subtree_rules(
+                                    kwargs['id_'], kwargs['texts'],
+                                    kwargs['group'], kwargs['description'])
         except KeyError:
             pass
 
@@ -127,10 +137,10 @@ class Main(object):
         curm.execute(queries.copyrules_insert, record)
         core_api.give_memory_connection(mem)
 
-    def _handle_paste_item(self, kwargs):
+    def _handle_paste_items(self, kwargs):
         try:
-            self.databases[kwargs['filename']].paste_item_rules(kwargs['id_'],
-                    kwargs['oldid'], kwargs['group'], kwargs['description'])
+            self.databases[kwargs['filename']].paste_items_rules(kwargs['ids'],
+                                    kwargs['group'], kwargs['description'])
         except KeyError:
             pass
 
@@ -16,8 +16,17 @@
 # You should have received a copy of the GNU General Public License
 # along with Outspline.  If not, see <http://www.gnu.org/licenses/>.
 
+import sys
 import json
 import time as time_
+import itertools
+import array
+import bisect
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 from outspline.static.pyaux import timeaux
 from outspline.coreaux_api import log, Event
@@ -28,7 +37,8 @@ from exceptions import (BadOccurrenceError, BadExceptRuleError,
                                                    ConflictingRuleHandlerError)
 
 update_item_rules_conditional_event = Event()
-delete_item_rules_event = Event()
+update_valid_rules_event = Event()
+delete_subtree_rules_event = Event()
 history_insert_event = Event()
 history_update_event = Event()
 get_alarms_event = Event()
@@ -37,51 +47,160 @@ get_alarms_event = Event()
 class Database(object):
     def __init__(self, filename):
         self.filename = filename
+        # Parsed rules of the items that have any, so that the occurrence
+        #  searches do not need to query the Rules table and decode its
+        #  values every time; it must be kept in sync by all the methods that
+        #  modify the table, including the history action handlers
+        self.valid_rules = {}
 
     def post_init(self):
-        core_api.register_history_action_handlers(self.filename,
+        qconn = core_api.get_connection(self.filename)
+        cursor = qconn.cursor()
+        cursor.execute(queries.rules_select_all, (self.rules_to_string([]), ))
+        rows = cursor.fetchall()
+        core_api.give_connection(self.filename, qconn)
+
+        for row in rows:
+            self._cache_rules(row['R_id'], row['R_rules'])
+
+        core_api.register_history_batch_action_handlers(self.filename,
                                 'rules_insert', self._handle_history_insert,
                                 self._handle_history_delete)
-        core_api.register_history_action_handlers(self.filename,
+        core_api.register_history_batch_action_handlers(self.filename,
                                 'rules_update', self._handle_history_update,
                                 self._handle_history_update)
-        core_api.register_history_action_handlers(self.filename,
+        core_api.register_history_batch_action_handlers(self.filename,
                                 'rules_delete', self._handle_history_delete,
                                 self._handle_history_insert)
+        core_api.register_history_action_handlers(self.filename,
+                        'rules_insert_subtree',
+                        self._handle_history_insert_subtree,
+                        self._handle_history_delete_subtree)
+        core_api.register_history_action_handlers(self.filename,
+                        'rules_delete_subtree',
+                        self._handle_history_delete_subtree,
+                        self._handle_history_insert_subtree)
 
     # This method has to accept filename as the first argument, even though
-    # it's part of this object
-    def _handle_history_insert(self, filename, action, jparams, hid, type_,
-                                                                    itemid):
+    # it's part of this object; rows are all the consecutive history rows of
+    # this type
+    def _handle_history_insert(self, filename, action, rows):
+        records = [(row['H_item'], row[3]) for row in rows]
+
         qconn = core_api.get_connection(filename)
         cursor = qconn.cursor()
-        cursor.execute(queries.rules_insert, (itemid, jparams))
+        cursor.executemany(queries.rules_insert, records)
         core_api.give_connection(filename, qconn)
 
-        history_insert_event.signal(filename=filename, id_=itemid,
+        for itemid, jparams in records:
+            self._cache_rules(itemid, jparams)
+
+        update_valid_rules_event.signal(filename=filename,
+                                ids=[itemid for itemid, jparams in records])
+
+        for itemid, jparams in records:
+            history_insert_event.signal(filename=filename, id_=itemid,
                                         rules=self.string_to_rules(jparams))
 
     # This method has to accept filename as the first argument, even though
-    # it's part of this object
-    def _handle_history_update(self, filename, action, jparams, hid, type_,
-                                                                    itemid):
+    # it's part of this object; rows are all the consecutive history rows of
+    # this type
+    def _handle_history_update(self, filename, action, rows):
         qconn = core_api.get_connection(filename)
         cursor = qconn.cursor()
-        cursor.execute(queries.rules_update_id, (jparams, itemid))
+
+        # Delta payloads are relative to the current rules of the item, which
+        #  may have been changed by a previous row of the same batch
+        current = {}
+        records = []
+
+        for row in rows:
+            itemid = row['H_item']
+            payload = row[3]
+
+            if isinstance(payload, buffer) and itemid not in current:
+                cursor.execute(queries.rules_select_id, (itemid, ))
+                current[itemid] = cursor.fetchone()['R_rules']
+
+            jparams = core_api.read_history_text_payload(payload,
+                                                        current.get(itemid))
+            current[itemid] = jparams
+            records.append((itemid, jparams))
+
+        cursor.executemany(queries.rules_update_id, ((jparams, itemid)
+                                            for itemid, jparams in records))
         core_api.give_connection(filename, qconn)
 
-        history_update_event.signal(filename=filename, id_=itemid,
+        for itemid, jparams in records:
+            self._cache_rules(itemid, jparams)
+
+        update_valid_rules_event.signal(filename=filename,
+                                ids=[itemid for itemid, jparams in records])
+
+        for itemid, jparams in records:
+            history_update_event.signal(filename=filename, id_=itemid,
                                         rules=self.string_to_rules(jparams))
 
+    # This method has to accept filename as the first argument, even though
+    # it's part of this object; rows are all the consecutive history rows of
+    # this type
+    def _handle_history_delete(self, filename, action, rows):
+        ids = [row['H_item'] for row in rows]
+
+        qconn = core_api.get_connection(filename)
+        cursor = qconn.cursor()
+        cursor.executemany(queries.rules_delete_id, ((itemid, )
+                                                            for itemid in ids))
+        core_api.give_connection(filename, qconn)
+
+        for itemid in ids:
+            self.valid_rules.pop(itemid, None)
+
+        update_valid_rules_event.signal(filename=filename, ids=ids)
+
     # This method has to accept filename as the first argument, even though
     # it's part of this object
-    def _handle_history_delete(self, filename, action, jparams, hid, type_,
-                                                                    itemid):
+    def _handle_history_insert_subtree(self, filename, action, jparams, hid,
+                                                                type_, itemid):
+        records = json.loads(jparams)
+
         qconn = core_api.get_connection(filename)
         cursor = qconn.cursor()
-        cursor.execute(queries.rules_delete_id, (itemid, ))
+        cursor.executemany(queries.rules_insert, records)
         core_api.give_connection(filename, qconn)
 
+        norules = self.rules_to_string([])
+        ids = [id_ for id_, srules in records if srules != norules]
+
+        for id_, srules in records:
+            if srules != norules:
+                self._cache_rules(id_, srules)
+
+        update_valid_rules_event.signal(filename=filename, ids=ids)
+
+        # Only the items that actually had rules are interesting for the
+        # handlers of this event
+        for id_, srules in records:
+            if srules != norules:
+                history_insert_event.signal(filename=filename, id_=id_,
+                                            rules=self.string_to_rules(srules))
+
+    # This method has to accept filename as the first argument, even though
+    # it's part of this object
+    def _handle_history_delete_subtree(self, filename, action, jparams, hid,
+                                                                type_, itemid):
+        ids = json.loads(jparams)
+
+        qconn = core_api.get_connection(filename)
+        cursor = qconn.cursor()
+        cursor.executemany(queries.rules_delete_id, ((id_, ) for id_ in ids))
+        core_api.give_connection(filename, qconn)
+
+        for id_ in ids:
+            self.valid_rules.pop(id_, None)
+
+        update_valid_rules_event.signal(filename=filename, ids=ids)
+
     def insert_item(self, id_, group, description='Insert item'):
         srules = self.rules_to_string([])
 
@@ -93,6 +212,23 @@ class Database(object):
         core_api.insert_history(self.filename, group, id_, 'rules_insert',
                                                     description, srules, None)
 
+    def insert_subtrees_items(self, roots, texts, group,
+                                                description='Insert items'):
+        srules = self.rules_to_string([])
+        records = [(id_, srules) for id_ in texts]
+
+        qconn = core_api.get_connection(self.filename)
+        cursor = qconn.cursor()
+        cursor.executemany(queries.rules_insert, records)
+        core_api.give_connection(self.filename, qconn)
+
+        # Store a single history record for all the subtrees
+        hparams = json.dumps(records, separators=(',',':'))
+        hunparams = json.dumps(list(texts), separators=(',',':'))
+
+        core_api.insert_history(self.filename, group, roots[0],
+                'rules_insert_subtree', description, hparams, hunparams)
+
     def update_item_rules(self, id_, rules, group,
                                             description='Update item rules'):
         self._update_item_rules_no_event(id_, rules, group,
@@ -121,8 +257,12 @@ class Database(object):
 
         core_api.give_connection(self.filename, qconn)
 
+        self._cache_rules(id_, rules)
+        update_valid_rules_event.signal(filename=self.filename, ids=(id_, ))
+
+        redo, undo = core_api.make_history_text_payloads(rules, unrules)
         core_api.insert_history(self.filename, group, id_, 'rules_update',
-                                                description, rules, unrules)
+                                                    description, redo, undo)
 
     def copy_item_rules(self, id_):
         conn = core_api.get_connection(self.filename)
@@ -132,39 +272,68 @@ class Database(object):
 
         return cur.fetchone()
 
-    def paste_item_rules(self, id_, oldid, group, description):
+    def paste_items_rules(self, ids, group, description):
         mem = core_api.get_memory_connection()
         curm = mem.cursor()
-        curm.execute(queries.copyrules_select_id, (oldid, ))
+        curm.execute(queries.copyrules_select_all)
         core_api.give_memory_connection(mem)
 
+        copied = dict((row['CR_id'], row['CR_rules']) for row in curm)
+        norules = self.rules_to_string([])
+
+        # The pasted items have just been inserted without rules, so only
+        # update the ones that actually had some
+        records = [(ids[oldid], rules) for oldid, rules in copied.iteritems()
+                                    if oldid in ids and rules != norules]
+
+        if records:
+            qconn = core_api.get_connection(self.filename)
+            cursor = qconn.cursor()
+            cursor.executemany(queries.rules_update_id, ((rules, id_)
+                                                    for id_, rules in records))
+            core_api.give_connection(self.filename, qconn)
+
+            for id_, rules in records:
+                self._cache_rules(id_, rules)
+
+            update_valid_rules_event.signal(filename=self.filename,
+                                        ids=[id_ for id_, rules in records])
+
+            core_api.insert_history_many(self.filename, group, 'rules_update',
+                                    description, ((id_, rules, norules)
+                                    for id_, rules in records))
+
         # Do not signal update_item_rules_conditional_event because it's
         # handled by organism_timer.timer.NextOccurrencesEngine, and it would
         # slow down the pasting of items a lot; NextOccurrencesEngine is bound
         # anyway to copypaste_api.bind_to_items_pasted
-        self._update_item_rules_no_event(id_, curm.fetchone()['CR_rules'],
-                                                            group, description)
 
-    def delete_item_rules(self, id_, text, group,
-                                            description='Delete item rules'):
+    def delete_subtree_rules(self, id_, texts, group,
+                                        description='Delete subtree rules'):
+        records = [(row['R_id'], row['R_rules']) for row in
+                                    core_api.select_ids(self.filename,
+                                    queries.rules_select_ids, texts)]
+
         qconn = core_api.get_connection(self.filename)
         cursor = qconn.cursor()
+        cursor.executemany(queries.rules_delete_id, ((itemid, )
+                                                        for itemid in texts))
 
-        cursor.execute(queries.rules_select_id, (id_, ))
-        sel = cursor.fetchone()
+        core_api.give_connection(self.filename, qconn)
 
-        # The query should always return a result, so sel should never be None
-        current_rules = sel['R_rules']
+        for itemid in texts:
+            self.valid_rules.pop(itemid, None)
 
-        cursor.execute(queries.rules_delete_id, (id_, ))
+        update_valid_rules_event.signal(filename=self.filename, ids=texts)
 
-        core_api.give_connection(self.filename, qconn)
+        # Store a single history record for the whole subtree
+        hparams = json.dumps(list(texts), separators=(',',':'))
+        hunparams = json.dumps(records, separators=(',',':'))
 
-        core_api.insert_history(self.filename, group, id_, 'rules_delete',
-                                            description, None, current_rules)
+        core_api.insert_history(self.filename, group, id_,
+                'rules_delete_subtree', description, hparams, hunparams)
 
-        delete_item_rules_event.signal(filename=self.filename, id_=id_,
-                                                                    text=text)
+        delete_subtree_rules_event.signal(filename=self.filename, texts=texts)
 
     def get_item_rules(self, id_):
         qconn = core_api.get_connection(self.filename)
@@ -176,13 +345,22 @@ class Database(object):
         # The query should always return a result, so row should never be None
         return self.string_to_rules(row['R_rules'])
 
+    def get_valid_item_rules(self, id_):
+        # Return an empty tuple also for items that do not exist
+        return self.valid_rules.get(id_, ())
+
     def get_all_valid_item_rules(self):
-        qconn = core_api.get_connection(self.filename)
-        cursor = qconn.cursor()
-        cursor.execute(queries.rules_select_all, (self.rules_to_string([]), ))
-        core_api.give_connection(self.filename, qconn)
+        # Return a list of (id_, rules) tuples, so that it can be iterated
+        #  safely even if the cache is modified meanwhile
+        return self.valid_rules.items()
 
-        return cursor
+    def _cache_rules(self, id_, srules):
+        rules = self.string_to_rules(srules)
+
+        if rules:
+            self.valid_rules[id_] = tuple(rules)
+        else:
+            self.valid_rules.pop(id_, None)
 
     def get_all_item_rules(self):
         qconn = core_api.get_connection(self.filename)
@@ -216,20 +394,290 @@ class Rules(object):
             raise ConflictingRuleHandlerError()
 
 
+# Python 2 arrays do not have a typecode that is guaranteed to be 64-bit, so
+# fall back to lists where C longs are shorter
+if array.array('l').itemsize >= 8:
+    def _make_column(values=()):
+        return array.array('l', values)
+else:
+    _make_column = list
+
+# Missing end and alarm times are stored in the columns as _NO_TIME, which is
+# lower than any valid time, like None is in Python 2 comparisons
+_NO_TIME = -sys.maxint - 1
+
+# Creating NumPy arrays is only worth it for the items with more occurrences
+# than this
+_NUMPY_MIN_OCCURRENCES = 64
+
+
+def _view_column(column):
+    # Return a NumPy array of the column, without copying it if possible
+    if isinstance(column, array.array):
+        return numpy.frombuffer(column, dtype=numpy.int64)
+    else:
+        return numpy.array(column, dtype=numpy.int64)
+
+
+class ExceptWindows(object):
+    # The time windows of an except rule, sorted by start time along with the
+    # running maximum of their end times, so that the windows that match an
+    # occurrence can be found with binary searches instead of testing all of
+    # them
+    def __init__(self, starts, ends, inclusive):
+        self.inclusive = inclusive
+
+        if numpy:
+            starts = numpy.asarray(starts, dtype=numpy.int64)
+            order = numpy.argsort(starts, kind='mergesort')
+            self.starts = starts[order]
+            self.maxends = numpy.maximum.accumulate(numpy.asarray(ends,
+                                                    dtype=numpy.int64)[order])
+        else:
+            windows = sorted(itertools.izip(starts, ends))
+            self.starts = [start for start, end in windows]
+            self.maxends = []
+            maxend = None
+
+            for start, end in windows:
+                maxend = max((maxend, end))
+                self.maxends.append(maxend)
+
+    def match(self, start, end):
+        # Occurrences with start == window end shouldn't be excepted, as
+        # they're not considered part of the end minute
+        index = bisect.bisect_right(self.starts, start)
+
+        # A window that starts not later than the occurrence must end not
+        # earlier than it starts
+        if index and self.maxends[index - 1] >= start:
+            return True
+
+        # If inclusive, a window that starts while the occurrence is ongoing
+        # also excepts it; remember that _NO_TIME ends are lower than any
+        # start
+        return self.inclusive and end is not None and \
+                    index < len(self.starts) and self.starts[index] < end
+
+    def match_many(self, starts, ends):
+        # This is the NumPy version of self.match for arrays of start and end
+        # times; it returns a boolean mask
+        count = len(self.starts)
+
+        if not count:
+            return numpy.zeros(len(starts), dtype=bool)
+
+        indices = numpy.searchsorted(self.starts, starts, side='right')
+        previous = numpy.maximum(indices - 1, 0)
+        mask = (indices > 0) & (self.maxends[previous] >= starts)
+
+        if self.inclusive:
+            following = numpy.minimum(indices, count - 1)
+            mask |= (indices < count) & (self.starts[following] < ends)
+
+        return mask
+
+
+class _ItemColumns(object):
+    # The occurrences of an item, stored in parallel columns of start, end and
+    # alarm times instead of dictionaries; self.index maps the times of the
+    # occurrences to their positions, and is only built when needed by
+    # self.remove
+    __slots__ = ('starts', 'ends', 'alarms', 'index')
+
+    def __init__(self):
+        self.starts = _make_column()
+        self.ends = _make_column()
+        self.alarms = _make_column()
+        self.index = None
+
+    def __len__(self):
+        return len(self.starts)
+
+    def append(self, start, end, alarm):
+        self.index = None
+        self.starts.append(start)
+        self.ends.append(_NO_TIME if end is None else end)
+        self.alarms.append(_NO_TIME if alarm is None else alarm)
+
+    def extend(self, starts, ends, alarms):
+        # ends and alarms can be None if no occurrence has an end or an alarm
+        # respectively
+        if ends is None:
+            ends = itertools.repeat(_NO_TIME, len(starts))
+
+        if alarms is None:
+            alarms = itertools.repeat(_NO_TIME, len(starts))
+
+        self.index = None
+        self.starts.extend(starts)
+        self.ends.extend(ends)
+        self.alarms.extend(alarms)
+
+    def iterate(self):
+        for start, end, alarm in itertools.izip(self.starts, self.ends,
+                                                                self.alarms):
+            yield (start, None if end == _NO_TIME else end,
+                                    None if alarm == _NO_TIME else alarm)
+
+    def remove(self, start, end, alarm):
+        # Remove an occurrence with the given times, if any, replacing it with
+        # the last one, since the order of the occurrences is not relevant
+        if self.index is None:
+            self.index = {}
+
+            for position, times in enumerate(itertools.izip(self.starts,
+                                                    self.ends, self.alarms)):
+                self.index.setdefault(times, []).append(position)
+
+        try:
+            positions = self.index[(start, _NO_TIME if end is None else end,
+                                        _NO_TIME if alarm is None else alarm)]
+        except KeyError:
+            return False
+
+        position = positions.pop()
+
+        if not positions:
+            del self.index[(self.starts[position], self.ends[position],
+                                                    self.alarms[position])]
+
+        last = len(self.starts) - 1
+
+        if position != last:
+            lastpositions = self.index[(self.starts[last], self.ends[last],
+                                                        self.alarms[last])]
+            lastpositions[lastpositions.index(last)] = position
+            self.starts[position] = self.starts[last]
+            self.ends[position] = self.ends[last]
+            self.alarms[position] = self.alarms[last]
+
+        self.starts.pop()
+        self.ends.pop()
+        self.alarms.pop()
+        return True
+
+    def except_(self, windows):
+        # windows is an ExceptWindows object
+        if numpy and len(self.starts) >= _NUMPY_MIN_OCCURRENCES:
+            mask = windows.match_many(_view_column(self.starts),
+                                                    _view_column(self.ends))
+
+            if mask.any():
+                self._select(numpy.flatnonzero(~mask).tolist())
+        else:
+            keep = [index for index, (start, end) in enumerate(
+                            itertools.izip(self.starts, self.ends)) if not
+                            windows.match(start, end)]
+
+            if len(keep) < len(self.starts):
+                self._select(keep)
+
+    def _select(self, indices):
+        self.index = None
+        self.starts = _make_column([self.starts[index] for index in indices])
+        self.ends = _make_column([self.ends[index] for index in indices])
+        self.alarms = _make_column([self.alarms[index] for index in indices])
+
+    def get_min_completion_time(self):
+        # Return the minimum of the latest times of each occurrence
+        if numpy and len(self.starts) >= _NUMPY_MIN_OCCURRENCES:
+            return int(numpy.maximum(numpy.maximum(_view_column(self.starts),
+                                    _view_column(self.ends)),
+                                    _view_column(self.alarms)).min())
+        else:
+            return min(itertools.imap(max, self.starts, self.ends,
+                                                                self.alarms))
+
+    def get_time_span(self):
+        # This assumes that start <= end, and _NO_TIME ends are ignored by
+        # max; note that the columns are never empty
+        if numpy and len(self.starts) >= _NUMPY_MIN_OCCURRENCES:
+            starts = _view_column(self.starts)
+            return (int(starts.min()), int(max((starts.max(),
+                                            _view_column(self.ends).max()))))
+        else:
+            return (min(self.starts), max((max(self.starts),
+                                                        max(self.ends))))
+
+
+class Occurrence(object):
+    # A lightweight view of an occurrence, which supports the same item access
+    # as the occurrence dictionaries
+    __slots__ = ('filename', 'id_', 'start', 'end', 'alarm')
+
+    def __init__(self, filename, id_, start, end, alarm):
+        self.filename = filename
+        self.id_ = id_
+        self.start = start
+        self.end = end
+        self.alarm = alarm
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def get_dict(self):
+        return {'filename': self.filename,
+                'id_': self.id_,
+                'start': self.start,
+                'end': self.end,
+                'alarm': self.alarm}
+
+
 class OccurrencesRange(object):
     def __init__(self, mint, maxt):
         self.mint = mint
         self.maxt = maxt
+        # The occurrences found by the rules are stored in _ItemColumns
+        # objects, while self.dict_ only stores the occurrences that have been
+        # updated with the data of their alarms, see self.update
+        self.columns = {}
         self.dict_ = {}
         self.actd = {}
+        # Count the active occurrences without an alarm id by their key, see
+        # self.move_active
+        self.actkeys = {}
 
     def update(self, occ, origalarm):
-        return self._update(self.dict_, self.add_safe, self._replace, occ,
-                                                                     origalarm)
+        # occ is an alarm dictionary, which also has an 'alarmid' key
+        filename = occ['filename']
+        id_ = occ['id_']
+
+        try:
+            columns = self.columns[filename][id_]
+        except KeyError:
+            pass
+        else:
+            if columns.remove(occ['start'], occ['end'], origalarm):
+                if not columns:
+                    self._delete_columns(filename, id_)
+
+                self._add(self.dict_, occ)
+                return True
+
+        return self.add_safe(occ)
 
     def move_active(self, occ, origalarm):
-        return self._update(self.actd, self.add_active, self._move, occ,
-                                                                     origalarm)
+        # occ is an alarm dictionary, which also has an 'alarmid' key; only
+        # the active occurrences that do not have an alarm id can be equal to
+        # occ with the original alarm and without the alarm id
+        filename = occ['filename']
+        id_ = occ['id_']
+        key = (filename, id_, occ['start'], occ['end'], origalarm)
+
+        if self.actkeys.get(key):
+            self.actkeys[key] -= 1
+            oocc = occ.copy()
+            oocc['alarm'] = origalarm
+            del oocc['alarmid']
+            self.actd[filename][id_].remove(oocc)
+            self.add_active(occ)
+            return True
+        else:
+            return self.add_active(occ)
 
     def add(self, occ):
         # Make sure this occurrence is compliant with the requirements defined
@@ -240,41 +688,91 @@ class OccurrencesRange(object):
             raise BadOccurrenceError()
 
     def add_safe(self, occ):
-        # This method must accept the same arguments as self.add_active
         # Occurrences with self.mint == occ['end'] shouldn't be added, as
         # they're not considered part of the end minute
         if self.mint <= occ['start'] <= self.maxt or \
                    (occ['end'] and occ['start'] <= self.mint < occ['end']) or \
                      (occ['alarm'] and self.mint <= occ['alarm'] <= self.maxt):
-            self._add(self.dict_, occ)
+            if 'alarmid' in occ:
+                self._add(self.dict_, occ)
+            else:
+                self._get_columns(occ['filename'], occ['id_']).append(
+                                        occ['start'], occ['end'], occ['alarm'])
+
             return True
         else:
             return False
 
-    def add_active(self, occ):
-        # This method must accept the same arguments as self.add
-        return self._add(self.actd, occ)
+    def add_many(self, filename, id_, starts, ends, alarms):
+        # This is the bulk version of self.add_safe for the occurrences of a
+        # single item: starts must be a sequence of start times, while ends
+        # and alarms must be sequences of the same length, or None if no
+        # occurrence has an end or an alarm respectively
+        if numpy:
+            # Filter the occurrences with array masks
+            starts = numpy.asarray(starts)
+            mask = (self.mint <= starts) & (starts <= self.maxt)
+
+            if ends is not None:
+                ends = numpy.asarray(ends)
+                mask |= (starts <= self.mint) & (self.mint < ends)
+
+            if alarms is not None:
+                alarms = numpy.asarray(alarms)
+                mask |= (self.mint <= alarms) & (alarms <= self.maxt)
+
+            indices = numpy.flatnonzero(mask)
+
+            if len(indices):
+                # tolist converts the NumPy integers to Python integers
+                self._get_columns(filename, id_).extend(
+                        starts[indices].tolist(),
+                        None if ends is None else ends[indices].tolist(),
+                        None if alarms is None else alarms[indices].tolist())
+                return True
+            else:
+                return False
+        else:
+            if ends is None:
+                ends = itertools.repeat(None)
 
-    def _update(self, occsd, add, action, occ, origalarm):
-        filename = occ['filename']
-        id_ = occ['id_']
+            if alarms is None:
+                alarms = itertools.repeat(None)
+
+            columns = None
+
+            for start, end, alarm in itertools.izip(starts, ends, alarms):
+                if self.mint <= start <= self.maxt or (end and
+                                        start <= self.mint < end) or (alarm and
+                                        self.mint <= alarm <= self.maxt):
+                    if columns is None:
+                        columns = self._get_columns(filename, id_)
+
+                    columns.append(start, end, alarm)
 
-        oocc = occ.copy()
-        oocc['alarm'] = origalarm
-        del oocc['alarmid']
+            return columns is not None
 
+    def add_active(self, occ):
+        if 'alarmid' not in occ:
+            key = (occ['filename'], occ['id_'], occ['start'], occ['end'],
+                                                                occ['alarm'])
+            self.actkeys[key] = self.actkeys.get(key, 0) + 1
+
+        return self._add(self.actd, occ)
+
+    def _get_columns(self, filename, id_):
         try:
-            occsd[filename][id_]
+            return self.columns[filename][id_]
         except KeyError:
-            return add(occ)
-        else:
-            try:
-                i = occsd[filename][id_].index(oocc)
-            except ValueError:
-                return add(occ)
-            else:
-                action(occsd[filename][id_], i, occ)
-                return True
+            columns = _ItemColumns()
+            self.columns.setdefault(filename, {})[id_] = columns
+            return columns
+
+    def _delete_columns(self, filename, id_):
+        del self.columns[filename][id_]
+
+        if not self.columns[filename]:
+            del self.columns[filename]
 
     def _add(self, occsd, occ):
         filename = occ['filename']
@@ -292,15 +790,6 @@ class OccurrencesRange(object):
 
         occsd[filename][id_].append(occ)
 
-    def _replace(self, ioccs, i, occ):
-        # This method must accept the same arguments as self._move
-        ioccs[i] = occ
-
-    def _move(self, ioccs, i, occ):
-        # This method must accept the same arguments as self._replace
-        del ioccs[i]
-        self.add_active(occ)
-
     def except_(self, filename, id_, start, end, inclusive):
         # Make sure this call is compliant with the requirements defined in
         # organism_api.update_item_rules
@@ -310,42 +799,92 @@ class OccurrencesRange(object):
             raise BadExceptRuleError()
 
     def except_safe(self, filename, id_, start, end, inclusive):
+        self.except_many(filename, id_, (start, ), (end, ), inclusive)
+
+    def except_many(self, filename, id_, starts, ends, inclusive):
+        # This is the bulk version of self.except_safe for all the time windows
+        # of an except rule, which are applied at once; the rule-order
+        # semantics are kept because the windows of a rule only affect the
+        # occurrences added by the previous rules
         # If an except rule is put at the start of the rules list for an item,
-        # self.dict_[filename][id_] wouldn't exist yet; note that if the item
+        # self.columns[filename][id_] wouldn't exist yet; note that if the item
         # is the first one being processed in the database, even
-        # self.dict_[filename] wouldn't exist
+        # self.columns[filename] wouldn't exist
         # This way the except rule is of course completely useless, however if
         # the user has to be warned at all, it must be done in the interface
         # when he saves the rules list, not here, where the exception has to be
         # just silenced
+        windows = None
+
+        try:
+            columns = self.columns[filename][id_]
+        except KeyError:
+            pass
+        else:
+            windows = ExceptWindows(starts, ends, inclusive)
+            columns.except_(windows)
+
+            if not columns:
+                self._delete_columns(filename, id_)
+
         try:
-            dc = self.dict_[filename][id_][:]
+            occs = self.dict_[filename][id_]
         except KeyError:
             pass
         else:
-            for o in dc:
-                # Occurrences with start == o['end'] shouldn't be excepted, as
-                # they're not considered part of the end minute
-                if start <= o['start'] <= end or \
-                                (inclusive and o['start'] <= start < o['end']):
-                    self.dict_[filename][id_].remove(o)
-                    if not self.dict_[filename][id_]:
-                        del self.dict_[filename][id_]
-                        if not self.dict_[filename]:
-                            del self.dict_[filename]
+            if windows is None:
+                windows = ExceptWindows(starts, ends, inclusive)
+
+            occs[:] = [o for o in occs if not windows.match(o['start'],
+                                                                    o['end'])]
+
+            if not occs:
+                del self.dict_[filename][id_]
+
+                if not self.dict_[filename]:
+                    del self.dict_[filename]
 
     def get_dict(self):
-        return self.dict_
+        # The dictionaries of the occurrences stored in columns are created
+        # every time this method is called
+        occsd = {}
+
+        for filename in self.columns:
+            occsd[filename] = {}
+
+            for id_, columns in self.columns[filename].iteritems():
+                occsd[filename][id_] = [{'filename': filename,
+                                         'id_': id_,
+                                         'start': start,
+                                         'end': end,
+                                         'alarm': alarm} for start, end, alarm
+                                                        in columns.iterate()]
+
+        for filename in self.dict_:
+            fdict = occsd.setdefault(filename, {})
+
+            for id_ in self.dict_[filename]:
+                fdict.setdefault(id_, []).extend(self.dict_[filename][id_])
+
+        return occsd
 
     def get_active_dict(self):
         return self.actd
 
     def get_list(self):
+        # The occurrences stored in columns are returned as Occurrence objects
         occsl = []
+
+        for filename in self.columns:
+            for id_, columns in self.columns[filename].iteritems():
+                occsl.extend(Occurrence(filename, id_, start, end, alarm) for
+                                        start, end, alarm in columns.iterate())
+
         for f in self.dict_:
             for i in self.dict_[f]:
                 for o in self.dict_[f][i]:
                     occsl.append(o)
+
         return occsl
 
     def get_active_list(self):
@@ -359,6 +898,14 @@ class OccurrencesRange(object):
     def get_next_completion_time(self):
         # Note that this method ignores self.actd _deliberately_
         ctime = None
+
+        for filename in self.columns:
+            for columns in self.columns[filename].itervalues():
+                t = columns.get_min_completion_time()
+
+                if not ctime or t < ctime:
+                    ctime = t
+
         for f in self.dict_:
             for i in self.dict_[f]:
                 for o in self.dict_[f][i]:
@@ -370,22 +917,30 @@ class OccurrencesRange(object):
     def get_item_time_span(self, filename, id_):
         # Note that this method ignores self.actd _deliberately_
         try:
-            occs = self.dict_[filename][id_]
+            minstart, maxend = self.columns[filename][id_].get_time_span()
         except KeyError:
-            return False
+            try:
+                occs = self.dict_[filename][id_]
+            except KeyError:
+                return False
+            else:
+                # The final minstart and maxend should never end up being None
+                minstart = occs[0]['start']
+                # Initialize maxend to minstart, which is surely != None
+                maxend = minstart
         else:
-            # The final minstart and maxend should never end up being None
-            minstart = occs[0]['start']
-            # Initialize maxend to minstart, which is surely != None
-            maxend = minstart
+            try:
+                occs = self.dict_[filename][id_]
+            except KeyError:
+                occs = ()
 
-            for occ in occs:
-                # This assumes that start <= end
-                minstart = min((minstart, occ['start']))
-                # occ['end'] could be None
-                maxend = max((occ['start'], occ['end'], maxend))
+        for occ in occs:
+            # This assumes that start <= end
+            minstart = min((minstart, occ['start']))
+            # occ['end'] could be None
+            maxend = max((occ['start'], occ['end'], maxend))
 
-            return (minstart, maxend)
+        return (minstart, maxend)
 
 
 class OccurrencesRangeSearchStop(UserWarning):
@@ -415,18 +970,7 @@ class OccurrencesRangeSearch(object):
             # Note that Main.databases could also change size during the
             #  search, so it should be copied to iterate in it
             for filename in self.filenames:
-                # Don'd iterate directly over the returned cursor, but use a
-                # fetchall, otherwise if the application is closed while the
-                # search is on (e.g. while searching the old alarms) an
-                # exception will be raised, because the database will be closed
-                # while the loop is still reading it
-                rows = self.databases[filename].get_all_valid_item_rules(
-                                                                ).fetchall()
-
-                for row in rows:
-                    id_ = row['R_id']
-                    rules = Database.string_to_rules(row['R_rules'])
-
+                for id_, rules in self._get_items_rules(filename):
                     for rule in rules:
                         self._search_item(filename, id_, rule)
 
@@ -451,6 +995,9 @@ class OccurrencesRangeSearch(object):
         # duty of the interface
         return self.occs
 
+    def _get_items_rules(self, filename):
+        return self.databases[filename].get_all_valid_item_rules()
+
     def _search_item(self, filename, id_, rule):
         # This method is defined dynamically
         pass
@@ -461,3 +1008,20 @@ class OccurrencesRangeSearch(object):
 
     def _search_item_stop(self, filename, id_, rule):
         raise OccurrencesRangeSearchStop()
+
+
+class ItemsOccurrencesRangeSearch(OccurrencesRangeSearch):
+    # Search the occurrences of only some items of the databases, e.g. the
+    # ones whose rules have changed; note that the alarms are still retrieved
+    # for all the items of the databases, so the results can also contain
+    # the occurrences of the alarms of the other items
+    def __init__(self, mint, maxt, itemsd, databases, rule_handlers):
+        OccurrencesRangeSearch.__init__(self, mint, maxt, itemsd.keys(),
+                                                    databases, rule_handlers)
+        self.itemsd = itemsd
+
+    def _get_items_rules(self, filename):
+        # Items that do not exist anymore simply have no rules
+        database = self.databases[filename]
+        return [(id_, database.get_valid_item_rules(id_))
+                                            for id_ in self.itemsd[filename]]
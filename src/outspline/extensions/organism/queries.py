@@ -25,6 +25,9 @@ rules_select_all = 'SELECT * FROM Rules WHERE R_rules!=?'
 
 rules_select_id = 'SELECT R_rules FROM Rules WHERE R_id=? LIMIT 1'
 
+# The placeholders for the ids must be formatted into this query
+rules_select_ids = 'SELECT R_id, R_rules FROM Rules WHERE R_id IN ({})'
+
 rules_insert = 'INSERT INTO Rules (R_id, R_rules) VALUES (?, ?)'
 
 rules_update_id = 'UPDATE Rules SET R_rules=? WHERE R_id=?'
@@ -38,7 +41,7 @@ copyrules_create = ("CREATE TABLE CopyRules (CR_id INTEGER, "
 
 copyrules_select = 'SELECT CR_id FROM CopyRules WHERE CR_rules!=? LIMIT 1'
 
-copyrules_select_id = 'SELECT CR_rules FROM CopyRules WHERE CR_id=?'
+copyrules_select_all = 'SELECT CR_id, CR_rules FROM CopyRules'
 
 copyrules_insert = 'INSERT INTO CopyRules (CR_id, CR_rules) VALUES (?, ?)'
 
@@ -50,13 +50,14 @@ class Main(object):
                                             self._handle_reset_modified_state)
         # No need to bind to close_database, as specific filenames will be
         # deleted from self.databases in self._handle_history_clean
-        core_api.bind_to_history_remove(self._handle_history_remove)
+        core_api.bind_to_history_group(self._handle_history_group)
         core_api.bind_to_history_clean(self._handle_history_clean)
 
-        # Do not bind directly to core_api.bind_to_deleted_item because it
-        # would create a race hazard with organism.items.delete_item_rules,
-        # which is bound to the same event
-        organism_api.bind_to_delete_item_rules(self._handle_delete_item_rules)
+        # Do not bind directly to core_api.bind_to_deleting_subtree because
+        # it would create a race hazard with
+        # organism.items.delete_subtree_rules, which is bound to the same event
+        organism_api.bind_to_delete_subtree_rules(
+                                            self._handle_delete_subtree_rules)
         organism_api.bind_to_get_alarms(self._handle_get_alarms)
 
         organism_timer_api.bind_to_get_next_occurrences(
@@ -71,7 +72,7 @@ class Main(object):
         if copypaste_api:
             copypaste_api.bind_to_copy_items(self._handle_copy_items)
             copypaste_api.bind_to_copy_item(self._handle_copy_item)
-            copypaste_api.bind_to_paste_item(self._handle_paste_item)
+            copypaste_api.bind_to_paste_items(self._handle_paste_items)
             copypaste_api.bind_to_safe_paste_check(
                                                 self._handle_safe_paste_check)
 
@@ -127,10 +128,10 @@ class Main(object):
         except KeyError:
             pass
 
-    def _handle_paste_item(self, kwargs):
+    def _handle_paste_items(self, kwargs):
         try:
-            self.databases[kwargs['filename']].paste_alarms(kwargs['id_'],
-                                                            kwargs['oldid'])
+            self.databases[kwargs['filename']].paste_items_alarms(
+                                                                kwargs['ids'])
         except KeyError:
             pass
 
@@ -144,19 +145,21 @@ class Main(object):
         if curm.fetchone() and kwargs['filename'] not in self.databases:
             raise kwargs['exception']()
 
-    def _handle_delete_item_rules(self, kwargs):
+    def _handle_delete_subtree_rules(self, kwargs):
         try:
-            self.databases[kwargs['filename']].delete_alarms(kwargs['id_'],
-                                                                kwargs['text'])
+            self.databases[kwargs['filename']].delete_items_alarms(
+                                                            kwargs['texts'])
         except KeyError:
             pass
 
-    def _handle_history_remove(self, kwargs):
-        try:
-            self.databases[kwargs['filename']].delete_alarms(kwargs['id_'],
-                                                                kwargs['text'])
-        except KeyError:
-            pass
+    def _handle_history_group(self, kwargs):
+        deleted = kwargs['changes']['deleted']
+
+        if deleted:
+            try:
+                self.databases[kwargs['filename']].delete_items_alarms(deleted)
+            except KeyError:
+                pass
 
     def _handle_history_clean(self, kwargs):
         filename = kwargs['filename']
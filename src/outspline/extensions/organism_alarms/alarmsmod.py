@@ -26,7 +26,9 @@ import outspline.extensions.organism_timer_api as organism_timer_api
 import queries
 
 alarm_event = Event()
+alarms_activated_event = Event()
 alarm_off_event = Event()
+alarms_off_event = Event()
 activate_alarms_range_event = Event()
 activate_alarms_range_end_event = Event()
 
@@ -35,7 +37,10 @@ class Database(object):
     def __init__(self, filename, choose_unique_old_alarms):
         self.filename = filename
         self.choose_unique_old_alarms = choose_unique_old_alarms
-        self.changes = None
+        # Count the changes to the Alarms table since the database was last
+        # saved, instead of comparing the whole table with a copy; the counter
+        # is only updated while holding the database connection
+        self.changes = 0
         self.modified_state = False
         self.old_alarms_lock = threading.Lock()
         # A first call to acquire is needed to set the state to unlocked
@@ -147,70 +152,98 @@ class Database(object):
         self._activate_alarms_all(occsd)
 
     def _activate_alarms_all(self, occsd):
-        for id_ in occsd:
-            # Due to race conditions, id_ could have been deleted meanwhile
-            # (e.g. if the modal dialog for deleting the item was open in the
-            # interface)
-            if core_api.is_item(self.filename, id_):
-                for occ in occsd[id_]:
-                    self._activate_alarm(occ)
+        self._activate_alarms([occ for id_ in self._get_existing_items(occsd)
+                                                    for occ in occsd[id_]])
 
     def _activate_alarms_unique(self, occsd):
-        for id_ in occsd:
-            # Due to race conditions, id_ could have been deleted meanwhile
-            # (e.g. if the modal dialog for deleting the item was open in the
-            # interface)
-            if core_api.is_item(self.filename, id_):
-                try:
-                    occ = max(occsd[id_], key=lambda occ: occ['alarm'])
-                except ValueError:
-                    # occsd[id_] may be have been emptied in
-                    # self.activate_alarms_range
-                    pass
-                else:
-                    self._activate_alarm(occ)
+        alarms = []
+
+        for id_ in self._get_existing_items(occsd):
+            try:
+                occ = max(occsd[id_], key=lambda occ: occ['alarm'])
+            except ValueError:
+                # occsd[id_] may be have been emptied in
+                # self.activate_alarms_range
+                pass
+            else:
+                alarms.append(occ)
+
+        self._activate_alarms(alarms)
 
     def activate_alarms(self, time, occsd):
-        for id_ in occsd:
-            # Due to race conditions, id_ could have been deleted meanwhile
-            # (e.g. if the modal dialog for deleting the item was open in the
-            # interface)
-            if core_api.is_item(self.filename, id_):
-                for occ in occsd[id_]:
-                    # occ may have start or end == time
-                    if occ['alarm'] == time:
-                        self._activate_alarm(occ)
-
-    def _activate_alarm(self, alarm):
+        # occ may have start or end == time
+        self._activate_alarms([occ for id_ in self._get_existing_items(occsd)
+                                for occ in occsd[id_] if occ['alarm'] == time])
+
+    def _get_existing_items(self, occsd):
+        # Due to race conditions, some items could have been deleted meanwhile
+        # (e.g. if the modal dialog for deleting the item was open in the
+        # interface)
+        return [id_ for id_ in occsd if core_api.is_item(self.filename, id_)]
+
+    def _activate_alarms(self, alarms):
         # If one of the loops that call this method lasts long enough (and
         # the're not run on the main thread), the database may be closed
         # meanwhile; however this function seems to terminate safely without
         # the need of further tests here
-        if 'alarmid' not in alarm:
-            alarmid = self._insert_alarm(id_=alarm['id_'],
-                                   start=alarm['start'],
-                                   end=alarm['end'],
-                                   origalarm=alarm['alarm'],
-                                   # Note that here passing None is correct (do
-                                   # not pass False)
-                                   snooze=None)
-        else:
-            alarmid = alarm['alarmid']
-            # Occurrence dictionaries store active alarms with False, not None
-            if alarm['alarm']:
-                filename = alarm['filename']
-                qconn = core_api.get_connection(filename)
-                cursor = qconn.cursor()
-                # Note that here using None is correct (do not use False)
-                cursor.execute(queries.alarms_update_id, (None, alarmid))
-                core_api.give_connection(filename, qconn)
-
-        alarm_event.signal(filename=alarm['filename'],
-                           id_=alarm['id_'],
-                           alarmid=alarmid,
-                           start=alarm['start'],
-                           end=alarm['end'],
-                           alarm=alarm['alarm'])
+        if not alarms:
+            return False
+
+        new = [alarm for alarm in alarms if 'alarmid' not in alarm]
+        # Occurrence dictionaries store active alarms with False, not None
+        snoozed = [alarm['alarmid'] for alarm in alarms if 'alarmid' in alarm
+                                                            and alarm['alarm']]
+        nextid = None
+
+        conn = core_api.get_connection(self.filename)
+        cur = conn.cursor()
+
+        if new:
+            # A_id is an INTEGER PRIMARY KEY, so since the connection is held
+            # the new alarms are given consecutive ids following the current
+            # maximum one
+            cur.execute(queries.alarms_select_max_id)
+            nextid = (cur.fetchone()['A_max_id'] or 0) + 1
+
+            # Note that here passing None as the snooze time is correct (do
+            # not pass False)
+            cur.executemany(queries.alarms_insert, ((alarm['id_'],
+                                    alarm['start'], alarm['end'],
+                                    alarm['alarm'], None) for alarm in new))
+
+        if snoozed:
+            # Note that here using None is correct (do not use False)
+            cur.executemany(queries.alarms_update_id, ((None, alarmid)
+                                                    for alarmid in snoozed))
+
+        if new or snoozed:
+            self.changes += 1
+
+        core_api.give_connection(self.filename, conn)
+
+        activated = []
+
+        for alarm in alarms:
+            try:
+                alarmid = alarm['alarmid']
+            except KeyError:
+                alarmid = nextid
+                nextid += 1
+
+            activated.append({'filename': alarm['filename'],
+                              'id_': alarm['id_'],
+                              'alarmid': alarmid,
+                              'start': alarm['start'],
+                              'end': alarm['end'],
+                              'alarm': alarm['alarm']})
+
+        # Signal the whole batch at once, so that the interfaces can update
+        # only once; the event for the single alarms is still signalled for
+        # the handlers that need it
+        alarms_activated_event.signal(filename=self.filename, alarms=activated)
+
+        for alarm in activated:
+            alarm_event.signal(**alarm)
 
     def get_alarms(self, mint, maxt, occs):
         conn = core_api.get_connection(self.filename)
@@ -254,55 +287,63 @@ class Database(object):
         return row['A_active_alarms']
 
     def snooze_alarms(self, alarmsd, stime, newalarm):
-        for id_ in alarmsd:
-            for alarmid in alarmsd[id_]:
-                text = core_api.get_item_text(self.filename, id_)
-
-                qconn = core_api.get_connection(self.filename)
-                cursor = qconn.cursor()
-                cursor.execute(queries.alarms_update_id, (newalarm, alarmid))
-                core_api.give_connection(self.filename, qconn)
-
-                self._insert_alarm_log(id_, 0, text.partition('\n')[0])
+        alarms = [(id_, alarmid) for id_ in alarmsd
+                                                for alarmid in alarmsd[id_]]
+
+        if alarms:
+            texts = core_api.get_items_text(self.filename, alarmsd.keys())
+
+            qconn = core_api.get_connection(self.filename)
+            cursor = qconn.cursor()
+            cursor.executemany(queries.alarms_update_id, ((newalarm, alarmid)
+                                                for id_, alarmid in alarms))
+            self._insert_alarms_log(cursor, [(id_, 0, texts[id_])
+                                                for id_, alarmid in alarms])
+            self.changes += 1
+            core_api.give_connection(self.filename, qconn)
 
-                # Signal the event after updating the database, so, for
-                # example, the tasklist can be correctly updated
-                alarm_off_event.signal(filename=self.filename, id_=id_,
-                                                            alarmid=alarmid)
+            # Signal the events after updating the database, so, for example,
+            # the tasklist can be correctly updated
+            self._signal_alarms_off(alarmsd)
 
     def dismiss_alarms(self, alarmsd):
-        for id_ in alarmsd:
-            for alarmid in alarmsd[id_]:
-                text = core_api.get_item_text(self.filename, id_)
+        alarms = [(id_, alarmid) for id_ in alarmsd
+                                                for alarmid in alarmsd[id_]]
+
+        if alarms:
+            texts = core_api.get_items_text(self.filename, alarmsd.keys())
+
+            qconn = core_api.get_connection(self.filename)
+            cursor = qconn.cursor()
+            cursor.executemany(queries.alarms_delete_id, ((alarmid, )
+                                                for id_, alarmid in alarms))
+            self._insert_alarms_log(cursor, [(id_, 1, texts[id_])
+                                                for id_, alarmid in alarms])
+            self.changes += 1
+            core_api.give_connection(self.filename, qconn)
 
-                qconn = core_api.get_connection(self.filename)
-                cursor = qconn.cursor()
-                cursor.execute(queries.alarms_delete_id, (alarmid, ))
-                core_api.give_connection(self.filename, qconn)
+            # It's necessary to change the dismiss status, otherwise it's
+            # possible that a database is loaded and some of its alarms are
+            # activated: if at that point those alarms are dismissed and
+            # then the user tries to close the database, the database will
+            # seem unmodified, and won't ask to be saved
+            self.modified_state = True
 
-                self._insert_alarm_log(id_, 1, text.partition('\n')[0])
+            # Signal the events after updating the database, so, for example,
+            # the tasklist can be correctly updated
+            self._signal_alarms_off(alarmsd)
 
-                # It's necessary to change the dismiss status, otherwise it's
-                # possible that a database is loaded and some of its alarms are
-                # activated: if at that point those alarms are dismissed and
-                # then the user tries to close the database, the database will
-                # seem unmodified, and won't ask to be saved
-                self.modified_state = True
+    def _signal_alarms_off(self, alarmsd):
+        # Signal the whole batch at once, so that the interfaces can update
+        # only once; the event for the single alarms is still signalled for
+        # the handlers that need it
+        alarms_off_event.signal(filename=self.filename, alarmsd=alarmsd)
 
-                # Signal the event after updating the database, so, for
-                # example, the tasklist can be correctly updated
+        for id_ in alarmsd:
+            for alarmid in alarmsd[id_]:
                 alarm_off_event.signal(filename=self.filename, id_=id_,
                                                             alarmid=alarmid)
 
-    def _insert_alarm(self, id_, start, end, origalarm, snooze):
-        conn = core_api.get_connection(self.filename)
-        cur = conn.cursor()
-        cur.execute(queries.alarms_insert, (id_, start, end, origalarm,
-                                                                    snooze))
-        core_api.give_connection(self.filename, conn)
-        aid = cur.lastrowid
-        return aid
-
     def copy_alarms(self, id_):
         occs = []
 
@@ -324,40 +365,54 @@ class Database(object):
 
         core_api.give_memory_connection(mem)
 
-    def paste_alarms(self, id_, oldid):
+    def paste_items_alarms(self, ids):
         mem = core_api.get_memory_connection()
         curm = mem.cursor()
-        curm.execute(queries.copyalarms_select_id, (oldid, ))
+        curm.execute(queries.copyalarms_select_all)
         core_api.give_memory_connection(mem)
 
-        for occ in curm:
-            self._insert_alarm(id_, occ['CA_start'], occ['CA_end'],
+        records = [(ids[occ['CA_item']], occ['CA_start'], occ['CA_end'],
                                             occ['CA_alarm'], occ['CA_snooze'])
-
-    def delete_alarms(self, id_, text):
-        qconn = core_api.get_connection(self.filename)
-        cursor = qconn.cursor()
-        cursor.execute(queries.alarms_delete_item, (id_, ))
-
-        if cursor.rowcount > 0:
+                                    for occ in curm if occ['CA_item'] in ids]
+
+        if records:
+            conn = core_api.get_connection(self.filename)
+            cur = conn.cursor()
+            cur.executemany(queries.alarms_insert, records)
+            self.changes += 1
+            core_api.give_connection(self.filename, conn)
+
+    def delete_items_alarms(self, texts):
+        alarmsd = {}
+
+        for row in core_api.select_ids(self.filename,
+                                        queries.alarms_select_items, texts):
+            alarmsd.setdefault(row['A_item'], []).append(row['A_id'])
+
+        if alarmsd:
+            qconn = core_api.get_connection(self.filename)
+            cursor = qconn.cursor()
+            cursor.executemany(queries.alarms_delete_item, ((id_, )
+                                                        for id_ in alarmsd))
+            self._insert_alarms_log(cursor, [(id_, 2, texts[id_])
+                                                        for id_ in alarmsd])
+            self.changes += 1
             core_api.give_connection(self.filename, qconn)
 
-            self._insert_alarm_log(id_, 2, text.partition('\n')[0])
-
             # Signal the event after updating the database, so, for example,
-            # the tasklist can be correctly updated
-            alarm_off_event.signal(filename=self.filename, id_=id_)
-        else:
-            core_api.give_connection(self.filename, qconn)
+            # the tasklist can be correctly updated; signal only the aggregated
+            # event for the whole subtree
+            alarms_off_event.signal(filename=self.filename, alarmsd=alarmsd)
 
-    def _insert_alarm_log(self, id_, reason, text):
-        qconn = core_api.get_connection(self.filename)
-        cursor = qconn.cursor()
+    def _insert_alarms_log(self, cursor, records):
+        # records is a list of (id_, reason, text) tuples
         # Also store the text, otherwise it won't be possible to retrieve it if
         # the item has been deleted meanwhile
-        cursor.execute(queries.alarmsofflog_insert, (id_, reason, text))
+        cursor.executemany(queries.alarmsofflog_insert, ((id_, reason,
+                                            text.partition('\n')[0])
+                                            for id_, reason, text in records))
+        # Clean the log only once for the whole batch
         cursor.execute(queries.alarmsofflog_delete_clean, self.log_limits)
-        core_api.give_connection(self.filename, qconn)
 
     def update_alarm_log_soft_limit(self, limit):
         qconn = core_api.get_connection(self.filename)
@@ -382,19 +437,12 @@ class Database(object):
                                                         (self.log_limits[0], ))
 
     def check_pending_changes(self):
-        conn = core_api.get_connection(self.filename)
-        cur = conn.cursor()
-        change_state = self.changes != [row for row in
-                                            cur.execute(queries.alarms_select)]
-        core_api.give_connection(self.filename, conn)
-
-        if change_state or self.modified_state:
+        if self.changes or self.modified_state:
             core_api.set_modified(self.filename)
 
     def reset_modified_state(self):
         conn = core_api.get_connection(self.filename)
-        cur = conn.cursor()
-        self.changes = [row for row in cur.execute(queries.alarms_select)]
+        self.changes = 0
         core_api.give_connection(self.filename, conn)
 
         self.modified_state = False
@@ -37,11 +37,18 @@ alarms_create = ("CREATE TABLE Alarms (A_id INTEGER PRIMARY KEY, "
                                       "A_alarm INTEGER, "
                                       "A_snooze INTEGER)")
 
+alarms_create_index_item = 'CREATE INDEX Alarms_item ON Alarms (A_item)'
+
 alarms_select = 'SELECT * FROM Alarms'
 
 alarms_select_item = ('SELECT A_id, A_start, A_end, A_alarm, A_snooze '
                                                 'FROM Alarms WHERE A_item=?')
 
+# The placeholders for the ids must be formatted into this query
+alarms_select_items = 'SELECT A_id, A_item FROM Alarms WHERE A_item IN ({})'
+
+alarms_select_max_id = 'SELECT MAX(A_id) AS A_max_id FROM Alarms'
+
 alarms_select_count = ('SELECT COUNT(*) AS A_active_alarms FROM Alarms '
                                                     'WHERE A_snooze IS NULL')
 
@@ -65,8 +72,8 @@ copyalarms_create = ("CREATE TABLE CopyAlarms (CA_id INTEGER, "
 
 copyalarms_select = 'SELECT CA_id FROM CopyAlarms LIMIT 1'
 
-copyalarms_select_id = ('SELECT CA_id, CA_start, CA_end, CA_alarm, CA_snooze '
-                        'FROM CopyAlarms WHERE CA_item=?')
+copyalarms_select_all = ('SELECT CA_item, CA_start, CA_end, CA_alarm, '
+                         'CA_snooze FROM CopyAlarms')
 
 copyalarms_insert = ('INSERT INTO CopyAlarms (CA_id, CA_item, CA_start, '
                      'CA_end, CA_alarm, CA_snooze) VALUES (?, ?, ?, ?, ?, ?)')
@@ -61,10 +61,20 @@ def bind_to_alarm(handler, bind=True):
     return alarmsmod.alarm_event.bind(handler, bind)
 
 
+def bind_to_alarms_activated(handler, bind=True):
+    # Warning, this function is executed on a separate thread!!!
+    # (Check for race conditions)
+    return alarmsmod.alarms_activated_event.bind(handler, bind)
+
+
 def bind_to_alarm_off(handler, bind=True):
     return alarmsmod.alarm_off_event.bind(handler, bind)
 
 
+def bind_to_alarms_off(handler, bind=True):
+    return alarmsmod.alarms_off_event.bind(handler, bind)
+
+
 def bind_to_activate_alarms_range(handler, bind=True):
     # Warning, this function is executed on a separate thread!!!
     # (Check for race conditions)
@@ -52,6 +52,10 @@ def get_item_rules(filename, id_):
     return extension.databases[filename].get_item_rules(id_)
 
 
+def get_valid_item_rules(filename, id_):
+    return extension.databases[filename].get_valid_item_rules(id_)
+
+
 def get_all_valid_item_rules(filename):
     return extension.databases[filename].get_all_valid_item_rules()
 
@@ -65,6 +69,16 @@ def get_occurrences_range(mint, maxt, filenames):
                                 extension.databases, extension.rules.handlers)
 
 
+def get_items_occurrences_range(mint, maxt, itemsd):
+    # itemsd maps the filenames to the ids of the items to be searched
+    return items.ItemsOccurrencesRangeSearch(mint, maxt, itemsd,
+                                extension.databases, extension.rules.handlers)
+
+
+def make_except_windows(starts, ends, inclusive):
+    return items.ExceptWindows(starts, ends, inclusive)
+
+
 def convert_string_to_rules(string):
     return items.Database.string_to_rules(string)
 
@@ -85,8 +99,12 @@ def bind_to_update_item_rules_conditional(handler, bind=True):
     return items.update_item_rules_conditional_event.bind(handler, bind)
 
 
-def bind_to_delete_item_rules(handler, bind=True):
-    return items.delete_item_rules_event.bind(handler, bind)
+def bind_to_update_valid_rules(handler, bind=True):
+    return items.update_valid_rules_event.bind(handler, bind)
+
+
+def bind_to_delete_subtree_rules(handler, bind=True):
+    return items.delete_subtree_rules_event.bind(handler, bind)
 
 
 def bind_to_get_alarms(handler, bind=True):
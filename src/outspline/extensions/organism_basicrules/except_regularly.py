@@ -184,27 +184,19 @@ def get_occurrences_range_local(mint, utcmint, maxt, utcoffset, filename, id_,
         start = occur_regularly.compute_min_time(minstart - utcoffset.compute(
                 minstart), rule['#'][0], interval, rule['#'][2], rule['#'][3])
 
-        # Because of the start time note above, this loop will take a long time
-        # to complete for example when retrieving the old alarms, and such a
-        # search couldn't be aborted, since the aborting happens there, not in
-        # this loop (bug #329)
-        while True:
-            # Every timestamp can have a different UTC offset, depending
-            # whether it's in a DST period or not
-            offset = utcoffset.compute(start)
+        starts = occur_regularly.make_times(start,
+                    occur_regularly.compute_max_utc_time(maxend), interval)
+        sstarts = occur_regularly.localize_times(starts, interval,
+                                                                utcoffset)
 
-            sstart = start + offset
-            send = sstart + rend
+        # Do compare the local start times with maxend, *not* the UTC ones
+        sstarts = occur_regularly.truncate_times(sstarts, maxend)
 
-            # Do compare sstart with maxend, *not* start
-            if sstart > maxend:
-                break
-            # Do compare send with minstart, *not* end
-            elif send >= minstart:
-                # The rule is checked in make_rule, no need to use occs.except_
-                occs.except_safe(filename, id_, sstart, send, inclusive)
-
-            start += interval
+        # Apply all the windows at once; the windows that end before minstart
+        #  cannot match any occurrence anyway
+        # The rule is checked in make_rule, no need to use occs.except_
+        occs.except_many(filename, id_, sstarts,
+                        occur_regularly.shift_times(sstarts, rend), inclusive)
 
 
 def get_occurrences_range_UTC(mint, utcmint, maxt, utcoffset, filename, id_,
@@ -223,20 +215,13 @@ def get_occurrences_range_UTC(mint, utcmint, maxt, utcoffset, filename, id_,
         start = occur_regularly.compute_min_time(minstart, rule['#'][0],
                                         interval, rule['#'][2], rule['#'][3])
 
-        # Because of the start time note above, this loop will take a long time
-        # to complete for example when retrieving the old alarms, and such a
-        # search couldn't be aborted, since the aborting happens there, not in
-        # this loop (bug #329)
-        while True:
-            end = start + rend
-
-            if start > maxend:
-                break
-            elif end >= minstart:
-                # The rule is checked in make_rule, no need to use occs.except_
-                occs.except_safe(filename, id_, start, end, inclusive)
+        starts = occur_regularly.make_times(start, maxend, interval)
 
-            start += interval
+        # Apply all the windows at once; the windows that end before minstart
+        # cannot match any occurrence anyway
+        # The rule is checked in make_rule, no need to use occs.except_
+        occs.except_many(filename, id_, starts,
+                        occur_regularly.shift_times(starts, rend), inclusive)
 
 
 def get_next_item_occurrences_local(base_time, utcbase, utcoffset, filename,
@@ -262,29 +247,21 @@ def get_next_item_occurrences_local(base_time, utcbase, utcoffset, filename,
         start = occur_regularly.compute_min_time(minstart - utcoffset.compute(
                 minstart), rule['#'][0], interval, rule['#'][2], rule['#'][3])
 
-        # Because of the start time note above, this loop will take a long time
-        # to complete for wide search ranges and short intervals (bug #329)
-        while True:
-            # Every timestamp can have a different UTC offset, depending
-            # whether it's in a DST period or not
-            offset = utcoffset.compute(start)
-
-            sstart = start + offset
-            send = sstart + rend
-
-            next_occ = occs.get_next_occurrence_time()
+        next_occ = occs.get_next_occurrence_time()
 
-            # Do compare sstart with next_occ, *not* start
-            if not next_occ or sstart > next_occ:
-                break
+        if next_occ:
+            starts = occur_regularly.make_times(start,
+                    occur_regularly.compute_max_utc_time(next_occ), interval)
+            sstarts = occur_regularly.localize_times(starts, interval,
+                                                                utcoffset)
+            # Do compare the local start times with next_occ, *not* the UTC
+            # ones; the windows that start after maxend or end before minstart
+            # cannot match any occurrence anyway
+            sstarts = occur_regularly.truncate_times(sstarts, next_occ)
 
-            # Do compare sstart with maxend and send with minstart, *not* start
-            # and end
-            if sstart <= maxend and send >= minstart:
-                # The rule is checked in make_rule, no need to use occs.except_
-                occs.except_safe(filename, id_, sstart, send, inclusive)
-
-            start += interval
+            # The rule is checked in make_rule, no need to use occs.except_
+            occs.except_many(filename, id_, sstarts,
+                        occur_regularly.shift_times(sstarts, rend), inclusive)
 
 
 def get_next_item_occurrences_UTC(base_time, utcbase, utcoffset, filename,
@@ -304,18 +281,13 @@ def get_next_item_occurrences_UTC(base_time, utcbase, utcoffset, filename,
         start = occur_regularly.compute_min_time(minstart, rule['#'][0],
                                         interval, rule['#'][2], rule['#'][3])
 
-        # Because of the start time note above, this loop will take a long time
-        # to complete for wide search ranges and short intervals (bug #329)
-        while True:
-            end = start + rend
-
-            next_occ = occs.get_next_occurrence_time()
-
-            if not next_occ or start > next_occ:
-                break
+        next_occ = occs.get_next_occurrence_time()
 
-            if start <= maxend and end >= minstart:
-                # The rule is checked in make_rule, no need to use occs.except_
-                occs.except_safe(filename, id_, start, end, inclusive)
+        if next_occ:
+            # The windows that start after maxend or end before minstart
+            # cannot match any occurrence anyway
+            starts = occur_regularly.make_times(start, next_occ, interval)
 
-            start += interval
+            # The rule is checked in make_rule, no need to use occs.except_
+            occs.except_many(filename, id_, starts,
+                        occur_regularly.shift_times(starts, rend), inclusive)
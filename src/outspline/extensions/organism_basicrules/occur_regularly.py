@@ -16,6 +16,13 @@
 # You should have received a copy of the GNU General Public License
 # along with Outspline.  If not, see <http://www.gnu.org/licenses/>.
 
+import time as _time
+
+try:
+    import numpy as _numpy
+except ImportError:
+    _numpy = None
+
 from exceptions import BadRuleError
 
 _RULE_NAMES = {'local': 'occur_regularly_local',
@@ -422,6 +429,102 @@ def compute_min_time(reftime, refstart, interval, overlaps, bgap):
     else:
         return ftime - overlaps * interval
 
+def make_times(mintime, maxtime, interval):
+    # Return the times between mintime and maxtime (included) spaced by
+    #  interval, as a NumPy array if NumPy is installed, or as a list
+    if _numpy:
+        return _numpy.arange(mintime, maxtime + 1, interval,
+                                                        dtype=_numpy.int64)
+    else:
+        return range(mintime, maxtime + 1, interval)
+
+
+def shift_times(times, delta):
+    # Return None if delta is None, i.e. if the rule does not define the
+    #  shifted times (e.g. the end or alarm times)
+    if delta is None:
+        return None
+    elif _numpy:
+        return times + delta
+    else:
+        return [time + delta for time in times]
+
+
+def localize_times(times, interval, utcoffset):
+    # Every timestamp can have a different UTC offset, depending whether it's
+    #  in a DST period or not; timeaux.UTCOffset uses a fixed offset if the
+    #  time zone does not have DST
+    if _time.daylight == 0:
+        return shift_times(times, _time.timezone)
+
+    # The offsets only change at the DST transitions, which are assumed to be
+    #  more than a day apart, so compute them about once a day and bisect the
+    #  runs of times where they change
+    step = max((86400 // interval, 1))
+    count = len(times)
+    runs = []
+    start = 0
+
+    while start < count:
+        offset = utcoffset.compute(int(times[start]))
+        first = start
+        last = min((start + step, count - 1))
+
+        if utcoffset.compute(int(times[last])) == offset:
+            stop = last + 1
+        else:
+            while last - first > 1:
+                middle = (first + last) // 2
+
+                if utcoffset.compute(int(times[middle])) == offset:
+                    first = middle
+                else:
+                    last = middle
+
+            stop = last
+
+        runs.append((start, stop, offset))
+        start = stop
+
+    if _numpy:
+        offsets = _numpy.empty(count, dtype=_numpy.int64)
+
+        for start, stop, offset in runs:
+            offsets[start:stop] = offset
+
+        return times + offsets
+    else:
+        localized = []
+
+        for start, stop, offset in runs:
+            localized.extend(time + offset for time in times[start:stop])
+
+        return localized
+
+
+def compute_max_utc_time(maxtime):
+    # Return the latest UTC time whose local time can be maxtime, whatever
+    #  its UTC offset
+    return maxtime - min((_time.timezone, _time.altzone))
+
+
+def truncate_times(times, maxtime):
+    # Truncate the times at the first one later than maxtime, which is where
+    #  the occurrence loops would stop; local times are not necessarily sorted
+    #  because of the DST changes
+    if _numpy:
+        later = _numpy.flatnonzero(times > maxtime)
+
+        if len(later):
+            return times[:later[0]]
+    else:
+        for index, time in enumerate(times):
+            if time > maxtime:
+                return times[:index]
+
+    return times
+
+
 def get_occurrences_range_local(mint, utcmint, maxt, utcoffset, filename, id_,
                                                                 rule, occs):
     interval = rule['#'][1]
@@ -434,36 +537,21 @@ def get_occurrences_range_local(mint, utcmint, maxt, utcoffset, filename, id_,
                                                                 rule['#'][3])
     rend = rule['#'][4]
     ralarm = rule['#'][5]
-
-    while True:
-        # Every timestamp can have a different UTC offset, depending whether
-        # it's in a DST period or not
-        offset = utcoffset.compute(start)
-
-        sstart = start + offset
-
-        try:
-            send = sstart + rend
-        except TypeError:
-            send = None
-
-        try:
-            salarm = sstart - ralarm
-        except TypeError:
-            salarm = None
-
-        # Do compare sstart and salarm with maxt, *not* start and alarm
-        if sstart > maxt and (salarm is None or salarm > maxt):
-            break
-
+    # The search stops at the first occurrence whose start and alarm times
+    #  are both later than maxt; remember that max((None, 0)) == 0
+    # Do compare the local start times with maxstart, *not* the UTC ones
+    maxstart = maxt + max((ralarm, 0))
+
+    # Compute all the occurrence times in the range with array operations
+    #  instead of looping through each occurrence
+    sstarts = truncate_times(localize_times(make_times(start,
+                    compute_max_utc_time(maxstart), interval), interval,
+                    utcoffset), maxstart)
+
+    if len(sstarts):
         # The rule is checked in make_rule, no need to use occs.add
-        occs.add_safe({'filename': filename,
-                       'id_': id_,
-                       'start': sstart,
-                       'end': send,
-                       'alarm': salarm})
-
-        start += interval
+        occs.add_many(filename, id_, sstarts, shift_times(sstarts, rend),
+                    shift_times(sstarts, None if ralarm is None else -ralarm))
 
 
 def get_occurrences_range_UTC(mint, utcmint, maxt, utcoffset, filename, id_,
@@ -474,28 +562,14 @@ def get_occurrences_range_UTC(mint, utcmint, maxt, utcoffset, filename, id_,
     rend = rule['#'][4]
     ralarm = rule['#'][5]
 
-    while True:
-        try:
-            end = start + rend
-        except TypeError:
-            end = None
-
-        try:
-            alarm = start - ralarm
-        except TypeError:
-            alarm = None
-
-        if start > maxt and (alarm is None or alarm > maxt):
-            break
+    # The search stops at the first occurrence whose start and alarm times
+    #  are both later than maxt; remember that max((None, 0)) == 0
+    starts = make_times(start, maxt + max((ralarm, 0)), interval)
 
+    if len(starts):
         # The rule is checked in make_rule, no need to use occs.add
-        occs.add_safe({'filename': filename,
-                       'id_': id_,
-                       'start': start,
-                       'end': end,
-                       'alarm': alarm})
-
-        start += interval
+        occs.add_many(filename, id_, starts, shift_times(starts, rend),
+                    shift_times(starts, None if ralarm is None else -ralarm))
 
 
 def get_next_item_occurrences_local(base_time, utcbase, utcoffset, filename,
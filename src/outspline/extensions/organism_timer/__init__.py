@@ -47,6 +47,8 @@ class Main(object):
         organism_api.bind_to_open_database(self._handle_open_database)
         organism_api.bind_to_update_item_rules_conditional(
                                 self._handle_search_next_occurrences_request)
+        organism_api.bind_to_update_valid_rules(
+                                            self._handle_update_valid_rules)
 
         if copypaste_api:
             copypaste_api.bind_to_items_pasted(
@@ -75,6 +77,9 @@ class Main(object):
         else:
             self.nextoccsengine.restart()
 
+    def _handle_update_valid_rules(self, kwargs):
+        self.nextoccsengine.set_dirty(kwargs['filename'], kwargs['ids'])
+
     def _handle_search_next_occurrences_request(self, kwargs):
         self.nextoccsengine.restart()
 
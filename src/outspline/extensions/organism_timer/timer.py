@@ -17,6 +17,7 @@
 # along with Outspline.  If not, see <http://www.gnu.org/licenses/>.
 
 import threading
+import heapq
 import time as time_
 
 from outspline.static.pyaux import timeaux
@@ -94,6 +95,11 @@ class NextOccurrences(object):
         self.occs = {}
         self.oldoccs = {}
         self.next = None
+        # self.index maps the keys of the occurrences in self.occs, see
+        # self._make_key, to the lists of the matching occurrences; it is only
+        # built by self.try_delete_one, and then kept updated by self.add_safe,
+        # while the other methods that modify self.occs just reset it
+        self.index = None
 
     def add(self, base_time, occ):
         # Make sure this occurrence is compliant with the requirements defined
@@ -114,18 +120,41 @@ class NextOccurrences(object):
                 if not self.next or t < self.next:
                     self.next = t
                     self.occs = {occ['filename']: {occ['id_']: [occ]}}
+
+                    if self.index is not None:
+                        self.index = {self._make_key(occ): [occ]}
+
                     return True
                 elif t == self.next:
                     self._add(self.occs, occ)
+
+                    if self.index is not None:
+                        self.index.setdefault(self._make_key(occ), []).append(
+                                                                           occ)
+
                     return True
                 else:
                     return False
         else:
             return False
 
+    def add_scheduled(self, time, filename, id_, occs):
+        # This method is used by NextOccurrencesEngine to merge the occurrences
+        # of the items that are scheduled at the same time, so all the calls
+        # must pass the same time
+        self.next = time
+        self.index = None
+        self._add_list(self.occs, filename, id_, occs)
+
     def add_old(self, occ):
         self._add(self.oldoccs, occ)
 
+    def _add_list(self, occsd, filename, id_, occs):
+        try:
+            occsd[filename][id_] = occs[:]
+        except KeyError:
+            occsd[filename] = {id_: occs[:]}
+
     def _add(self, occsd, occ):
         filename = occ['filename']
         id_ = occ['id_']
@@ -140,6 +169,11 @@ class NextOccurrences(object):
             occsd[filename][id_] = []
         occsd[filename][id_].append(occ)
 
+    @staticmethod
+    def _make_key(occ):
+        return (occ['filename'], occ['id_'], occ['start'], occ['end'],
+                                                                occ['alarm'])
+
     def except_(self, filename, id_, start, end, inclusive):
         # Make sure this call is compliant with the requirements defined in
         # organism_api.update_item_rules
@@ -156,6 +190,8 @@ class NextOccurrences(object):
         except KeyError:
             pass
         else:
+            self.index = None
+
             for occ in occsc:
                 # Occurrences with start == o['end'] shouldn't be excepted, as
                 # they're not considered part of the end minute
@@ -171,22 +207,67 @@ class NextOccurrences(object):
         # this value, thus ignoring the excepted occurrences at the following
         # search
 
+    def except_many(self, filename, id_, starts, ends, inclusive):
+        # This is the bulk version of self.except_safe for all the time windows
+        # of an except rule, see organism.items.OccurrencesRange.except_many
+        try:
+            occs = self.occs[filename][id_]
+        except KeyError:
+            return
+
+        self.index = None
+
+        windows = organism_api.make_except_windows(starts, ends, inclusive)
+        occs[:] = [occ for occ in occs if not windows.match(occ['start'],
+                                                                occ['end'])]
+
+        if not occs:
+            del self.occs[filename][id_]
+
+            if not self.occs[filename]:
+                del self.occs[filename]
+
+        # Like in self.except_safe, do not try to update self.next
+
     def try_delete_one(self, filename, id_, start, end, alarm):
         try:
-            occsc = self.occs[filename][id_][:]
+            occs = self.occs[filename][id_]
         except KeyError:
             return False
         else:
-            for occd in occsc:
-                if (start, end, alarm) == (occd['start'], occd['end'],
-                                                                occd['alarm']):
-                    self.occs[filename][id_].remove(occd)
-                    if not self.occs[filename][id_]:
-                        del self.occs[filename][id_]
-                        if not self.occs[filename]:
-                            del self.occs[filename]
-                    # Delete only one occurrence, hence the name try_delete_one
-                    return True
+            if self.index is None:
+                self.index = {}
+
+                for foccs in self.occs.itervalues():
+                    for ioccs in foccs.itervalues():
+                        for occ in ioccs:
+                            self.index.setdefault(self._make_key(occ),
+                                                                []).append(occ)
+
+            key = (filename, id_, start, end, alarm)
+
+            try:
+                matches = self.index[key]
+            except KeyError:
+                pass
+            else:
+                occd = matches.pop(0)
+
+                if not matches:
+                    del self.index[key]
+
+                # Remove exactly the indexed occurrence, not just an equal one
+                for index, occ in enumerate(occs):
+                    if occ is occd:
+                        del occs[index]
+                        break
+
+                if not occs:
+                    del self.occs[filename][id_]
+                    if not self.occs[filename]:
+                        del self.occs[filename]
+                # Delete only one occurrence, hence the name try_delete_one
+                return True
         # Do not try to update self.next (even in case there are no occurrences
         # left): this would let NextOccurrencesEngine reset the last search
         # time to this value, thus avoiding repeating this same procedure
@@ -269,11 +350,8 @@ class NextOccurrencesSearch(object):
                 utcbase = self.base_time - self.utcoffset.compute(
                                                                 self.base_time)
 
-                for row in organism_api.get_all_valid_item_rules(filename):
-                    id_ = row['R_id']
-                    rules = organism_api.convert_string_to_rules(
-                                                                row['R_rules'])
-
+                for id_, rules in organism_api.get_all_valid_item_rules(
+                                                                    filename):
                     for rule in rules:
                         self._search_item(filename, id_, rule, utcbase)
 
@@ -456,6 +534,20 @@ class NextOccurrencesEngine(object):
         self.thread = threading.Thread(target=int)
         self.queued = False
         self.timer = threading.Timer(0, int)
+        # Instead of searching all the rules at every restart, keep a schedule
+        # of the next occurrence time of each item: self.schedule maps
+        # (filename, id_) keys to (time, occurrences) tuples, while self.heap
+        # holds (time, filename, id_) entries, which are stale if they do not
+        # match self.schedule
+        self.schedule = {}
+        self.heap = []
+        # The databases that have been searched entirely
+        self.scanned = set()
+        # The items whose rules have changed since the last restart, see
+        # self.set_dirty
+        self.dirty = {}
+        self.dirty_lock = threading.Lock()
+        self.timezone = None
 
     def restart(self):
         # Allow only one restart request in the queue
@@ -468,6 +560,147 @@ class NextOccurrencesEngine(object):
             self.thread.name = "organism_engine"
             self.thread.start()
 
+    def set_dirty(self, filename, ids):
+        # This method can be called from other threads than the engine's
+        with self.dirty_lock:
+            try:
+                self.dirty[filename].update(ids)
+            except KeyError:
+                self.dirty[filename] = set(ids)
+
+    def _update_schedule(self, filenames, base_times):
+        # A timezone change affects the occurrences of all the rules
+        timezone = (time_.timezone, time_.altzone, time_.daylight)
+
+        if timezone != self.timezone:
+            self.timezone = timezone
+            self.scanned.clear()
+
+        with self.dirty_lock:
+            dirty = self.dirty
+            self.dirty = {}
+
+        for filename in self.scanned.difference(filenames):
+            self._unschedule_database(filename)
+
+        utcoffset = timeaux.UTCOffset()
+
+        for filename in filenames:
+            base_time = base_times[filename]
+            utcbase = base_time - utcoffset.compute(base_time)
+
+            if filename not in self.scanned:
+                # Search the whole database only when it is opened, or after
+                # a timezone change
+                self._unschedule_database(filename)
+
+                for id_, rules in organism_api.get_all_valid_item_rules(
+                                                                    filename):
+                    self._schedule_item(filename, id_, rules, base_time,
+                                                        utcbase, utcoffset)
+
+                self.scanned.add(filename)
+            else:
+                for id_ in dirty.get(filename, ()):
+                    self._schedule_item(filename, id_,
+                                organism_api.get_valid_item_rules(filename,
+                                id_), base_time, utcbase, utcoffset)
+
+        # Advance only the items whose next occurrence is not later than the
+        # last search time of their database, i.e. the ones that have just
+        # been activated
+        maxbase = max(base_times.itervalues()) if base_times else None
+        later = []
+
+        while self.heap and self.heap[0][0] <= maxbase:
+            entry = heapq.heappop(self.heap)
+            time, filename, id_ = entry
+
+            try:
+                if self.schedule[(filename, id_)][0] != time:
+                    continue
+            except KeyError:
+                continue
+
+            base_time = base_times[filename]
+
+            if time <= base_time:
+                self._schedule_item(filename, id_,
+                        organism_api.get_valid_item_rules(filename, id_),
+                        base_time, base_time - utcoffset.compute(base_time),
+                        utcoffset)
+            else:
+                later.append(entry)
+
+        for entry in later:
+            heapq.heappush(self.heap, entry)
+
+        # Remove the stale entries once in a while
+        if len(self.heap) > len(self.schedule) * 2 + 64:
+            self.heap = [(time, filename, id_) for (filename, id_),
+                                    (time, occs) in self.schedule.iteritems()]
+            heapq.heapify(self.heap)
+
+    def _schedule_item(self, filename, id_, rules, base_time, utcbase,
+                                                                utcoffset):
+        occs = NextOccurrences()
+
+        for rule in rules:
+            self.rule_handlers[rule['rule']](base_time, utcbase, utcoffset,
+                                                filename, id_, rule, occs)
+
+        time = occs.get_next_occurrence_time()
+
+        if time is None:
+            self.schedule.pop((filename, id_), None)
+        else:
+            # Note that the occurrences list can be empty if they have all
+            # been excepted, see NextOccurrences.except_safe
+            try:
+                itemoccs = occs.get_dict()[filename][id_]
+            except KeyError:
+                itemoccs = []
+
+            self.schedule[(filename, id_)] = (time, itemoccs)
+            heapq.heappush(self.heap, (time, filename, id_))
+
+    def _unschedule_database(self, filename):
+        # The heap entries are left to become stale
+        for key in [key for key in self.schedule if key[0] == filename]:
+            del self.schedule[key]
+
+        self.scanned.discard(filename)
+
+    def _get_next_occurrences(self, filenames, base_times):
+        occs = NextOccurrences()
+        entries = []
+
+        while self.heap:
+            time, filename, id_ = self.heap[0]
+
+            try:
+                sched = self.schedule[(filename, id_)]
+            except KeyError:
+                heapq.heappop(self.heap)
+                continue
+
+            if sched[0] != time:
+                heapq.heappop(self.heap)
+            elif occs.get_next_occurrence_time() in (None, time):
+                entries.append(heapq.heappop(self.heap))
+                occs.add_scheduled(time, filename, id_, sched[1])
+            else:
+                break
+
+        for entry in entries:
+            heapq.heappush(self.heap, entry)
+
+        for filename in filenames:
+            get_next_occurrences_event.signal(base_time=base_times[filename],
+                                                filename=filename, occs=occs)
+
+        return occs
+
     def _restart(self):
         # Note that this function must be kept separate from
         # NextOccurrencesSearch because the latter can be used without this
@@ -486,14 +719,19 @@ class NextOccurrencesEngine(object):
 
         base_times = {filename: self.databases[filename].get_last_search() for
                                                         filename in filenames}
+        search_start = (time_.time(), time_.clock())
+
         # For the moment there seems to be no need to stop the search if a
         # database is closed, in fact the databases are blocked, and the search
         # seems to terminate cleanly, and anyway it should take a reasonable
         # time to complete
-        search = NextOccurrencesSearch(filenames, self.rule_handlers,
-                                                        base_times=base_times)
-        search.start()
-        occs = search.get_results()
+        self._update_schedule(filenames, base_times)
+        occs = self._get_next_occurrences(filenames, base_times)
+
+        log.debug('Next occurrences found in {} (time) / {} (clock) s'.format(
+                                              time_.time() - search_start[0],
+                                              time_.clock() - search_start[1]))
+
         next_occurrence = occs.get_next_occurrence_time()
         occsd = occs.get_dict()
         oldoccsd = occs.get_old_dict()
@@ -17,10 +17,10 @@
 # along with Outspline.  If not, see <http://www.gnu.org/licenses/>.
 
 authors = ("Dario Giovannetti <dev@dariogiovannetti.net>", )
-version = "2.2"
+version = "3.0"
 description = ("Adds the backend for cutting, copying and pasting database "
                                                                     "items.")
 website = "https://kynikos.github.io/outspline/"
 affects_database = False
 provides_tables = ("Copy", )
-dependencies = (("core", 4), )
+dependencies = (("core", 5), )
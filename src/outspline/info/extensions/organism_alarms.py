@@ -17,13 +17,13 @@
 # along with Outspline.  If not, see <http://www.gnu.org/licenses/>.
 
 authors = ("Dario Giovannetti <dev@dariogiovannetti.net>", )
-version = "1.3"
+version = "2.0"
 description = "Adds the backend for managing alarm events."
 website = "https://kynikos.github.io/outspline/"
 affects_database = True
 provides_tables = ("AlarmsProperties", "Alarms", "CopyAlarms", "AlarmsOffLog")
-dependencies = (("core", 4), ("extensions.organism", 2),
+dependencies = (("core", 5), ("extensions.organism", 3),
                 ("extensions.organism_timer", 1))
-optional_dependencies = (("extensions.copypaste", 2), )
-database_dependency_group_1 = (("core", 4), ("extensions.organism", 2),
-        ("extensions.organism_timer", 1), ("extensions.organism_alarms", 1))
+optional_dependencies = (("extensions.copypaste", 3), )
+database_dependency_group_1 = (("core", 5), ("extensions.organism", 3),
+        ("extensions.organism_timer", 1), ("extensions.organism_alarms", 2))
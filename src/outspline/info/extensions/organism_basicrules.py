@@ -23,5 +23,5 @@ description = ("Adds the backend for calculating item events/tasks with basic "
 website = "https://kynikos.github.io/outspline/"
 affects_database = True
 provides_tables = ()
-dependencies = (("core", 4), ("extensions.organism", 2),
+dependencies = (("core", 5), ("extensions.organism", 3),
                 ("extensions.organism_timer", 1))
@@ -20,4 +20,4 @@ authors = ("Dario Giovannetti <dev@dariogiovannetti.net>", )
 version = "3.2"
 description = "A wxPython user interface for Outspline."
 website = "https://kynikos.github.io/outspline/"
-dependencies = (("core", 4), )
+dependencies = (("core", 5), )
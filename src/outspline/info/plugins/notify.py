@@ -21,5 +21,5 @@ version = "1.3"
 description = ("Shows a desktop notification whenever an item event/task "
                                                         "alarm is activated.")
 website = "https://kynikos.github.io/outspline/"
-dependencies = (("core", 4), ("extensions.organism_alarms", 1))
+dependencies = (("core", 5), ("extensions.organism_alarms", 2))
 optional_dependencies = (("interfaces.wxgui", 3), ("plugins.wxtrayicon", 1))
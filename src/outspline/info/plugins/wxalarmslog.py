@@ -20,5 +20,5 @@ authors = ("Dario Giovannetti <dev@dariogiovannetti.net>", )
 version = "1.3"
 description = "Adds a log the records alarm events"
 website = "https://kynikos.github.io/outspline/"
-dependencies = (("core", 4), ("extensions.organism_alarms", 1),
+dependencies = (("core", 5), ("extensions.organism_alarms", 2),
                 ("interfaces.wxgui", 3))
@@ -20,4 +20,4 @@ authors = ("Dario Giovannetti <dev@dariogiovannetti.net>", )
 version = "1.3"
 description = "Lets search for some item content in the databases."
 website = "https://kynikos.github.io/outspline/"
-dependencies = (("core", 4), ("interfaces.wxgui", 3))
+dependencies = (("core", 5), ("interfaces.wxgui", 3))
@@ -20,6 +20,6 @@ authors = ("Dario Giovannetti <dev@dariogiovannetti.net>", )
 version = "2.2"
 description = "Lets manage the scedule rules for items."
 website = "https://kynikos.github.io/outspline/"
-dependencies = (("core", 4), ("extensions.organism", 2),
+dependencies = (("core", 5), ("extensions.organism", 3),
                 ("interfaces.wxgui", 3))
 optional_dependencies = (("plugins.wxcopypaste", 1), )
@@ -20,6 +20,6 @@ authors = ("Dario Giovannetti <dev@dariogiovannetti.net>", )
 version = "1.3"
 description = "Adds the interface for creating some basic item schedule rules."
 website = "https://kynikos.github.io/outspline/"
-dependencies = (("core", 4), ("extensions.organism", 2),
+dependencies = (("core", 5), ("extensions.organism", 3),
                 ("extensions.organism_basicrules", 1), ("interfaces.wxgui", 3),
                 ("plugins.wxscheduler", 2))
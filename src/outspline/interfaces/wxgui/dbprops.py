@@ -40,11 +40,10 @@ class DatabasePropertyManager(object):
         # No need to also bind to "save as" because it closes and opens the
         # database anyway, thus also closing the property tab if open
         core_api.bind_to_save_database(self._handle_save_database)
-        core_api.bind_to_history_insert(self._handle_items_number)
-        core_api.bind_to_history_remove(self._handle_items_number)
+        core_api.bind_to_history_group(self._handle_items_number)
         core_api.bind_to_insert_item(self._handle_items_number)
-        core_api.bind_to_deleted_item(self._handle_items_number)
-        # No need to bind to pasting items
+        core_api.bind_to_insert_subtrees(self._handle_items_number)
+        core_api.bind_to_deleted_subtree(self._handle_items_number)
 
         databases.close_database_event.bind(self._handle_close_database)
 
@@ -41,6 +41,8 @@ dbs = {}
 class Item(object):
     # The DataViewModel needs proper objects; to *not* store simple integers
     # (e.g. the items' id's) or strings as items' objects
+    # The label is None until the item is shown for the first time, see
+    # Database.load_item_labels
     def __init__(self, id_, label, properties):
         self.id_ = id_
         self.label = label
@@ -63,9 +65,9 @@ class Item(object):
 
 
 class Model(dv.PyDataViewModel):
-    def __init__(self, data, filename):
+    def __init__(self, database, filename):
         super(Model, self).__init__()
-        self.data = data
+        self.database = database
         self.filename = filename
 
         # The wxPython demo uses weak references for the item objects: see if
@@ -86,7 +88,7 @@ class Model(dv.PyDataViewModel):
             pid = core_api.get_item_parent(self.filename, id_)
 
             if pid > 0:
-                return self.ObjectToItem(self.data[pid])
+                return self.ObjectToItem(self.database.get_item_data(pid))
             else:
                 return dv.NullDataViewItem
 
@@ -97,8 +99,13 @@ class Model(dv.PyDataViewModel):
             pid = self.ItemToObject(parent).get_id()
             ids = core_api.get_item_children(self.filename, pid)
 
+        # The children are about to be shown, so read all their labels at once
+        # instead of one by one when they're rendered
+        self.database.load_item_labels(ids)
+
         for id_ in ids:
-            children.append(self.ObjectToItem(self.data[id_]))
+            children.append(self.ObjectToItem(
+                                        self.database.get_item_data(id_)))
 
         return len(ids)
 
@@ -231,10 +238,9 @@ class Database(wx.SplitterWindow):
         # Initialize the tree only *after* instantiating the class (and
         # initilizing the icons), because actions like the creation of item
         # images rely on the filename to be in the dictionary
-        for row in core_api.get_all_items(self.filename):
-            self._init_item_data(row["I_id"], row["I_text"])
-
-        self.dvmodel = Model(self.data, self.filename)
+        # The items' data is created only when the items are requested by the
+        # model, so that opening a big database doesn't read all its texts
+        self.dvmodel = Model(self, self.filename)
         self.treec.AssociateModel(self.dvmodel)
         # According to DataViewModel's documentation (as of September 2014)
         # its reference count must be decreased explicitly to avoid memory
@@ -282,15 +288,11 @@ class Database(wx.SplitterWindow):
                                                         self._popup_item_menu)
 
         core_api.bind_to_insert_item(self._handle_insert_item)
+        core_api.bind_to_insert_subtrees(self._handle_insert_subtrees)
         core_api.bind_to_update_item_text(self._handle_update_item_text)
-        core_api.bind_to_deleting_item(self._handle_deleting_item)
-        core_api.bind_to_deleted_item_2(self._handle_deleted_item)
-        core_api.bind_to_history_insert(self._handle_history_insert)
-        core_api.bind_to_history_update_simple(
-                                            self._handle_history_update_simple)
-        core_api.bind_to_history_update_deep(self._handle_history_update_deep)
-        core_api.bind_to_history_update_text(self._handle_history_update_text)
-        core_api.bind_to_history_remove(self._handle_history_remove)
+        core_api.bind_to_deleting_subtree(self._handle_deleting_subtree)
+        core_api.bind_to_deleted_subtree(self._handle_deleted_subtree)
+        core_api.bind_to_history_group(self._handle_history_group)
         core_api.bind_to_history(self._handle_history)
 
     def _init_accelerators(self):
@@ -324,6 +326,18 @@ class Database(wx.SplitterWindow):
             parent = self.get_tree_item_safe(kwargs['parent'])
             self._insert_item(parent, kwargs['id_'], kwargs['text'])
 
+    def _handle_insert_subtrees(self, kwargs):
+        if kwargs['filename'] == self.filename:
+            for id_, text in kwargs['texts'].iteritems():
+                self._init_item_data(id_, text)
+
+            # The descendants are added to the model when their parents are
+            # expanded
+            parent = self.get_tree_item_safe(kwargs['parent'])
+
+            for id_ in kwargs['roots']:
+                self.dvmodel.ItemAdded(parent, self.get_tree_item(id_))
+
     def _handle_update_item_text(self, kwargs):
         # Don't update an item label only when editing the text area, as there
         # may be other plugins that edit an item's text (e.g links)
@@ -334,37 +348,34 @@ class Database(wx.SplitterWindow):
             self._set_item_label(id_, kwargs['text'])
             self.update_tree_item(id_)
 
-    def _handle_deleting_item(self, kwargs):
+    def _handle_deleting_subtree(self, kwargs):
         if kwargs['filename'] == self.filename:
+            # Removing the root item from the model removes also its
+            # descendants
             self._remove_item(kwargs['parent'], kwargs['id_'])
 
-    def _handle_deleted_item(self, kwargs):
+    def _handle_deleted_subtree(self, kwargs):
         if kwargs['filename'] == self.filename:
-            self._remove_item_data(kwargs['id_'])
+            for id_ in kwargs['texts']:
+                self._remove_item_data(id_)
 
-    def _handle_history_insert(self, kwargs):
+    def _handle_history_group(self, kwargs):
         if kwargs['filename'] == self.filename:
-            self._init_item_data(kwargs["id_"], kwargs["text"])
-            self._request_tree_reset()
+            changes = kwargs['changes']
 
-    def _handle_history_update_simple(self, kwargs):
-        if kwargs['filename'] == self.filename:
-            self._request_tree_reset()
+            for id_, text in changes['inserted'].iteritems():
+                self._init_item_data(id_, text)
 
-    def _handle_history_update_deep(self, kwargs):
-        if kwargs['filename'] == self.filename:
-            self._request_tree_reset()
+            for id_ in changes['deleted']:
+                self._remove_item_data(id_)
 
-    def _handle_history_update_text(self, kwargs):
-        if kwargs['filename'] == self.filename:
-            id_ = kwargs['id_']
-            self._set_item_label(id_, kwargs['text'])
-            self.request_item_refresh(id_)
+            for id_, text in changes['updated_text'].iteritems():
+                if id_ not in changes['deleted']:
+                    self._set_item_label(id_, text)
+                    self.request_item_refresh(id_)
 
-    def _handle_history_remove(self, kwargs):
-        if kwargs['filename'] == self.filename:
-            self._remove_item_data(kwargs['id_'])
-            self._request_tree_reset()
+            if changes['inserted'] or changes['deleted'] or changes['moved']:
+                self._request_tree_reset()
 
     def _request_tree_reset(self):
         self.history_tree_reset_request = True
@@ -506,11 +517,45 @@ class Database(wx.SplitterWindow):
     def _init_item_data(self, id_, text):
         label = self._make_item_label(text)
         multiline_bits, multiline_mask = \
-                    self.base_properties.get_item_multiline_state(text, label)
+                self.base_properties.get_item_multiline_state(text != label)
         properties = self._compute_property_bits(0, multiline_bits,
                                                                 multiline_mask)
         self.data[id_] = Item(id_, label, properties)
 
+    def get_item_data(self, id_):
+        try:
+            return self.data[id_]
+        except KeyError:
+            # The label is read only when the item is shown, but the
+            # properties can be updated before that, e.g. by the plugins when
+            # opening the database
+            item = self.data[id_] = Item(id_, None, 0)
+            return item
+
+    def load_item_labels(self, ids):
+        ids = [id_ for id_ in ids
+                                if self.get_item_data(id_).get_label() is None]
+
+        if ids:
+            headings = core_api.get_items_heading(self.filename, ids)
+
+            for id_, (label, multiline) in headings.iteritems():
+                self.data[id_].set_label(label)
+                multiline_bits, multiline_mask = \
+                    self.base_properties.get_item_multiline_state(multiline)
+                self.update_item_properties(id_, multiline_bits,
+                                                                multiline_mask)
+
+    def _get_loaded_item_data(self, id_):
+        item = self.get_item_data(id_)
+
+        if item.get_label() is None:
+            # The item may be shown without having been loaded with its
+            # siblings, e.g. if it's been selected programmatically
+            self.load_item_labels((id_, ))
+
+        return item
+
     def get_selections(self, none=True, many=True, descendants=None):
         selection = self.treec.GetSelections()
 
@@ -673,7 +718,8 @@ class Database(wx.SplitterWindow):
         self.dvmodel.ItemDeleted(parent, item)
 
     def _remove_item_data(self, id_):
-        del self.data[id_]
+        # The data of the items that have never been shown may not exist
+        self.data.pop(id_, None)
 
     def close(self):
         global dbs
@@ -698,7 +744,7 @@ class Database(wx.SplitterWindow):
         return self.dvmodel.ItemToObject(item).get_id()
 
     def get_tree_item(self, id_):
-        return self.dvmodel.ObjectToItem(self.data[id_])
+        return self.dvmodel.ObjectToItem(self.get_item_data(id_))
 
     def get_tree_item_safe(self, id_):
         if id_ > 0:
@@ -711,16 +757,17 @@ class Database(wx.SplitterWindow):
         return text.partition('\n')[0]
 
     def get_item_label(self, id_):
-        return self.data[id_].get_label()
+        return self._get_loaded_item_data(id_).get_label()
 
     def get_item_properties(self, id_):
-        return self.properties.get(self.data[id_].get_properties())
+        return self.properties.get(
+                            self._get_loaded_item_data(id_).get_properties())
 
     def _set_item_label(self, id_, text):
         label = self._make_item_label(text)
-        self.data[id_].set_label(label)
+        self.get_item_data(id_).set_label(label)
         multiline_bits, multiline_mask = \
-                    self.base_properties.get_item_multiline_state(text, label)
+                self.base_properties.get_item_multiline_state(text != label)
         self.update_item_properties(id_, multiline_bits, multiline_mask)
 
     @staticmethod
@@ -729,8 +776,9 @@ class Database(wx.SplitterWindow):
         return (old_property_bits & ~property_mask) | new_property_bits
 
     def update_item_properties(self, id_, property_bits, property_mask):
-        self.data[id_].set_properties(self._compute_property_bits(
-                self.data[id_].get_properties(), property_bits, property_mask))
+        item = self.get_item_data(id_)
+        item.set_properties(self._compute_property_bits(item.get_properties(),
+                                                property_bits, property_mask))
 
     def update_tree_item(self, id_):
         self.dvmodel.ItemChanged(self.get_tree_item(id_))
@@ -813,8 +861,8 @@ class DBProperties(object):
             self.multiline_shift, self.multiline_mask = properties.add(1,
                                                     multichar, bits_to_color)
 
-    def get_item_multiline_state(self, text, label):
-        if text != label:
+    def get_item_multiline_state(self, multiline):
+        if multiline:
             bits = 1 << self.multiline_shift
         else:
             bits = 0
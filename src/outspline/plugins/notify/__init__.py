@@ -45,11 +45,15 @@ class Notifications():
         self.ICON = "outspline-alarm"
         self.wxtrayicon_id = wxtrayicon_id
 
-        organism_alarms_api.bind_to_alarm(self._handle_alarm)
+        organism_alarms_api.bind_to_alarms_activated(self._handle_alarms)
 
-    def _handle_alarm(self, kwargs):
+    def _handle_alarms(self, kwargs):
         now = int(time.time()) // 60 * 60
 
+        for alarm in kwargs['alarms']:
+            self._notify(now, alarm)
+
+    def _notify(self, now, kwargs):
         # Don't notify for old alarms to avoid filling the screen with
         # notifications
         # Of course this check will prevent a valid notification if Outspline
@@ -123,8 +127,8 @@ class BlinkingTrayIcon():
 
         self._update_tooltip()
 
-        organism_alarms_api.bind_to_alarm(self._blink_after)
-        organism_alarms_api.bind_to_alarm_off(self._stop_after)
+        organism_alarms_api.bind_to_alarms_activated(self._blink_after)
+        organism_alarms_api.bind_to_alarms_off(self._stop_after)
         wxgui_api.bind_to_close_database(self._stop_after)
         core_api.bind_to_exit_app_2(self._exit)
 
@@ -133,7 +137,8 @@ class BlinkingTrayIcon():
         # signalled many times in a loop, so that self.blink is executed only
         # once after the last signal
         filename = kwargs['filename']
-        alarmid = kwargs['alarmid']
+        active_alarms = self.active_alarms.setdefault(filename, set())
+        alarmids = set(alarm['alarmid'] for alarm in kwargs['alarms'])
 
         # Keep track of the active alarms because the alarm event is signalled
         # every time occurrences are searched and old alarms are found, so not
@@ -141,13 +146,11 @@ class BlinkingTrayIcon():
         # are searched if there are already-open alarms
         # Do this check here and not in self._blink, otherwise only the last
         # handled alarm would be checked
-        if filename not in self.active_alarms:
-            self.active_alarms[filename] = [alarmid, ]
-        elif alarmid not in self.active_alarms[filename]:
-            self.active_alarms[filename].append(alarmid)
-        else:
+        if alarmids <= active_alarms:
             return False
 
+        active_alarms.update(alarmids)
+
         # self._blink_later uses wx.CallLater, which cannot be called from
         # other threads than the main one
         wx.CallAfter(self._blink_later)
@@ -175,12 +178,14 @@ class BlinkingTrayIcon():
             pass
         else:
             try:
-                alarmid = kwargs['alarmid']
+                alarmsd = kwargs['alarmsd']
             except KeyError:
-                # alarmid is not present when handling the database close event
+                # alarmsd is not present when handling the database close event
                 del self.active_alarms[filename]
             else:
-                self.active_alarms[filename].remove(alarmid)
+                for id_ in alarmsd:
+                    self.active_alarms[filename].difference_update(
+                                                                alarmsd[id_])
 
                 if len(self.active_alarms[filename]) == 0:
                     del self.active_alarms[filename]
@@ -213,7 +218,7 @@ class BlinkingTrayIcon():
     def _exit(self, kwargs):
         # Unbind the handlers whose timers could race with the application
         # closure
-        organism_alarms_api.bind_to_alarm_off(self._stop_after, False)
+        organism_alarms_api.bind_to_alarms_off(self._stop_after, False)
         wxgui_api.bind_to_close_database(self._stop_after, False)
         self.delay.Stop()
         self.sdelay.Stop()
@@ -106,8 +106,8 @@ class AlarmsWindow(object):
         wxgui_api.bind_to_menu(self.toggle_shown, self.menushow)
         wxgui_api.bind_to_menu_view_update(self._handle_menu_view_update)
 
-        organism_alarms_api.bind_to_alarm(self._handle_alarm)
-        organism_alarms_api.bind_to_alarm_off(self._handle_alarm_off)
+        organism_alarms_api.bind_to_alarms_activated(self._handle_alarms)
+        organism_alarms_api.bind_to_alarms_off(self._handle_alarms_off)
         wxgui_api.bind_to_close_database(self._handle_close_db)
 
     def _init_hidden_panel(self):
@@ -248,14 +248,13 @@ class AlarmsWindow(object):
 
             core_api.release_databases()
 
-    def _close_alarms(self, filename=None, id_=None, alarmid=None):
+    def _close_alarms(self, filename=None, alarmids=None):
         for a in self.alarms.keys():
             afilename = self.alarms[a].get_filename()
-            aitem = self.alarms[a].get_id()
             aid = self.alarms[a].get_alarmid()
 
-            if filename in (afilename, None) and id_ in (aitem, None) and \
-                                                        alarmid in (aid, None):
+            if filename in (afilename, None) and (alarmids is None or
+                                                            aid in alarmids):
                 self.alarms[a].close()
                 del self.alarms[a]
                 self.hiddenalarms.discard(a)
@@ -266,26 +265,26 @@ class AlarmsWindow(object):
     def _handle_close_db(self, kwargs):
         self._close_alarms(filename=kwargs['filename'])
 
-    def _handle_alarm(self, kwargs):
+    def _handle_alarms(self, kwargs):
         # Using CallAfter can cause (minor) bugs if the core timer is refreshed
         # in a loop (events could be displayed when not necessary...)
-        wx.CallAfter(self._append, **kwargs)
+        wx.CallAfter(self._append_many, kwargs['alarms'])
 
-    def _handle_alarm_off(self, kwargs):
-        filename = kwargs['filename']
-        if 'alarmid' in kwargs:
-            alarmid = kwargs['alarmid']
-            self._close_alarms(filename=filename, alarmid=alarmid)
-        else:
-            id_ = kwargs['id_']
-            self._close_alarms(filename=filename, id_=id_)
+    def _handle_alarms_off(self, kwargs):
+        alarmsd = kwargs['alarmsd']
+        alarmids = set(alarmid for id_ in alarmsd for alarmid in alarmsd[id_])
+        self._close_alarms(filename=kwargs['filename'], alarmids=alarmids)
+
+    def _append_many(self, alarms):
+        for alarm in alarms:
+            self._append(**alarm)
 
     def _append(self, filename, id_, alarmid, start, end, alarm):
         a = self.make_alarmid(filename, alarmid)
 
         # Check whether the database is still open because this method is
-        # called with wx.CallAfter in _handle_alarm, thus running in a
-        # different thread; this way it can happen that, when _handle_alarm is
+        # called with wx.CallAfter in _handle_alarms, thus running in a
+        # different thread; this way it can happen that, when _handle_alarms is
         # called, a database is still open, but when this method is called,
         # that database has been already closed; this would happen for example
         # when closing all the databases: after each database is closed (in
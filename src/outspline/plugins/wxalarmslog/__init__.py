@@ -150,16 +150,16 @@ class AlarmsLog(object):
 
         self.view.Bind(wx.dataview.EVT_DATAVIEW_ITEM_CONTEXT_MENU,
                                                                 popup_cmenu)
-        organism_alarms_api.bind_to_alarm_off(self._handle_alarm_off)
+        organism_alarms_api.bind_to_alarms_off(self._handle_alarms_off)
         wxgui_api.bind_to_close_database(self._handle_close_database)
 
         self._refresh()
 
-    def _handle_alarm_off(self, kwargs):
+    def _handle_alarms_off(self, kwargs):
         self._refresh()
 
     def _handle_close_database(self, kwargs):
-        organism_alarms_api.bind_to_alarm_off(self._handle_alarm_off, False)
+        organism_alarms_api.bind_to_alarms_off(self._handle_alarms_off, False)
 
     def is_shown(self):
         return self.view.IsShown()
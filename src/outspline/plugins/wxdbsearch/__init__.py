@@ -18,20 +18,22 @@
 
 import re
 import time
+import sre_parse
+import sre_constants
 import os.path
 import sys
 import threading
+import Queue as queue
 import wx
 from wx.lib.mixins.listctrl import ListCtrlAutoWidthMixin, ColumnSorterMixin
 
-from outspline.static.activestate.tco import tail_call_optimized
-
 from outspline.coreaux_api import log
 import outspline.coreaux_api as coreaux_api
 import outspline.core_api as core_api
 import outspline.interfaces.wxgui_api as wxgui_api
 
 import msgboxes
+import engine
 
 mainmenu = None
 searches = []
@@ -182,10 +184,9 @@ class SearchView(object):
             msgboxes.bad_regular_expression().ShowModal()
             self.finish_search()
         else:
-            # Note that the databases are released *before* the threads are
-            # terminated: this is safe as no more calls to the databases are
-            # made after core_api.get_all_items_text in
-            # self._finish_search_restart_database
+            # The first chunk of every database is retrieved immediately, the
+            # others are retrieved by self._fetch_next_chunk, which blocks the
+            # databases by itself
             if core_api.block_databases():
                 if self.filters.option1.GetValue():
                     filename = wxgui_api.get_selected_database_filename()
@@ -194,145 +195,153 @@ class SearchView(object):
                     for filename in core_api.get_open_databases():
                         self._finish_search_restart_database(filename, regexp)
 
-                # Note that the databases are released *before* the threads are
-                # terminated: this is safe as no more calls to the databases
-                # are made after core_api.get_all_items_text in
-                # self._finish_search_restart_database
                 core_api.release_databases()
             else:
                 self.finish_search()
 
     def _finish_search_restart_database(self, filename, regexp):
-        # It's not easy to benchmark the search for all the databases
-        # at once, as the searches are done in separate threads
-        search_start = (time.time(), time.clock())
-
-        # Retrieve all the rows immediately (based on fetchall()):
-        # retrieving row by row (based on fetchone()) would need
-        # querying the database in the thread, which would be faster
-        # but exposed to race conditions
-        rows = core_api.get_all_items_text(filename)
-        iterator = iter(rows)
+        # The options are read here because the wx objects must not be
+        # accessed from the search threads
+        # The process pool is only worth its overhead for big databases
+        search = engine.DatabaseSearch(filename, os.path.basename(filename),
+                    regexp, self._get_required_strings(regexp),
+                    self.filters.option2.GetValue(),
+                    self.filters.option3.GetValue(),
+                    engine.get_pool() if core_api.get_items_count(filename) >=
+                    engine.POOL_MIN_ITEMS else None)
 
         # A thread for each database is instantiated and started
-        thread = threading.Thread(
-                target=self._search_threaded_continue,
-                args=(regexp, filename, iterator, [], search_start))
-        thread.name = "wxdbsearch_{}".format(filename)
-        thread.start()
+        # The thread never queries the database, so it can be a daemon
+        search.thread = threading.Thread(target=self._search_threaded,
+                                                            args=(search, ))
+        search.thread.name = "wxdbsearch_{}".format(filename)
+        search.thread.daemon = True
+        search.thread.start()
         self.threads += 1
 
-    # use tail call optimization to avoid Python's limit to recursions
-    # (sys.getrecursionlimit()), which would lead to an exception in case of
-    # databases with more items than such limit
-    @tail_call_optimized
-    def _search_threaded_continue(self, regexp, filename, iterator, results,
-                                                                search_start):
-        try:
-            row = iterator.next()
-        except StopIteration:
-            log.debug('Search in {} completed in {} (time) / {} (clock) s'
-                                            ''.format(filename,
-                                            time.time() - search_start[0],
-                                            time.clock() - search_start[1]))
-
-            fname = os.path.basename(filename)
+        self._fetch_chunk(search)
 
-            # The gui must be updated in the main thread, so do it only once
-            # when the search is *finished* instead of calling CallAfter every
-            # time a match is found
-            wx.CallAfter(self.results.display, filename, fname, results)
+    def _fetch_next_chunk(self, search):
+        if not search.thread.is_alive():
+            # The search has been stopped
+            pass
+        elif search.chunks.full() or not core_api.block_databases(
+                                                                quiet=True):
+            wx.CallLater(int(engine.CHUNK_TIMEOUT * 1000),
+                                            self._fetch_next_chunk, search)
         else:
-            id_ = row['I_id']
-            text = row['I_text']
-
-            heading = text.partition('\n')[0]
-
-            try:
-                if self.filters.option2.GetValue():
-                    text = heading
-            except wx.PyDeadObjectError:
-                # If the application is closed while the search is ongoing,
-                #  this is where it would crash
-                # If there were more problems, consider running this thread as
-                #  a daemon
-                pass
-            else:
-                results = self._find_match_lines(regexp, id_, heading, text,
-                                                                    results)
+            self._fetch_chunk(search)
+            core_api.release_databases()
+
+    def _fetch_chunk(self, search):
+        # The rows are retrieved in the main thread, like all the other
+        # queries, one chunk at a time, so that the interface is never blocked
+        # for long and the search thread can start working on the first rows
+        # immediately
+        # The full-text index only returns the items that contain the literal
+        # parts of the expression, the regular expression is still needed to
+        # find the actual matches
+        if core_api.is_database_open(search.filename):
+            rows = core_api.search_items_text(search.filename,
+                                                search.strings,
+                                                start=search.last_id,
+                                                limit=engine.CHUNK_ROWS)
+        else:
+            rows = ()
 
-                # Use a recursion instead of a simple for loop, so that it will
-                # be easy to stop the search from the main thread if needed
-                self.search_threaded_action(regexp, filename, iterator,
-                                                        results, search_start)
+        if rows:
+            search.last_id = rows[-1]['I_id']
 
-    def _search_threaded_stop(self, regexp, filename, iterator, results,
-                                                                search_start):
-        log.debug('Search in {} stopped after {} (time) / {} (clock) s'
-                                            ''.format(filename,
-                                            time.time() - search_start[0],
-                                            time.clock() - search_start[1]))
+            # sqlite3.Row objects cannot be passed to the process pool
+            search.chunks.put([(row['I_id'], row['I_text']) for row in rows])
 
-        # The number of ongoing threads must be updated in the main thread
-        wx.CallAfter(self.finish_search)
+            wx.CallAfter(self._fetch_next_chunk, search)
+        else:
+            search.chunks.put(None)
+
+    @staticmethod
+    def _get_required_strings(regexp):
+        # Return the literal strings that any match of the regular expression
+        # must contain; the non-regex searches are escaped, so they are made
+        # of a single literal string
+        strings = []
+        chars = []
+
+        def walk(subpattern):
+            for opcode, argument in subpattern:
+                if opcode == sre_constants.LITERAL:
+                    chars.append(unichr(argument))
+                elif opcode == sre_constants.SUBPATTERN:
+                    # The contents of a group are part of the sequence
+                    walk(argument[-1])
+                else:
+                    # Anything else (alternatives, repetitions, character
+                    # classes...) may match different strings
+                    flush()
 
-    def _find_match_lines(self, regexp, id_, heading, text, results):
-        # I can't use a simple for loop because previous_line_index must be
-        # initialized at the first iteration
-        iterator = regexp.finditer(text)
+        def flush():
+            if chars:
+                strings.append(u''.join(chars))
+                del chars[:]
 
         try:
-            match = iterator.next()
-        except StopIteration:
+            walk(sre_parse.parse(regexp.pattern, regexp.flags))
+        except (sre_constants.error, ValueError):
+            # Fall back to searching all the items
+            return []
+
+        flush()
+        return strings
+
+    def _search_threaded(self, search):
+        # self.search_threaded_action is checked for every chunk, so that the
+        # search can be stopped from the main thread
+        while self.search_threaded_action(search):
             pass
-        else:
-            line, previous_line_end_index = self._find_match_line(text, 0,
-                                                                match.start())
-            results.append((id_, heading, line))
-
-            if not self.filters.option3.GetValue():
-                while True:
-                    try:
-                        match = iterator.next()
-                    except StopIteration:
-                        break
-                    else:
-                        # Don't use >= because if looking for an expression
-                        # that starts with '\n', the one starting at
-                        # previous_line_end_index (which is always a '\n'
-                        # character except at the last iteration) will have
-                        # been found at the previous iteration
-                        if match.start() > previous_line_end_index:
-                            line, previous_line_end_index = \
-                                        self._find_match_line(text,
-                                        previous_line_end_index, match.start())
-                            results.append((id_, heading, line))
-
-        return results
-
-    def _find_match_line(self, text, previous_line_end_index, match_start):
-        # Add 1 so that the line doesn't start with the '\n'
-        # If the first match is in the first line, rfind will return -1, so
-        # adding 1 will give 0 which is still the expected index
-        # For the matches after the first one (which are already filtered for
-        # being all on different lines) rfind will always find an index (and
-        # never return -1) because previous_line_end_index is always the index
-        # of a '\n' character
-        # If match_start is the index of a '\n' character, line_start will be
-        # the *previous* '\n' character, which is expected, as '\n' characters
-        # are considered to be part of the previous line (specifically its
-        # final character)
-        line_start = text.rfind('\n', previous_line_end_index, match_start) + 1
 
+    def _search_threaded_continue(self, search):
         try:
-            line_end = text.index('\n', line_start)
-        except ValueError:
-            # The match is in the last line
-            line_end = len(text)
+            rows = search.chunks.get(timeout=engine.CHUNK_TIMEOUT)
+        except queue.Empty:
+            # Check again whether the search has been stopped
+            continue_ = True
+        else:
+            if rows is None:
+                results = search.collect_results(True)
+                continue_ = False
+            else:
+                results = search.search_chunk(rows)
+                continue_ = True
+
+            # The gui must be updated in the main thread, so do it only once
+            # for every chunk instead of calling CallAfter every time a match
+            # is found
+            if results:
+                wx.CallAfter(self.results.display, search.filename,
+                                                        search.fname, results)
+
+            if not continue_:
+                log.debug('Search in {} completed in {} (time) / {} (clock) '
+                                        's'.format(search.filename,
+                                        time.time() - search.start[0],
+                                        time.clock() - search.start[1]))
+
+                # The number of ongoing threads must be updated in the main
+                # thread
+                wx.CallAfter(self.finish_search)
 
-        line = text[line_start:line_end]
+        return continue_
 
-        return (line, line_end)
+    def _search_threaded_stop(self, search):
+        log.debug('Search in {} stopped after {} (time) / {} (clock) s'
+                                            ''.format(search.filename,
+                                            time.time() - search.start[0],
+                                            time.clock() - search.start[1]))
+
+        # The number of ongoing threads must be updated in the main thread
+        wx.CallAfter(self.finish_search)
+
+        return False
 
 
 class SearchFilters(object):
@@ -439,16 +448,17 @@ class SearchResults(object):
 
     def display(self, filename, fname, results):
         # Even though this method is called with wx.CallAfter from
-        # self.listview._search_threaded_continue, which is running in a
+        # self.mainview._search_threaded_continue, which is running in a
         # different thread, there's no need to check that the databases and
         # items still exist, because they're not queried any more. Doing it
         # wouldn't make sense because then the search should be also refreshed
         # when closing a database, deleting items etc... Instead, perform those
         # checks when acting on the search results, e.g. with context-menu
         # actions
-        # Note that this method is called as many times as the open databases,
-        # because self.listview._search_threaded_continue is run separately for
-        # every database
+        # Note that this method is called for every chunk of rows that has
+        # some results, as soon as it has been searched, and for every open
+        # database, because self.mainview._search_threaded_continue is run
+        # separately for every database
         for result in results:
             id_, heading, line = result
 
@@ -466,8 +476,6 @@ class SearchResults(object):
             # requirements of ColumnSorterMixin
             self.datamap[index] = (fname, heading, line)
 
-        self.mainview.finish_search()
-
     def find_in_tree(self):
         sel = self.listview.GetFirstSelected()
 
@@ -711,3 +719,5 @@ def main():
     global nb_icon_refresh_index
     nb_icon_refresh_index = wxgui_api.add_right_nb_image(
                                     wxgui_api.get_notebook_icon('@refresh'))
+
+    core_api.bind_to_exit_app_1(engine.terminate_pool)
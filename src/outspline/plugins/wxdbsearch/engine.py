@@ -0,0 +1,193 @@
+# Outspline - A highly modular and extensible outliner.
+# Copyright (C) 2011-2014 Dario Giovannetti <dev@dariogiovannetti.net>
+#
+# This file is part of Outspline.
+#
+# Outspline is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Outspline is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Outspline.  If not, see <http://www.gnu.org/licenses/>.
+
+# This module must not depend on wx, because its functions are also run in the
+# processes of the pool
+
+import time
+import collections
+import multiprocessing
+import Queue as queue
+
+# The number of rows retrieved from a database at a time
+CHUNK_ROWS = 500
+# The maximum number of chunks retrieved in advance of the search thread
+QUEUED_CHUNKS = 8
+# The seconds after which the search thread stops waiting for a chunk and
+# checks whether the search has been stopped
+CHUNK_TIMEOUT = 0.1
+# The databases with fewer items are searched entirely in the search thread
+POOL_MIN_ITEMS = 20000
+# The first chunks are always searched in the search thread, so that the
+# first results are displayed without waiting for the processes of the pool
+LOCAL_CHUNKS = 2
+
+pool = None
+
+
+def get_pool():
+    # The pool is created only when a big database is searched for the first
+    # time, and then reused by all the following searches
+    global pool
+
+    if pool is None:
+        try:
+            processes = multiprocessing.cpu_count()
+        except NotImplementedError:
+            processes = 1
+
+        if processes > 1:
+            pool = multiprocessing.Pool(processes)
+
+    return pool
+
+
+def terminate_pool(kwargs):
+    global pool
+
+    if pool is not None:
+        pool.terminate()
+        pool.join()
+        pool = None
+
+
+class DatabaseSearch(object):
+    def __init__(self, filename, fname, regexp, strings, headings_only,
+                                                        one_per_item, pool):
+        self.filename = filename
+        self.fname = fname
+        self.regexp = regexp
+        self.strings = strings
+        self.headings_only = headings_only
+        self.one_per_item = one_per_item
+        self.pool = pool
+
+        # The chunks of (id, text) tuples are put in this queue by the main
+        # thread, and None marks the end of the database
+        self.chunks = queue.Queue(maxsize=QUEUED_CHUNKS)
+        self.last_id = 0
+        self.thread = None
+
+        # The results of the chunks, either lists or AsyncResult objects, in
+        # the order of the chunks
+        self.pending = collections.deque()
+        self.searched_chunks = 0
+
+        self.start = (time.time(), time.clock())
+
+    def search_chunk(self, rows):
+        # Return the results that are available so far, in order
+        if self.pool and self.searched_chunks >= LOCAL_CHUNKS:
+            self.pending.append(self.pool.apply_async(find_matches,
+                                        (self.regexp, self.headings_only,
+                                        self.one_per_item, rows)))
+        else:
+            self.pending.append(find_matches(self.regexp, self.headings_only,
+                                                    self.one_per_item, rows))
+
+        self.searched_chunks += 1
+
+        return self.collect_results(False)
+
+    def collect_results(self, wait):
+        results = []
+
+        while self.pending:
+            chunkresults = self.pending[0]
+
+            if isinstance(chunkresults, list):
+                results.extend(chunkresults)
+            elif wait or chunkresults.ready():
+                results.extend(chunkresults.get())
+            else:
+                break
+
+            self.pending.popleft()
+
+        return results
+
+
+def find_matches(regexp, headings_only, one_per_item, rows):
+    results = []
+
+    for id_, text in rows:
+        heading = text.partition('\n')[0]
+
+        if headings_only:
+            text = heading
+
+        _find_match_lines(regexp, id_, heading, text, one_per_item, results)
+
+    return results
+
+
+def _find_match_lines(regexp, id_, heading, text, one_per_item, results):
+    # I can't use a simple for loop because previous_line_index must be
+    # initialized at the first iteration
+    iterator = regexp.finditer(text)
+
+    try:
+        match = iterator.next()
+    except StopIteration:
+        pass
+    else:
+        line, previous_line_end_index = _find_match_line(text, 0,
+                                                                match.start())
+        results.append((id_, heading, line))
+
+        if not one_per_item:
+            while True:
+                try:
+                    match = iterator.next()
+                except StopIteration:
+                    break
+                else:
+                    # Don't use >= because if looking for an expression
+                    # that starts with '\n', the one starting at
+                    # previous_line_end_index (which is always a '\n'
+                    # character except at the last iteration) will have
+                    # been found at the previous iteration
+                    if match.start() > previous_line_end_index:
+                        line, previous_line_end_index = _find_match_line(text,
+                                        previous_line_end_index, match.start())
+                        results.append((id_, heading, line))
+
+
+def _find_match_line(text, previous_line_end_index, match_start):
+    # Add 1 so that the line doesn't start with the '\n'
+    # If the first match is in the first line, rfind will return -1, so
+    # adding 1 will give 0 which is still the expected index
+    # For the matches after the first one (which are already filtered for
+    # being all on different lines) rfind will always find an index (and
+    # never return -1) because previous_line_end_index is always the index
+    # of a '\n' character
+    # If match_start is the index of a '\n' character, line_start will be
+    # the *previous* '\n' character, which is expected, as '\n' characters
+    # are considered to be part of the previous line (specifically its
+    # final character)
+    line_start = text.rfind('\n', previous_line_end_index, match_start) + 1
+
+    try:
+        line_end = text.index('\n', line_start)
+    except ValueError:
+        # The match is in the last line
+        line_end = len(text)
+
+    line = text[line_start:line_end]
+
+    return (line, line_end)
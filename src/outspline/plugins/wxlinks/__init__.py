@@ -195,7 +195,8 @@ class TreeItemIcons(object):
 
             links_api.bind_to_upsert_link(self._handle_upsert_link)
             links_api.bind_to_delete_link(self._handle_delete_link)
-            links_api.bind_to_break_link(self._handle_break_links)
+            links_api.bind_to_delete_subtree_links(
+                                            self._handle_delete_subtree_links)
             links_api.bind_to_history_insert(self._handle_history)
             links_api.bind_to_history_update(self._handle_history)
             links_api.bind_to_history_delete(self._handle_history)
@@ -237,7 +238,8 @@ class TreeItemIcons(object):
         if kwargs['filename'] == self.filename:
             links_api.bind_to_upsert_link(self._handle_upsert_link, False)
             links_api.bind_to_delete_link(self._handle_delete_link, False)
-            links_api.bind_to_break_link(self._handle_break_links, False)
+            links_api.bind_to_delete_subtree_links(
+                                    self._handle_delete_subtree_links, False)
 
             wxgui_api.bind_to_open_database(self._handle_open_database, False)
             wxgui_api.bind_to_close_database(self._handle_close_database,
@@ -295,18 +297,23 @@ class TreeItemIcons(object):
             if core_api.is_item(self.filename, oldtarget):
                 self._reset_item(oldtarget)
 
-    def _handle_break_links(self, kwargs):
+    def _handle_delete_subtree_links(self, kwargs):
         if kwargs['filename'] == self.filename:
-            for id_ in kwargs['ids']:
-                backlinks = links_api.find_back_links(self.filename, id_)
-                rbits = 5 if len(backlinks) > 0 else 2
-                self._update_item(id_, rbits)
+            for ids in kwargs['broken'].itervalues():
+                for id_ in ids:
+                    backlinks = links_api.find_back_links(self.filename, id_)
+                    rbits = 5 if len(backlinks) > 0 else 2
+                    self._update_item(id_, rbits)
 
-            oldtarget = kwargs['oldtarget']
+            # The links' ids and targets may not exist anymore
+            for id_, oldtarget in kwargs['deleted'].iteritems():
+                if core_api.is_item(self.filename, id_):
+                    backlinks = links_api.find_back_links(self.filename, id_)
+                    rbits = 3 if len(backlinks) > 0 else 0
+                    self._update_item(id_, rbits)
 
-            # oldtarget may not exist anymore
-            if core_api.is_item(self.filename, oldtarget):
-                self._reset_item(oldtarget)
+                if core_api.is_item(self.filename, oldtarget):
+                    self._reset_item(oldtarget)
 
     def _handle_history(self, kwargs):
         if kwargs['filename'] == self.filename:
@@ -187,15 +187,17 @@ class TaskList(object):
         self.list_.refresh()
         self._update_tab_label()
 
-        organism_alarms_api.bind_to_alarm(self._update_tab_label_after)
-        organism_alarms_api.bind_to_alarm_off(self._update_tab_label)
+        organism_alarms_api.bind_to_alarms_activated(
+                                                self._update_tab_label_after)
+        organism_alarms_api.bind_to_alarms_off(self._update_tab_label)
         wxgui_api.bind_to_close_database(self._update_tab_label)
 
     def _disable(self):
         self.list_.disable_refresh()
 
-        organism_alarms_api.bind_to_alarm(self._update_tab_label_after, False)
-        organism_alarms_api.bind_to_alarm_off(self._update_tab_label, False)
+        organism_alarms_api.bind_to_alarms_activated(
+                                        self._update_tab_label_after, False)
+        organism_alarms_api.bind_to_alarms_off(self._update_tab_label, False)
         wxgui_api.bind_to_close_database(self._update_tab_label, False)
 
     def _handle_exit_application(self, kwargs):
@@ -0,0 +1,74 @@
+# Outspline - A highly modular and extensible outliner.
+# Copyright (C) 2011-2014 Dario Giovannetti <dev@dariogiovannetti.net>
+#
+# This file is part of Outspline.
+#
+# Outspline is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Outspline is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Outspline.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+from collections import OrderedDict
+
+
+class RangeCache(object):
+    def __init__(self, limit):
+        # The cache is shared by the refresh engine and the prefetch threads
+        self.lock = threading.Lock()
+
+        # The maximum total size of the cached results, measured in list
+        # items, which roughly determines the memory used by the cache
+        self.limit = limit
+        self.size = 0
+
+        # The results mapped by search window, from the least recently used
+        # to the most recently used
+        self.entries = OrderedDict()
+
+    def get(self, window, versions):
+        with self.lock:
+            try:
+                entryversions, size, results = self.entries.pop(window)
+            except KeyError:
+                return None
+
+            if entryversions != versions:
+                # The databases have changed since the results were cached, so
+                # they will never be used again
+                self.size -= size
+                return None
+
+            self.entries[window] = (entryversions, size, results)
+            return results
+
+    def set(self, window, versions, results, size):
+        with self.lock:
+            try:
+                oldsize = self.entries.pop(window)[1]
+            except KeyError:
+                pass
+            else:
+                self.size -= oldsize
+
+            if size > self.limit:
+                return
+
+            self.entries[window] = (versions, size, results)
+            self.size += size
+
+            while self.size > self.limit:
+                self.size -= self.entries.popitem(last=False)[1][1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
@@ -278,6 +278,21 @@ class Navigator(object):
     def get_default_configuration(self):
         return self.configuration.get_default()
 
+    def get_adjacent_configurations(self):
+        cconfig = self.configuration.get_current()
+        configs = []
+
+        for mode in (-1, 1):
+            try:
+                nconfig = self.configuration.compute_adjacent_configuration(
+                                                                cconfig, mode)
+            except SearchOutOfRangeError:
+                pass
+            else:
+                configs.append(nconfig)
+
+        return configs
+
     def save_configuration(self):
         self.config['show_navigator'] = 'yes' if self.is_shown() else 'no'
         self.configuration.clear_on_file()
@@ -349,6 +364,11 @@ class FilterConfiguration(object):
         self._set_current(nconfig)
         return nconfig
 
+    def compute_adjacent_configuration(self, config, mode):
+        # Unlike the methods above, do not change the current configuration
+        return self.modes_to_filters[config['mode']].compute_adjacent(config,
+                                                                        mode)
+
     def clear_on_file(self):
         # The DefaultFilter section must be reset (not simply upgraded) in the
         # configuration file, otherwise the old options will be left
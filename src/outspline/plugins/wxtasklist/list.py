@@ -17,13 +17,13 @@
 # along with Outspline.  If not, see <http://www.gnu.org/licenses/>.
 
 import wx
-from wx.lib.mixins.listctrl import ListCtrlAutoWidthMixin, ColumnSorterMixin
-import sys
+from wx.lib.mixins.listctrl import ListCtrlAutoWidthMixin
 import time as _time
 import datetime as _datetime
 import os
-import string as string_
 import threading
+import array
+import locale
 
 from outspline.static.pyaux.timeaux import TimeSpanFormatters
 from outspline.static.wxclasses.misc import NarrowSpinCtrl
@@ -38,19 +38,35 @@ import outspline.interfaces.wxgui_api as wxgui_api
 
 import filters
 import menus
+import cache
 from exceptions import SearchOutOfRangeError, ResultsOutOfRangeError
 
 
-class ListView(wx.ListView, ListCtrlAutoWidthMixin, ColumnSorterMixin):
-    def __init__(self, parent, colsn):
-        wx.ListView.__init__(self, parent, style=wx.LC_REPORT)
+class ListView(wx.ListView, ListCtrlAutoWidthMixin):
+    def __init__(self, parent, colsn, secondary_column):
+        # The list is virtual, so that only the rows that are actually
+        # visible are formatted, and sorting only permutes an index of the
+        # items, instead of moving the rows of the control
+        wx.ListView.__init__(self, parent,
+                                        style=wx.LC_REPORT | wx.LC_VIRTUAL)
         ListCtrlAutoWidthMixin.__init__(self)
-        ColumnSorterMixin.__init__(self, colsn)
+
+        self.secondary_column = secondary_column
+
+        # Reproduce the sort state of ColumnSorterMixin
+        self.sortcolumn = -1
+        self.sortflags = [0] * colsn
+
+        self.items = []
+        # The position in self.items of the item shown in each row
+        self.order = array.array('i')
+        # The sort keys are computed only once per column for every set of
+        # items, the first time that the items are sorted by that column
+        self.sortkeys = {}
 
         self._set_image_lists()
 
-    def GetListCtrl(self):
-        return self
+        self.Bind(wx.EVT_LIST_COL_CLICK, self._handle_column_click)
 
     def _set_image_lists(self):
         self.sortindices = []
@@ -60,8 +76,119 @@ class ListView(wx.ListView, ListCtrlAutoWidthMixin, ColumnSorterMixin):
         self.sortindices.append(imagelist.Add(sortdown))
         self.AssignImageList(imagelist, wx.IMAGE_LIST_SMALL)
 
-    def GetSortImages(self):
-        return self.sortindices
+    def OnGetItemText(self, row, column):
+        return self.items[self.order[row]].get_display_values()[column]
+
+    def OnGetItemImage(self, row):
+        return -1
+
+    def OnGetItemAttr(self, row):
+        return self.items[self.order[row]].get_attr()
+
+    def set_items(self, items):
+        self.items = items
+        self.sortkeys.clear()
+
+        # For a virtual list DeleteAllItems also resets the selection, like it
+        # used to happen when re-inserting all the rows
+        self.DeleteAllItems()
+        self._sort()
+        self.SetItemCount(len(items))
+
+    def get_item(self, row):
+        return self.items[self.order[row]]
+
+    def GetSortState(self):
+        return (self.sortcolumn, self.sortflags[self.sortcolumn])
+
+    def SortListItems(self, column=-1, ascending=1):
+        # Using (-1, -1) preserves the current sort column and order
+        oldcolumn = self.sortcolumn
+
+        if column != -1:
+            self.sortcolumn = column
+            self.sortflags[column] = ascending
+
+        self._sort_selected()
+        self._update_images(oldcolumn)
+
+    def _handle_column_click(self, event):
+        oldcolumn = self.sortcolumn
+        self.sortcolumn = column = event.GetColumn()
+        self.sortflags[column] = int(not self.sortflags[column])
+
+        self._sort_selected()
+        self._update_images(oldcolumn)
+
+        event.Skip()
+
+    def _sort_selected(self):
+        # The selection of a virtual list refers to the rows, so it must be
+        # moved to the new rows of the selected items
+        selected = set()
+        row = self.GetFirstSelected()
+
+        while row > -1:
+            selected.add(self.order[row])
+            self.Select(row, on=False)
+            row = self.GetNextSelected(row)
+
+        self._sort()
+
+        if selected:
+            for row, index in enumerate(self.order):
+                if index in selected:
+                    self.Select(row)
+
+        self.Refresh()
+
+    def _sort(self):
+        if self.sortcolumn == -1:
+            self.order = array.array('i', xrange(len(self.items)))
+        else:
+            keys = self._get_sort_keys(self.sortcolumn)
+            # Sorting in reverse order keeps the stability of the sort, so
+            # the order of identical items is the same in both directions
+            self.order = array.array('i', sorted(xrange(len(self.items)),
+                                key=keys.__getitem__,
+                                reverse=not self.sortflags[self.sortcolumn]))
+
+    def _get_sort_keys(self, column):
+        try:
+            return self.sortkeys[column]
+        except KeyError:
+            # Items with equal values are sorted by the secondary column, like
+            # with ColumnSorterMixin.GetSecondarySortValues
+            secondary = self.secondary_column
+            keys = []
+
+            for item in self.items:
+                values = item.get_comparison_values()
+                keys.append((_make_sort_key(values[column]),
+                                        _make_sort_key(values[secondary])))
+
+            self.sortkeys[column] = keys
+            return keys
+
+    def _update_images(self, oldcolumn):
+        if self.sortcolumn != -1:
+            if oldcolumn != -1:
+                self.ClearColumnImage(oldcolumn)
+
+            flag = self.sortflags[self.sortcolumn]
+            self.SetColumnImage(self.sortcolumn, self.sortindices[flag])
+
+
+def _make_sort_key(value):
+    # Strings are compared according to the locale like in
+    # ColumnSorterMixin, but with keys transformed only once
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+
+    if isinstance(value, str):
+        return locale.strxfrm(value)
+
+    return value
 
 
 class OccurrencesView(object):
@@ -97,17 +224,9 @@ class OccurrencesView(object):
         self.ALARM_COLUMN = 6
         COLUMNS_COUNT = 7
 
-        self.listview = ListView(self.tasklist.panel, COLUMNS_COUNT)
-
-        # Override ColumnSorterMixin's method for sorting items that have equal
-        # primary sort value
-        self.listview.GetSecondarySortValues = self._get_secondary_sort_values
-
-        # Defining an itemDataMap dictionary is required by ColumnSorterMixin
-        self.listview.itemDataMap = {}
-        # Create an alias for self.itemDataMap to save it from any future
-        # attribute renaming
-        self.datamap = self.listview.itemDataMap
+        # Items that have equal primary sort value are sorted by start time
+        self.listview = ListView(self.tasklist.panel, COLUMNS_COUNT,
+                                                            self.START_COLUMN)
 
         # No need to validate the values, as they are reset every time the
         # application is closed, and if a user edits them manually he knows
@@ -162,10 +281,6 @@ class OccurrencesView(object):
     def _init_context_menu(self, mainmenu):
         self.cmenu = menus.ListContextMenu(self.tasklist, mainmenu)
 
-    def _get_secondary_sort_values(self, col, key1, key2):
-        return (self.datamap[key1][self.START_COLUMN],
-                                        self.datamap[key2][self.START_COLUMN])
-
     def enable_refresh(self):
         self.refengine.enable()
 
@@ -186,77 +301,40 @@ class OccurrencesView(object):
         return self.active_alarms_modes[self.active_alarms_mode](min_time, now,
                                                                     max_time)
 
+    def get_adjacent_configurations(self):
+        return self.navigator.get_adjacent_configurations()
+
     def get_gaps_and_overlappings_setting(self):
         return (self.show_gaps, self.show_overlappings)
 
     def insert_items(self):
         # This method is always executed in the main thread, so there can't be
         #  races, except for self.occs that may be re-created meanwhile, but
-        #  it's enough to iterate over a copy
-        # Since self.datamap depends on self.occs, though, make sure to update
-        #  it here, and not in the search thread, or it will be subject to the
-        #  same race conditions as self.occs
-        self.datamap.clear()
-
+        #  it's enough to give the list a copy
         # Explicitly preserve the scrolled attribute of Autoscroll, because
         # DeleteAllItems generates EVT_SCROLLWIN that would always set it to
         # True
         scrolled = self.autoscroll.is_scrolled()
 
-        # The number of items should have been limited by RefreshEngine
+        # The number of items should have been limited by RefreshEngine,
+        #  however the list is virtual, so only the visible rows are ever
+        #  formatted, and sorting only permutes an index of the items
         if self.listview.GetItemCount() > 0:
             # Save the scroll y for restoring it after inserting the items
-            # I could instead save
-            #   self.listview.GetItemData(self.listview.GetTopItem()), but in
+            # I could instead save the item in the top row, but in
             #   case that disappears or moves in the list, the thing should
             #   start being complicated, and probably even confusing for the
             #   user
             # Note that self.listview.GetItemRect(0).GetY() gives a slightly
             # wrong value
             yscroll = abs(self.listview.GetItemPosition(0).y)
-            self.listview.DeleteAllItems()
         else:
             yscroll = 0
 
-        # Iterate over a copy of self.occs because it may be changed meanwhile
-        # by RefreshEngine
-        for i, item in enumerate(self.occs[:]):
-            # Splitting this part and calling with CallAfter directly from the
-            #  engine thread every time an occurrence is added to self.occs
-            #  doesn't make the interface responsive anyway, so just do
-            #  everything here
-
-            # Initialize the first column with an empty string
-            index = self.listview.InsertStringItem(sys.maxint, '')
-            self.listview.SetStringItem(index, self.DATABASE_COLUMN,
-                                                item.get_formatted_filename())
-            self.listview.SetStringItem(index, self.HEADING_COLUMN,
-                                                item.get_title())
-            self.listview.SetStringItem(index, self.START_COLUMN,
-                                                item.get_start_date())
-            self.listview.SetStringItem(index, self.DURATION_COLUMN,
-                                                item.get_duration())
-            self.listview.SetStringItem(index, self.END_COLUMN,
-                                                item.get_end_date())
-            self.listview.SetStringItem(index, self.STATE_COLUMN,
-                                                item.get_state())
-            self.listview.SetStringItem(index, self.ALARM_COLUMN,
-                                                item.get_alarm_date())
-
-            self.listview.SetItemTextColour(index, item.get_color())
-
-            # In order for ColumnSorterMixin to work, all items must have a
-            # unique data value
-            self.listview.SetItemData(index, i)
-
-            # Both the key and the values of self.datamap must comply with the
-            # requirements of ColumnSorterMixin
-            self.datamap[i] = item.get_comparison_values()
-
-        # Use SortListItems instead of occurrences.sort(), so that the heading
-        # will properly display the arrow icon
-        # Using (-1, -1) will preserve the current sort column and order
-        self.listview.SortListItems(-1, -1)
+        # Use a copy of self.occs because it may be changed meanwhile by
+        # RefreshEngine
+        # The items are sorted with the current sort column and order
+        self.listview.set_items(self.occs[:])
 
         # The list must be autoscrolled *after* sorting the items, so that the
         # correct y values will be got
@@ -272,9 +350,11 @@ class OccurrencesView(object):
     def get_shown_items_count(self):
         return self.listview.GetItemCount()
 
+    def get_item_by_position(self, pos):
+        return self.listview.get_item(pos)
+
     def get_item_values_by_position(self, pos):
-        return self.occs[self.listview.GetItem(pos).GetData()
-                                                        ].get_export_values()
+        return self.listview.get_item(pos).get_export_values()
 
     def get_active_alarms(self):
         return self.refengine.get_active_alarms()
@@ -284,7 +364,7 @@ class OccurrencesView(object):
         alarmsd = {}
 
         while sel > -1:
-            item = self.occs[self.listview.GetItemData(sel)]
+            item = self.listview.get_item(sel)
             filename = item.get_filename()
             id_ = item.get_id()
             alarmid = item.get_alarm_id()
@@ -316,7 +396,7 @@ class OccurrencesView(object):
         self.tasklist.set_tab_icon_stopped()
 
     def warn_limit_exceeded(self):
-        self.listview.DeleteAllItems()
+        self.listview.set_items([])
         self.tasklist.show_warning("Search results limit exceeded")
         self.tasklist.set_tab_icon_stopped()
 
@@ -363,7 +443,7 @@ class OccurrencesView(object):
 
             # Loop that selects a database tab (but doesn't select items)
             while sel > -1:
-                item = self.occs[self.listview.GetItemData(sel)]
+                item = self.listview.get_item(sel)
 
                 if item.get_filename() is not None:
                     wxgui_api.select_database_tab(item.get_filename())
@@ -375,7 +455,7 @@ class OccurrencesView(object):
             # Loop that doesn't select a database tab but selects items,
             # including the one found in the loop above
             while sel > -1:
-                item = self.occs[self.listview.GetItemData(sel)]
+                item = self.listview.get_item(sel)
 
                 if item.get_filename() is not None:
                     wxgui_api.add_item_to_selection(item.get_filename(),
@@ -387,7 +467,7 @@ class OccurrencesView(object):
         sel = self.listview.GetFirstSelected()
 
         while sel > -1:
-            item = self.occs[self.listview.GetItemData(sel)]
+            item = self.listview.get_item(sel)
 
             if item.get_filename() is not None:
                 wxgui_api.open_editor(item.get_filename(), item.get_id())
@@ -532,11 +612,38 @@ class RefreshEngine(object):
         self.occs = occs
         self.activealarms = {}
         self.TIMER_NAME = "wxtasklist_engine"
+        self.PREFETCH_NAME = "wxtasklist_prefetch"
         self.DELAY = config.get_int('refresh_delay')
         self.LIMIT = config.get_int('maximum_items')
         self.DEBUG_MODE = config.get_bool("debug_mode")
         self.pastN = 0
 
+        # The list items of the occurrences found by the previous refreshes,
+        # mapped by (filename, id_) keys, so that the items that change can be
+        # searched again and spliced into the results, without searching the
+        # whole time range
+        self.regularitems = {}
+        self.activeitems = {}
+        # The search parameters of the last complete refresh: the whole range
+        # is searched again only when they change, e.g. when the time window
+        # moves; None forces the next refresh to search the whole range
+        self.window = None
+        # The items that have changed since the last refresh, see
+        # self.set_dirty
+        self.dirty = {}
+        self.dirty_lock = threading.Lock()
+        # The number of changes of each database, also incremented by
+        # self.set_dirty, so that the cached results that were computed before
+        # a change are recognized as stale
+        self.versions = {}
+
+        # The items of the recently shown pages and of the pages adjacent to
+        # the current one, so that navigating the schedule back and forth
+        # doesn't search the same ranges again
+        self.cache = cache.RangeCache(config.get_int('maximum_cached_items'))
+        self.prefetchstop = threading.Event()
+        self.prefetchthread = None
+
         self.filterclasses = {
             'relative': filters.FilterRelative,
             'date': filters.FilterDate,
@@ -573,6 +680,10 @@ class RefreshEngine(object):
         # re-enable the tasklist when opening another database
         self.cancel()
 
+        # If the database is reopened, its cached items may not be valid
+        # anymore, e.g. if it was closed without saving
+        self.set_dirty(kwargs['filename'], ())
+
     def cancel(self):
         self.timer.cancel()
 
@@ -590,8 +701,32 @@ class RefreshEngine(object):
 
         self.cancel_request = False
 
+        self.prefetchstop.set()
+
+        try:
+            self.prefetchsearch.stop()
+        except AttributeError:
+            # The prefetch search may not have been initialized yet
+            pass
+
+        # Also wait for the prefetch thread, otherwise it may still be reading
+        # a database that is being closed
+        if self.prefetchthread is not None:
+            self.prefetchthread.join()
+            self.prefetchthread = None
+
     def enable(self):
+        # The events that are not signalled while the refresh is disabled may
+        # have changed any item
+        self.window = None
+        self.cache.clear()
+
         core_api.bind_to_update_item_text(self._delay_restart_on_text_update)
+        core_api.bind_to_history_group(self._handle_history_group)
+        organism_api.bind_to_update_valid_rules(
+                                            self._handle_update_valid_rules)
+        organism_alarms_api.bind_to_alarms_activated(
+                                            self._handle_alarms_activated)
         # The old occurrences are searched on a separate thread, so they may be
         # found *after* the next occurrences, so _delay_restart must be bound
         # to this one too
@@ -603,7 +738,7 @@ class RefreshEngine(object):
         # organism_timer_api.get_next_occurrences, otherwise this would make
         # self._refresh recur infinitely
         organism_timer_api.bind_to_search_next_occurrences(self._delay_restart)
-        organism_alarms_api.bind_to_alarm_off(self._delay_restart)
+        organism_alarms_api.bind_to_alarms_off(self._handle_alarms_off)
 
         core_api.bind_to_closing_database(self._handle_closing_database)
 
@@ -615,11 +750,16 @@ class RefreshEngine(object):
         # selecting it, which would make everything more sluggish
         core_api.bind_to_update_item_text(self._delay_restart_on_text_update,
                                                                         False)
+        core_api.bind_to_history_group(self._handle_history_group, False)
+        organism_api.bind_to_update_valid_rules(
+                                    self._handle_update_valid_rules, False)
+        organism_alarms_api.bind_to_alarms_activated(
+                                    self._handle_alarms_activated, False)
         organism_alarms_api.bind_to_activate_alarms_range_end(
                                                     self._delay_restart, False)
         organism_timer_api.bind_to_search_next_occurrences(self._delay_restart,
                                                                         False)
-        organism_alarms_api.bind_to_alarm_off(self._delay_restart, False)
+        organism_alarms_api.bind_to_alarms_off(self._handle_alarms_off, False)
         core_api.bind_to_closing_database(self._handle_closing_database, False)
 
     def set_filter(self, config):
@@ -644,9 +784,49 @@ class RefreshEngine(object):
 
         self.activealarms[filename][id_].append(alarmid)
 
+    def set_dirty(self, filename, ids):
+        # This method can be called from other threads than the engine's
+        with self.dirty_lock:
+            try:
+                self.dirty[filename].update(ids)
+            except KeyError:
+                self.dirty[filename] = set(ids)
+
+            self.versions[filename] = self.versions.get(filename, 0) + 1
+
+    def _get_versions(self, filenames):
+        # Call this method with self.dirty_lock acquired
+        return tuple(sorted((filename, self.versions.get(filename, 0))
+                                                    for filename in filenames))
+
     def _delay_restart_on_text_update(self, kwargs):
+        # Only the heading of the item has to be updated, but the item is
+        # searched again anyway, in order to keep a single way of updating
+        # the list
+        self.set_dirty(kwargs['filename'], (kwargs['id_'], ))
         self.delay_restart()
 
+    def _handle_history_group(self, kwargs):
+        # The list is refreshed by search_next_occurrences_event, which is
+        # signalled after every history action
+        self.set_dirty(kwargs['filename'],
+                                        kwargs['changes']['updated_text'])
+
+    def _handle_update_valid_rules(self, kwargs):
+        # The list is refreshed by search_next_occurrences_event, which is
+        # signalled after every change of rules
+        self.set_dirty(kwargs['filename'], kwargs['ids'])
+
+    def _handle_alarms_activated(self, kwargs):
+        # The list is refreshed by search_next_occurrences_event, which is
+        # signalled after activating the alarms
+        self.set_dirty(kwargs['filename'], [alarm['id_'] for alarm in
+                                                            kwargs['alarms']])
+
+    def _handle_alarms_off(self, kwargs):
+        self.set_dirty(kwargs['filename'], kwargs['alarmsd'])
+        self._delay_restart(kwargs)
+
     def _delay_restart(self, kwargs):
         # self.delay_restart uses wx.CallLater, which cannot be called from
         # other threads than the main one
@@ -688,7 +868,7 @@ class RefreshEngine(object):
             else:
                 wx.CallAfter(self.occview.reset_warnings)
                 try:
-                    delay = self._refresh_continue()
+                    delay, prefetch = self._refresh_continue()
                 except RefreshEngineStop:
                     wx.CallAfter(self.occview.set_tab_icon_stopped)
                 except RefreshEngineLimit:
@@ -701,13 +881,154 @@ class RefreshEngine(object):
                     # Since self._refresh_end (and so
                     # self.occview.insert_items) is always run in the main
                     # thread, there can't be races
-                    wx.CallAfter(self._refresh_end, delay)
+                    wx.CallAfter(self._refresh_end, delay, prefetch)
 
     def _refresh_continue(self):
+        filenames = organism_api.get_supported_open_databases()
+        in_range = self.occview.is_time_in_range(self.now, self.min_time,
+                                                                self.max_time)
+        window = self._make_window(self.min_time, self.max_time, filenames,
+                                                                    in_range)
+
+        with self.dirty_lock:
+            dirty = self.dirty
+            self.dirty = {}
+            versions = self._get_versions(filenames)
+
+        # If this refresh doesn't complete, the next one must search the
+        # whole range
+        lastwindow = self.window
+        self.window = None
+
+        if window == lastwindow:
+            try:
+                occsobj = self._refresh_items(dirty, filenames, in_range)
+            except RefreshEngineStop:
+                # Nothing has been changed yet
+                for filename in dirty:
+                    self.set_dirty(filename, dirty[filename])
+
+                self.window = lastwindow
+                raise
+        else:
+            results = self.cache.get(window, versions)
+
+            if results is None:
+                occsobj = self._refresh_all(filenames, in_range)
+            else:
+                self.regularitems, self.activeitems = results
+                self._update_states()
+                occsobj = _ListItemsRange(self.regularitems)
+
+        # Don't re-assign = [] or the other live references to the object won't
+        # be updated anymore (they'll still refer to the old object)
+        self.occs[:] = []
+        self.activealarms.clear()
+        self.pastN = 0
+
+        self.timealloc = TimeAllocation(self.min_time, self.max_time,
+                                                            self.occview, self)
+
+        for itemsd in (self.regularitems, self.activeitems):
+            for items in itemsd.itervalues():
+                for item in items:
+                    self.timealloc.compute_time_allocation(item.get_start(),
+                                                                item.get_end())
+                    self._insert_item(item)
+
+        self.timealloc.insert_gaps_and_overlappings()
+
+        delay = self.filter_.compute_delay(occsobj, self.now, self.min_time,
+                                                                self.max_time)
+
+        self.cache.set(window, versions, (self.regularitems, self.activeitems),
+                        self._count_items(self.regularitems, self.activeitems))
+        self.window = window
+
+        # Prefetch the adjacent pages only when the shown page has changed:
+        # the incremental refreshes are run after every change, and the
+        # prefetched pages would be made stale by the next change anyway
+        return (delay, window != lastwindow)
+
+    def _make_window(self, mint, maxt, filenames, in_range):
+        # A timezone change affects the occurrences of all the rules
+        return (mint, maxt, frozenset(filenames), in_range, _time.timezone,
+                                                _time.altzone, _time.daylight)
+
+    def _count_items(self, *itemsds):
+        return sum(len(items) for itemsd in itemsds
+                                            for items in itemsd.itervalues())
+
+    def _refresh_all(self, filenames, in_range):
         self.search = organism_api.get_occurrences_range(mint=self.min_time,
-                        maxt=self.max_time,
-                        filenames=organism_api.get_supported_open_databases())
+                                    maxt=self.max_time, filenames=filenames)
+        self._start_search()
 
+        occsobj = self.search.get_results()
+        occurrences = occsobj.get_list()
+
+        if len(occurrences) > self.LIMIT:
+            raise RefreshEngineLimit()
+
+        self.regularitems = {}
+        self.activeitems = {}
+
+        self._make_items(occurrences, self.regularitems)
+
+        # Always add active (but not snoozed) alarms if time interval includes
+        # current time
+        if in_range:
+            self._make_items(occsobj.get_active_list(), self.activeitems)
+
+        return occsobj
+
+    def _refresh_items(self, dirty, filenames, in_range):
+        # Only search the changed items of the databases that are still open
+        itemsd = {filename: dirty[filename] for filename in dirty
+                                                    if filename in filenames}
+        keys = set((filename, id_) for filename in itemsd
+                                                for id_ in itemsd[filename])
+
+        if itemsd:
+            self.search = organism_api.get_items_occurrences_range(
+                            mint=self.min_time, maxt=self.max_time,
+                            itemsd=itemsd)
+            self._start_search()
+
+            # The alarms are retrieved for all the items of the databases
+            occsobj = self.search.get_results()
+            occurrences = [occ for occ in occsobj.get_list()
+                                    if (occ['filename'], occ['id_']) in keys]
+            actives = [occ for occ in occsobj.get_active_list()
+                                    if (occ['filename'], occ['id_']) in keys]
+        else:
+            occurrences = []
+            actives = []
+
+        for key in keys:
+            self.regularitems.pop(key, None)
+            self.activeitems.pop(key, None)
+
+        # The states of the other items may have changed meanwhile
+        self._update_states()
+
+        self._make_items(occurrences, self.regularitems)
+
+        if in_range:
+            self._make_items(actives, self.activeitems)
+
+        if self._count_items(self.regularitems) > self.LIMIT:
+            raise RefreshEngineLimit()
+
+        return _ListItemsRange(self.regularitems)
+
+    def _update_states(self):
+        for itemsd in (self.regularitems, self.activeitems):
+            for items in itemsd.itervalues():
+                for item in items:
+                    item.update_state(self.now, self.formatter)
+
+    def _start_search(self):
         try:
             self.search.start()
         except:
@@ -727,30 +1048,57 @@ class RefreshEngine(object):
         if self.cancel_request:
             raise RefreshEngineStop()
 
-        occsobj = self.search.get_results()
-        occurrences = occsobj.get_list()
+    def _get_titles(self, occurrences):
+        # Read the headings of all the listed items with a few queries per
+        # database instead of one query per occurrence
+        idsd = {}
 
-        if len(occurrences) > self.LIMIT:
-            raise RefreshEngineLimit()
+        for occurrence in occurrences:
+            idsd.setdefault(occurrence['filename'], set()).add(
+                                                            occurrence['id_'])
 
-        # Always add active (but not snoozed) alarms if time interval includes
-        # current time
-        if self.occview.is_time_in_range(self.now, self.min_time,
-                                                                self.max_time):
-            occurrences.extend(occsobj.get_active_list())
+        titles = {}
 
-        # Don't re-assign = [] or the other live references to the object won't
-        # be updated anymore (they'll still refer to the old object)
-        self.occs[:] = []
-        self.activealarms.clear()
-        self.pastN = 0
+        for filename, ids in idsd.iteritems():
+            try:
+                headings = core_api.get_items_heading(filename, ids)
+            except KeyError:
+                # The database has been closed in the meantime
+                raise core_api.NonExistingItemError()
+
+            if len(headings) < len(ids):
+                # Some items have been deleted in the meantime
+                raise core_api.NonExistingItemError()
+
+            for id_, (heading, multiline) in headings.iteritems():
+                titles[(filename, id_)] = heading
+
+        return titles
+
+    def _make_item(self, occurrence, titles, now):
+        item = ListRegularItem(occurrence, titles[(occurrence['filename'],
+                                    occurrence['id_'])], now, self.formatter)
+
+        # The dates are normally formatted only when the item is displayed,
+        #  but if the end or the alarm time is outside the searchable range,
+        #  format them right away, so that the exceptions described in
+        #  self._make_items are raised here and not when drawing the list
+        for time in (item.get_end(), item.get_alarm()):
+            if time is not None and time is not False and not \
+                        self.filterlimits[0] <= time <= self.filterlimits[1]:
+                item.get_display_values()
+                break
 
-        self.timealloc = TimeAllocation(self.min_time, self.max_time,
-                                                            self.occview, self)
+        return item
+
+    def _make_items(self, occurrences, itemsd):
+        titles = self._get_titles(occurrences)
 
         try:
             for occurrence in occurrences:
-                self._insert_occurrence(occurrence)
+                item = self._make_item(occurrence, titles, self.now)
+                itemsd.setdefault((item.get_filename(), item.get_id()), []
+                                                                ).append(item)
         except:
             # If an item has a long duration or a very far alarm, the
             #  calculated occurrence secondary times (end and alarm) may go out
@@ -766,22 +1114,107 @@ class RefreshEngine(object):
             else:
                 raise ResultsOutOfRangeError()
 
-        self.timealloc.insert_gaps_and_overlappings()
+    def _refresh_end(self, delay, prefetch):
+        self.occview.insert_items()
+        self._restart(delay)
 
-        delay = self.filter_.compute_delay(occsobj, self.now, self.min_time,
-                                                                self.max_time)
+        if prefetch:
+            self._start_prefetch()
 
-        return delay
+    def _start_prefetch(self):
+        # The limits of the previous and next pages are computed here, in the
+        # main thread, because the navigator is not thread-safe
+        now = int(_time.time())
+        filenames = organism_api.get_supported_open_databases()
+        pages = []
 
-    def _refresh_end(self, delay):
-        self.occview.insert_items()
-        self._restart(delay)
+        with self.dirty_lock:
+            versions = self._get_versions(filenames)
 
-    def _insert_occurrence(self, occurrence):
-        item = ListRegularItem(occurrence, self, self.now, self.formatter)
-        self.timealloc.compute_time_allocation(item.get_start(),
-                                                                item.get_end())
-        self._insert_item(item)
+        for config in self.occview.get_adjacent_configurations():
+            try:
+                mint, maxt = self.filterclasses[config['mode']](config
+                                                        ).compute_limits(now)
+            except SearchOutOfRangeError:
+                continue
+
+            if mint < self.filterlimits[0] or maxt > self.filterlimits[1]:
+                continue
+
+            in_range = self.occview.is_time_in_range(now, mint, maxt)
+            window = self._make_window(mint, maxt, filenames, in_range)
+
+            if self.cache.get(window, versions) is None:
+                pages.append((mint, maxt, in_range, window))
+
+        if pages:
+            # A new event for every thread, so that a prefetch stopped by
+            # self.cancel can never be resumed
+            # The versions are taken *before* searching, so that the results
+            # are stale if the databases are changed during the search
+            # The databases can't be closed during the search, because
+            # self.cancel waits for the thread to finish
+            self.prefetchstop = threading.Event()
+            self.prefetchthread = threading.Thread(target=self._prefetch,
+                        args=(now, filenames, versions, pages,
+                        self.prefetchstop))
+            self.prefetchthread.name = self.PREFETCH_NAME
+            self.prefetchthread.daemon = True
+            self.prefetchthread.start()
+
+    def _prefetch(self, now, filenames, versions, pages, stop):
+        for mint, maxt, in_range, window in pages:
+            search = organism_api.get_occurrences_range(mint=mint, maxt=maxt,
+                                                        filenames=filenames)
+            self.prefetchsearch = search
+
+            if stop.is_set():
+                return
+
+            regularitems = {}
+            activeitems = {}
+
+            try:
+                search.start()
+                occsobj = search.get_results()
+                occurrences = occsobj.get_list()
+
+                if len(occurrences) > self.LIMIT:
+                    continue
+
+                # Always add active (but not snoozed) alarms if time interval
+                # includes current time, like in self._refresh_all
+                actives = occsobj.get_active_list() if in_range else []
+
+                titles = self._get_titles(occurrences + actives)
+
+                for occs, itemsd in ((occurrences, regularitems),
+                                                (actives, activeitems)):
+                    for occurrence in occs:
+                        if stop.is_set():
+                            return
+
+                        item = self._make_item(occurrence, titles, now)
+                        itemsd.setdefault((item.get_filename(),
+                                            item.get_id()), []).append(item)
+            except core_api.NonExistingItemError:
+                # Some items have been deleted during the search, so the
+                # results would be stale anyway
+                continue
+            except:
+                # Catch all the other exceptions for the same reasons as in
+                # self._start_search and self._make_items: the page will just
+                # be searched again when it's shown
+                if self.DEBUG_MODE:
+                    raise
+                else:
+                    continue
+
+            if stop.is_set():
+                return
+
+            self.cache.set(window, versions, (regularitems, activeitems),
+                                self._count_items(regularitems, activeitems))
 
     def insert_gap(self, start, end, minstart, maxend):
         item = ListAuxiliaryItem('[gap]', start, end, minstart, maxend, 'gap',
@@ -797,6 +1230,10 @@ class RefreshEngine(object):
         self.occs.append(item)
         self.pastN += item.get_past_count()
 
+        if item.get_alarm_id() is not None:
+            self.add_active_alarm(item.get_filename(), item.get_id(),
+                                                        item.get_alarm_id())
+
         # No point in inserting the item in the tasklist here with CallAfter,
         #  as it wouldn't make the interface responsive anyway
         # Also, don't even dream of updating ListCtrl's itemDataMap here,
@@ -814,13 +1251,11 @@ class TimeAllocation(object):
                             self.occview.get_gaps_and_overlappings_setting()
 
         if self.show_gaps or self.show_overlappings:
-            # Bit array that stores the minutes occupied by at least an
-            # occurrence
-            self.time_allocation = 0
-
-            # Bit array that stores the minutes occupied by at least two
-            # occurrences
-            self.time_allocation_overlap = 0
+            # The (minute, +1/-1) boundaries of the minutes occupied by the
+            # occurrences, counted from self.min_time; they are sorted only
+            # once, when finding the gaps and overlappings, so that the cost
+            # does not depend on the length of the search interval
+            self.boundaries = []
 
             self.compute_time_allocation = self._compute_time_allocation_real
             self.insert_gaps_and_overlappings = \
@@ -847,12 +1282,11 @@ class TimeAllocation(object):
             # Add 1 to self.max_time because if an occurrence is exceeding it,
             # it *is* occupying that minute too
             maxr = (min((end, self.max_time + 60)) - self.min_time) // 60
-            interval = maxr - minr
-            occrarr = 2 ** interval - 1
-            occarr = occrarr << minr
-            occoverlap = self.time_allocation & occarr
-            self.time_allocation |= occarr
-            self.time_allocation_overlap |= occoverlap
+
+            # An occurrence shorter than a minute may not occupy any
+            if maxr > minr:
+                self.boundaries.append((minr, 1))
+                self.boundaries.append((maxr, -1))
 
     def _compute_time_allocation_dummy(self, start, end):
         pass
@@ -868,55 +1302,78 @@ class TimeAllocation(object):
         # because that minute is *included* in the occurrence search interval
         interval = (self.max_time + 60 - self.min_time) // 60
 
+        # Sweep the boundaries in order, storing the number of occurrences
+        # occupying the minutes from each boundary to the next one
+        deltas = {}
+
+        for minute, delta in self.boundaries:
+            deltas[minute] = deltas.get(minute, 0) + delta
+
+        changes = []
+        count = 0
+
+        for minute in sorted(deltas):
+            count += deltas[minute]
+            changes.append((minute, count))
+
         if self.show_gaps:
-            gaps = '{:b}'.format(self.time_allocation).zfill(interval
-                                ).translate(string_.maketrans("10","01"))[::-1]
-            self._find_gaps_or_overlappings(gaps, self.refengine.insert_gap)
+            self._find_gaps_or_overlappings(changes, interval,
+                                                    lambda count: count == 0,
+                                                    self.refengine.insert_gap)
 
         if self.show_overlappings:
-            overlappings = '{:b}'.format(self.time_allocation_overlap).zfill(
-                                                                interval)[::-1]
-            self._find_gaps_or_overlappings(overlappings,
+            self._find_gaps_or_overlappings(changes, interval,
+                                            lambda count: count > 1,
                                             self.refengine.insert_overlapping)
 
     def _insert_gaps_and_overlappings_dummy(self):
         pass
 
-    def _find_gaps_or_overlappings(self, bitstring, call):
-        maxend = False
+    def _find_gaps_or_overlappings(self, changes, interval, test, call):
+        # A gap/overlapping can also start at the beginning of the interval
+        runstart = 0 if test(0) else None
 
-        # Find a gap/overlapping at the beginning of the interval separately
-        if bitstring[0] == '1':
-            bitstart = 0
+        for minute, count in changes:
+            if test(count):
+                if runstart is None:
+                    runstart = minute
+            elif runstart is not None:
+                if minute > runstart:
+                    self._find_gaps_or_overlappings_continue(runstart, minute,
+                                                            interval, call)
 
-            bitend, maxend = self._find_gaps_or_overlappings_continue(
-                                    bitstring, bitstart, True, maxend, call)
-        else:
-            bitend = 0
+                runstart = None
 
-        while True:
-            try:
-                bitstart = bitstring.index('01', bitend) + 1
-            except ValueError:
-                break
-            else:
-                bitend, maxend = self._find_gaps_or_overlappings_continue(
-                                    bitstring, bitstart, False, maxend, call)
+        if runstart is not None and runstart < interval:
+            self._find_gaps_or_overlappings_continue(runstart, interval,
+                                                            interval, call)
 
-    def _find_gaps_or_overlappings_continue(self, bitstring, bitstart,
-                                                    minstart, maxend, call):
-        try:
-            bitend = bitstring.index('10', bitstart) + 1
-        except ValueError:
-            bitend = len(bitstring)
-            maxend = True
+    def _find_gaps_or_overlappings_continue(self, minstart, minend, interval,
+                                                                        call):
+        start = minstart * 60 + self.min_time
+        end = minend * 60 + self.min_time
+
+        call(start, end, minstart == 0, minend >= interval)
 
-        start = bitstart * 60 + self.min_time
-        end = bitend * 60 + self.min_time
 
-        call(start, end, minstart, maxend)
+class _ListItemsRange(object):
+    # Replace the results of an occurrences search when computing the refresh
+    # delay after searching only some of the items
+    def __init__(self, itemsd):
+        self.itemsd = itemsd
 
-        return (bitend, maxend)
+    def get_next_completion_time(self):
+        # Like OccurrencesRange.get_next_completion_time
+        ctime = None
+
+        for items in self.itemsd.itervalues():
+            for item in items:
+                t = max((item.get_end(), item.get_start(), item.get_alarm()))
+
+                if t and (not ctime or t < ctime):
+                    ctime = t
+
+        return ctime
 
 
 class Formatter(object):
@@ -996,6 +1453,13 @@ class Formatter(object):
         self.colors['gap'] = colgap
         self.colors['overlapping'] = coloverlap
 
+        # The attributes of the rows of the virtual list must be kept alive
+        self.attrs = {}
+
+        for type_ in self.colors:
+            self.attrs[type_] = wx.ListItemAttr()
+            self.attrs[type_].SetTextColour(self.colors[type_])
+
     def get_start_format(self):
         return self.startformat
 
@@ -1008,6 +1472,9 @@ class Formatter(object):
     def get_color(self, type_):
         return self.colors[type_]
 
+    def get_attr(self, type_):
+        return self.attrs[type_]
+
     def format_database(self, filename):
         # This method is assigned dynamically
         pass
@@ -1158,6 +1625,31 @@ class Autoscroll(object):
 class _ListItem(object):
     # Virtual class
 
+    def _set_state(self, now):
+        mnow = now // 60 * 60
+
+        if mnow < self.start:
+            self.state = 'future'
+            self.stateid = 2
+            self.pastN = 0
+        # If end is None, as soon as the start time arrives, the
+        # occurrence is finished, so it can't have an 'ongoing' state and has
+        # to be be immediately marked as 'past'
+        # Besides, if an 'ongoing' state was set, e.g. for 1 minute from the
+        # start, the dynamic filter should be able to calculate the time to
+        # refresh the list in order to mark the occurrence as 'past', which
+        # wouldn't happen with the current implementation
+        # There's no need to test if end is None here, as mnow can be <
+        # end only if end is not None
+        elif self.start <= mnow < self.end:
+            self.state = 'ongoing'
+            self.stateid = 1
+            self.pastN = 0
+        else:
+            self.state = 'past'
+            self.stateid = 0
+            self.pastN = 1
+
     def get_filename(self):
         return self.filename
 
@@ -1180,22 +1672,30 @@ class _ListItem(object):
         return self.start
 
     def get_start_date(self):
-        return self.startdate
+        return self._get_dates()[0]
 
     def get_duration(self):
-        return self.durationstr
+        return self._get_dates()[1]
 
     def get_end(self):
         return self.end
 
     def get_end_date(self):
-        return self.enddate
+        return self._get_dates()[2]
 
     def get_state(self):
         return self.state
 
     def get_alarm_date(self):
-        return self.alarmdate
+        return self._get_dates()[3]
+
+    def _get_dates(self):
+        return self.dates
+
+    def get_display_values(self):
+        startdate, durationstr, enddate, alarmdate = self._get_dates()
+        return (self.fname, self.title, startdate, durationstr, enddate,
+                                                    self.state, alarmdate)
 
     def get_comparison_values(self):
         return (self.fname, self.title, self.start, self.duration, self.end,
@@ -1210,82 +1710,78 @@ class _ListItem(object):
             "alarm": self.alarm,
         }
 
-    def get_color(self):
-        return self.color
+    def get_attr(self):
+        return self.attr
 
     def get_past_count(self):
         return self.pastN
 
 
 class ListRegularItem(_ListItem):
-    def __init__(self, occ, refengine, now, formatter):
+    def __init__(self, occ, title, now, formatter):
         self.filename = occ['filename']
         self.id_ = occ['id_']
+        self.title = title
         self.start = occ['start']
         self.end = occ['end']
         self.alarm = occ['alarm']
+        self.formatter = formatter
 
         self.fname = formatter.format_database(self.filename)
 
-        mnow = now // 60 * 60
+        if self.end is not None:
+            self.duration = self.end - self.start
+        else:
+            self.duration = None
 
-        if mnow < self.start:
-            self.state = 'future'
-            self.stateid = 2
-            self.pastN = 0
-            self.color = formatter.get_color('future')
-        # If end is None, as soon as the start time arrives, the
-        # occurrence is finished, so it can't have an 'ongoing' state and has
-        # to be be immediately marked as 'past'
-        # Besides, if an 'ongoing' state was set, e.g. for 1 minute from the
-        # start, the dynamic filter should be able to calculate the time to
-        # refresh the list in order to mark the occurrence as 'past', which
-        # wouldn't happen with the current implementation
-        # There's no need to test if end is None here, as mnow can be <
-        # end only if end is not None
-        elif self.start <= mnow < self.end:
-            self.state = 'ongoing'
-            self.stateid = 1
-            self.pastN = 0
-            self.color = formatter.get_color('ongoing')
+        if self.alarm is False:
+            self.alarmid = occ['alarmid']
         else:
-            self.state = 'past'
-            self.stateid = 0
-            self.pastN = 1
-            self.color = formatter.get_color('past')
+            self.alarmid = None
+
+        # The date strings are formatted only when the item is displayed for
+        # the first time, since most of the items of a long list are never
+        # scrolled into view
+        self.dates = None
 
-        text = core_api.get_item_text(self.filename, self.id_)
-        self.title = text.partition('\n')[0]
+        self.update_state(now, formatter)
 
-        self.startdate = _time.strftime(formatter.get_start_format(),
+    def _get_dates(self):
+        if self.dates is None:
+            formatter = self.formatter
+            startdate = _time.strftime(formatter.get_start_format(),
                                                 _time.localtime(self.start))
 
-        if self.end is not None:
-            self.enddate = _time.strftime(formatter.get_end_format(),
+            if self.end is not None:
+                enddate = _time.strftime(formatter.get_end_format(),
                                                     _time.localtime(self.end))
-            self.duration = self.end - self.start
-            self.durationstr = formatter.format_duration(self.duration)
-        else:
-            self.enddate = ''
-            self.duration = None
-            self.durationstr = ''
+                durationstr = formatter.format_duration(self.duration)
+            else:
+                enddate = ''
+                durationstr = ''
+
+            if self.alarm is None:
+                alarmdate = ''
+            elif self.alarm is False:
+                alarmdate = 'active'
+            # Note that testing if isinstance(alarm, int) *before* testing if
+            # alarm is False would return True also when alarm is False!
+            else:
+                alarmdate = _time.strftime(formatter.get_alarm_format(),
+                                                _time.localtime(self.alarm))
 
-        if self.alarm is None:
-            self.alarmdate = ''
-            self.alarmid = None
-        elif self.alarm is False:
-            self.alarmdate = 'active'
-            self.alarmid = occ['alarmid']
-            refengine.add_active_alarm(self.filename, self.id_, self.alarmid)
-            # Note that the assignment of the active color must come after any
-            # previous color assignment, in order to override them
-            self.color = formatter.get_color('active')
-        # Note that testing if isinstance(alarm, int) *before* testing if
-        # alarm is False would return True also when alarm is False!
+            self.dates = (startdate, durationstr, enddate, alarmdate)
+
+        return self.dates
+
+    def update_state(self, now, formatter):
+        self._set_state(now)
+
+        if self.alarm is False:
+            # Note that the active color overrides the color of the state
+            self.attr = formatter.get_attr('active')
         else:
-            self.alarmdate = _time.strftime(formatter.get_alarm_format(),
-                                                _time.localtime(self.alarm))
-            self.alarmid = None
+            self.attr = formatter.get_attr(self.state)
 
 
 class ListAuxiliaryItem(_ListItem):
@@ -1300,30 +1796,17 @@ class ListAuxiliaryItem(_ListItem):
         self.alarm = None
         self.alarmid = None
 
-        self.color = formatter.get_color(type_)
-
-        mnow = now // 60 * 60
+        self.attr = formatter.get_attr(type_)
 
-        if mnow < self.start:
-            self.state = 'future'
-            self.stateid = 2
-            self.pastN = 0
-        elif self.start <= mnow < self.end:
-            self.state = 'ongoing'
-            self.stateid = 1
-            self.pastN = 0
-        else:
-            self.state = 'past'
-            self.stateid = 0
-            self.pastN = 1
+        self._set_state(now)
 
         if minstart:
             # Don't show the start date if the gap/overlapping is at the
             # beginning of the search interval, otherwise it should be updated
             # every minute
-            self.startdate = ''
+            startdate = ''
         else:
-            self.startdate = _time.strftime(formatter.get_start_format(),
+            startdate = _time.strftime(formatter.get_start_format(),
                                                 _time.localtime(self.start))
 
         # Do *not* merge this check with the others for minstart (above) and
@@ -1333,17 +1816,17 @@ class ListAuxiliaryItem(_ListItem):
             # the end of the search interval, otherwise it should be updated
             # every minute
             self.duration = None
-            self.durationstr = ''
+            durationstr = ''
         else:
             self.duration = self.end - self.start
-            self.durationstr = formatter.format_duration(self.duration)
+            durationstr = formatter.format_duration(self.duration)
 
         if maxend:
             # Don't show the end date if the gap/overlapping is at the end of
             # the search interval, otherwise it should be updated every minute
-            self.enddate = ''
+            enddate = ''
         else:
-            self.enddate = _time.strftime(formatter.get_end_format(),
+            enddate = _time.strftime(formatter.get_end_format(),
                                                     _time.localtime(self.end))
 
-        self.alarmdate = ''
+        self.dates = (startdate, durationstr, enddate, '')
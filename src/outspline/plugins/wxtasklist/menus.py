@@ -158,8 +158,7 @@ class MainMenu(wx.Menu):
                 self.dismiss.Enable(False)
 
                 while sel > -1:
-                    item = self.occview.occs[
-                                    self.occview.listview.GetItemData(sel)]
+                    item = self.occview.get_item_by_position(sel)
 
                     canbreak = 0
 
@@ -794,7 +793,7 @@ class ListContextMenu(wx.Menu):
         self.dismiss.Enable(False)
 
         while sel > -1:
-            item = self.occview.occs[self.occview.listview.GetItemData(sel)]
+            item = self.occview.get_item_by_position(sel)
 
             canbreak = 0
 